@@ -14,23 +14,23 @@ from evo.tools import plot, file_interface, log
 import torch
 import logging
 import re
-
-def get_frame_num_from_path(path):
-    frame_name = os.path.basename(path)
-    return int(re.sub('[^0-9]', '', frame_name))
+from optitrack_utils import FrameStore
+from optitrack_utils import PhotoAssociation
 
 class LocalizationClient:
-    def __init__(self, take_name, map_name, framerate, local_extractor, global_extractor, matcher):
+    def __init__(self, take_name, map_name, framerate, local_extractor, global_extractor, matcher,
+                 rigid_body_id=None, camera_latency=0.0):
         self.take_name = take_name
         self.map_name = map_name
         self.framerate = framerate
         self.local_extractor = local_extractor
         self.global_extractor = global_extractor
         self.matcher = matcher
+        self.rigid_body_id = rigid_body_id
+        self.camera_latency = camera_latency
 
     def run(self):
         print('Starting Localization')
-        img_dir = f'takes/{self.take_name}/frames'
         dataset_path = f'maps/{self.map_name}/hloc_data'
 
         # Load global memory - Common data across all maps
@@ -66,22 +66,38 @@ class LocalizationClient:
         db_image_names = np.array(list_h5_names(db_global_descriptors_path))
         db_global_descriptors = pairs_from_retrieval.get_descriptors(db_image_names, db_global_descriptors_path)
         db_global_descriptors = db_global_descriptors.to(device)
-        all_image_paths = sorted(Path(img_dir).glob('*.png'), key=get_frame_num_from_path)
-        frame_offset = get_frame_num_from_path(all_image_paths[0])
-        # random_sample = np.random.choice(all_image_paths, 20)
-        query_processing_data_dir = Path(img_dir)
+        # Photos from the take frame store, or its frames folder for older takes
+        frames = FrameStore.open_take_frames(f'takes/{self.take_name}')
+        frame_numbers = frames.get_frame_numbers()
+        frame_offset = frame_numbers[0]
+        # Pose at each photo's capture time, or for older takes the pose of the frame that triggered it
+        photo_poses = PhotoAssociation.associate_take(f'takes/{self.take_name}', self.rigid_body_id, self.camera_latency)
+        if photo_poses:
+            print('Photo to mocap association error, relative to the trigger frame:')
+            print(PhotoAssociation.format_association_stats(PhotoAssociation.get_association_stats(photo_poses)))
+            photo_poses = {photo_pose.frame_number: photo_pose for photo_pose in photo_poses}
+            time_offset = min(photo_pose.natnet_time for photo_pose in photo_poses.values())
+        # hloc reads query images from files, frame store images are extracted here one at a time
+        query_image_dir = Path(f'takes/{self.take_name}/localization/query_images')
         not_localized = []
         num_localized = 0
         os.makedirs(f'takes/{self.take_name}/localization', exist_ok=True)
 
         with open(f'takes/{self.take_name}/localization/localization_data.txt', 'w', newline='') as f:
-            for path in all_image_paths:
-                time = (get_frame_num_from_path(path) - frame_offset) / self.framerate
+            for frame_number in frame_numbers:
+                if photo_poses:
+                    if frame_number not in photo_poses:
+                        # No tracked pose around its capture time
+                        not_localized.append(frame_number)
+                        continue
+                    time = photo_poses[frame_number].natnet_time - time_offset
+                else:
+                    time = (frame_number - frame_offset) / self.framerate
                 try:
-                    img_name = os.path.basename(path)
+                    path = frames.extract(frame_number, query_image_dir)
                     ret, log = localize(
-                        query_processing_data_dir = query_processing_data_dir, 
-                        query_image_name = img_name, 
+                        query_processing_data_dir = path.parent, 
+                        query_image_name = path.name, 
                         device = device, 
                         local_feature_conf = local_feature_conf, 
                         local_features_extractor_model = local_features_extractor_model, 
@@ -100,19 +116,28 @@ class LocalizationClient:
                     f.write(f'{outstring}\n')
                     num_localized += 1
                 except:
-                    not_localized.append(get_frame_num_from_path(path))
+                    not_localized.append(frame_number)
             f.close()
-        with open(f'takes/{self.take_name}/optitrack_untimed.txt') as untimed, open(f'takes/{self.take_name}/optitrack_timed.txt', 'w', newline='') as timed:
-            num_read = 0
-            while (l := untimed.readline()) != '' and (num_read < num_localized):
-                row = l.split(' ')
-                time = (int(row[0]) - frame_offset) / self.framerate
-                if int(row[0]) not in not_localized and time >= 0.0:
-                    new = [time, row[1], row[2], row[3], row[4], row[5], row[6], row[7]]
-                    timed.write(' '.join(map(str, new)))
-                    num_read += 1
-            untimed.close()
-            timed.close()
+        if photo_poses:
+            with open(f'takes/{self.take_name}/optitrack_timed.txt', 'w', newline='') as timed:
+                for frame_number in frame_numbers:
+                    if frame_number not in not_localized:
+                        photo_pose = photo_poses[frame_number]
+                        new = [photo_pose.natnet_time - time_offset, *photo_pose.pos, *photo_pose.rot]
+                        timed.write(' '.join(map(str, new)) + '\n')
+        else:
+            with open(f'takes/{self.take_name}/optitrack_untimed.txt') as untimed, open(f'takes/{self.take_name}/optitrack_timed.txt', 'w', newline='') as timed:
+                num_read = 0
+                while (l := untimed.readline()) != '' and (num_read < num_localized):
+                    # frame number, pose, then rigid body ID and timestamp, see PoseLog.TEXT_COLUMNS
+                    row = l.split()
+                    time = (int(row[0]) - frame_offset) / self.framerate
+                    if int(row[0]) not in not_localized and time >= 0.0:
+                        new = [time, row[1], row[2], row[3], row[4], row[5], row[6], row[7]]
+                        timed.write(' '.join(map(str, new)) + '\n')
+                        num_read += 1
+                untimed.close()
+                timed.close()
         with open(f'takes/{self.take_name}/localization/frames_not_localized.txt', 'w') as f:
             f.write(str(not_localized))
             f.close()
@@ -139,8 +164,10 @@ def main():
     parser.add_argument('-l', type=str, metavar='LOCAL EXTRACTOR', default='superpoint_aachen', help='Only for localization. Default Superpoint Aachen')
     parser.add_argument('-g', type=str, metavar='GLOBAL EXTRACTOR', default='netvlad', help='Only for localization. Default Netvlad')
     parser.add_argument('-m', type=str, metavar='MATCHER', default='superglue', help='Only for localization. Default Superglue')
+    parser.add_argument('-r', type=int, metavar='RIGID BODY ID', default=None, help='Rigid body the camera is on. Default the lowest ID in the take')
+    parser.add_argument('--camera-latency', type=float, default=0.0, help='Seconds from exposure to the image being read. Default 0')
     args = parser.parse_args()
-    localizer = LocalizationClient(args.recording, args.map, args.f, args.l, args.g, args.m)
+    localizer = LocalizationClient(args.recording, args.map, args.f, args.l, args.g, args.m, args.r, args.camera_latency)
     localizer.run()
 
 if __name__ == '__main__':
@@ -1,17 +1,35 @@
-import cv2
 import sys
 import os
 import re
 import argparse
 import csv
 import threading
+import time
 from pynput import keyboard
 from pathlib import Path
 from optitrack_utils.NatNetClient import NatNetClient
+from optitrack_utils import NatNetCapture
+from optitrack_utils import PoseLog
+from optitrack_utils import CameraCapture
+from optitrack_utils import FrameStore
+from optitrack_utils import RatePolicy
 
 # This program grabs frame-by-frame pose information on a single from an Optitrack client using the NatNet SDK
-# While every Optitrack frame is recorded, the camera is read only every eigth frame.
-# File is saved on shutdown
+# While every Optitrack frame is recorded, photos are taken at --photo-rate, 60 Hz by default, every
+# fourth frame at 240 Hz. Frames are picked by NatNet timestamp, see RatePolicy; when the photo writers
+# fall behind the photo rate is reduced, and restored once they catch up, each change is written to
+# rate_policy.log in the take.
+# The camera is read on its own thread and photos are written by a pool of writer threads,
+# the NatNet listeners only queue a trigger so camera and disk never hold up decoding.
+# Photos go to one frames.nnframes container, JPEG by default, see FrameStore; --photos files
+# writes a photo_<frame>.png per photo to the frames folder instead
+# With several cameras each one has its own capture thread and its photos go to a camera_<source>
+# folder inside the take, laid out like a single camera take
+# Every photo of every camera is listed in photo_times.txt: frame number, camera, capture time on
+# the time.monotonic() clock and the NatNet frame that arrived nearest to it with its arrival time
+# and NatNet timestamp; PhotoAssociation matches photos to poses by capture time from these
+# Poses at --pose-rate are streamed to optitrack_untimed.txt while recording, see PoseLog
+# for the columns, and every frame of every recorded rigid body to optitrack.nntake, see NatNetTake
 # For .traj files, time is estimated based on frame number, with frame zero occuring at 0.00s
 # Frames are saved to folder
 # To run the client, simply run on command line
@@ -22,20 +40,81 @@ RECEIVING_CLIENT_ADDRESS = '127.0.0.1'
 OPTITRACK_SERVER_ADDRESS = '192.168.2.109'
 MULTICAST = True
 OPENCV_CAMERA_SOURCE = 0
+# Data socket SO_RCVBUF, room for a few seconds of frames while the decoder catches up
+RECEIVE_BUFFER_SIZE = 4*1024*1024
+# --photos choice writing one PNG file per photo
+PHOTO_FILES = 'files'
 
 # The Optitrack client saves both the camera and 
 class OptiTrackClient:
-    def __init__(self, cap_number, name):
-        self.capture = cv2.VideoCapture(cap_number)
+    def __init__(self, cameras, name, rigid_body=None, capture_file=None, replay_file=None,
+                 server_address=OPTITRACK_SERVER_ADDRESS, photo_storage=FrameStore.ENCODING_JPEG,
+                 fsync_policy=PoseLog.FSYNC_INTERVAL, pose_rate=RatePolicy.DEFAULT_POSE_RATE,
+                 photo_rate=RatePolicy.DEFAULT_PHOTO_RATE, min_photo_rate=RatePolicy.DEFAULT_MIN_PHOTO_RATE):
+        if isinstance(cameras, (str, int)):
+            cameras = [cameras]
+        # One capture thread, photo folder and frame store per camera
+        self.cameras = []
+        self.camera_dirs = []
+        self.frame_stores = []
+        for camera_num, source in enumerate(cameras):
+            camera_name = 'camera_' + re.sub('[^0-9A-Za-z]+', '_', str(source)).strip('_')
+            camera_dir = Path(f'takes/{name}')
+            if len(cameras) > 1:
+                camera_dir = camera_dir / camera_name
+            os.makedirs(camera_dir / 'frames', exist_ok=True)
+            self.camera_dirs.append(camera_dir)
+            self.cameras.append(CameraCapture.CameraCaptureThread(
+                source, camera_name, on_photo=lambda camera_image, frame_numbers, camera_num=camera_num:
+                    self.on_photo(camera_num, camera_image, frame_numbers)))
+            if photo_storage != PHOTO_FILES:
+                self.frame_stores.append(FrameStore.FrameStoreWriter(camera_dir / FrameStore.TAKE_FRAMES_FILE, photo_storage))
+        # Photos are keyed by ( camera number, frame number ), written to a frame store or one file each
+        self.photo_writer = CameraCapture.PhotoWriterPool(num_writers=CameraCapture.DEFAULT_WRITERS * len(self.cameras),
+                                                          writer=self.write_photo, on_written=self.on_photo_written)
+        # Host time of every NatNet frame, for the frame nearest to each photo
+        self.frame_timeline = CameraCapture.FrameTimeline()
+        # ( frame number, camera name, capture time, nearest NatNet frame, its host time and NatNet timestamp )
+        # of every photo written, see PhotoAssociation
+        self.photo_times = []
         self.is_recording = False
         self.frame_number = None
-        self.rigid_body_positions = []
         self.lock = threading.Lock()
         self.natnet = None
         self.recording_name = name
+        # Rigid body ID or name to record, None records every rigid body
+        self.rigid_body = rigid_body
+        # Raw NatNet packets are written to capture_file, or read from replay_file instead of the network
+        self.capture_file = capture_file
+        self.replay_file = replay_file
+        self.stop_replay = False
+        self.server_address = server_address
+        # Pose logs written in the background while recording
+        self.fsync_policy = fsync_policy
+        self.pose_log = None
+        self.take_log = None
+        # ( id, position, rotation ) of the frame being decoded
+        self.frame_rigid_bodies = []
+        # Which frames log a pose and trigger a photo, created when recording starts
+        self.pose_rate = pose_rate
+        self.photo_rate = photo_rate
+        self.min_photo_rate = min_photo_rate
+        self.rate_policy = None
         os.makedirs(f'takes/{self.recording_name}', exist_ok=True)
 
     def start_recording(self):
+        if self.pose_log is None:
+            self.pose_log = PoseLog.PoseLogWriter(Path(f'takes/{self.recording_name}') / 'optitrack_untimed.txt',
+                                                  PoseLog.FORMAT_TEXT, self.fsync_policy)
+            self.take_log = PoseLog.PoseLogWriter(Path(f'takes/{self.recording_name}') / 'optitrack.nntake',
+                                                  PoseLog.FORMAT_TAKE, self.fsync_policy,
+                                                  nat_net_version=(self.natnet.get_major(), self.natnet.get_minor(), 0, 0))
+            self.rate_policy = RatePolicy.RatePolicy(self.pose_rate, self.photo_rate, self.min_photo_rate,
+                                                     log_file_name=Path(f'takes/{self.recording_name}') / 'rate_policy.log')
+        if self.replay_file is not None:
+            self.is_recording = True
+            print(f'Recording started.')
+            return
         return_code = self.natnet.send_command('SetPlaybackStartFrame=0')
         if return_code == -1:
             print('Failed to start recording')
@@ -47,63 +126,107 @@ class OptiTrackClient:
         self.is_recording = False
         print(f'Recording stopped.')
 
-    def take_photo(self):
-        ret, frame = self.capture.read()
-        if ret:
-            photo_filename = f'photo_{self.frame_number}.png'
-            cv2.imwrite(Path(f'takes/{self.recording_name}/frames') / photo_filename, frame)
-            print(f'Saved {photo_filename}')
-
-    def record_position(self, rigid_body):
-        if self.frame_number % 4 == 0:
-            position_data = {
-                'frame_number': self.frame_number,
-                'data': rigid_body
-            }
-            self.rigid_body_positions.append(position_data)
-            print(f'Recorded pose for frame {self.frame_number}: {rigid_body}')
+    # Called on a camera thread with the first image grabbed after the triggers
+    def on_photo(self, camera_num, camera_image, frame_numbers):
+        for frame_number in frame_numbers:
+            self.photo_writer.submit((camera_num, frame_number), camera_image)
+
+    # Called on a writer thread, to the camera frame store or for --photos files to an image file
+    def write_photo(self, key, camera_image):
+        camera_num, frame_number = key
+        if self.frame_stores:
+            self.frame_stores[camera_num].write_photo(frame_number, camera_image)
+        else:
+            photo_filename = FrameStore.get_image_name(frame_number)
+            CameraCapture.write_image(self.camera_dirs[camera_num] / 'frames' / photo_filename, camera_image.image)
+
+    # Called on a writer thread once a photo is written
+    def on_photo_written(self, key, camera_image):
+        camera_num, frame_number = key
+        nearest = self.frame_timeline.nearest(camera_image.capture_time)
+        if nearest is None:
+            nearest = (-1, 0.0, 0.0)
+        with self.lock:
+            self.photo_times.append((frame_number, camera_image.camera_name, camera_image.capture_time) + nearest)
+        print(f'Saved {camera_image.camera_name} photo for frame {frame_number}')
+
+    def record_position(self, timestamp, rigid_body_id, position, rotation, keep_pose):
+        self.take_log.add(self.frame_number, timestamp, rigid_body_id, position, rotation)
+        if keep_pose:
+            self.pose_log.add(self.frame_number, timestamp, rigid_body_id, position, rotation)
+            print(f'Recorded pose for frame {self.frame_number}: {position + rotation}')
 
     # Frame listener attached to NatNet client
     def on_frame(self, data_dict):
+        frame_time = time.monotonic()
         with self.lock:
             # print('frame has lock')
             self.frame_number = data_dict['frame_number']
-            if self.is_recording and self.frame_number % 4 == 0:
-                self.take_photo()
+            self.frame_timeline.add(frame_time, self.frame_number, data_dict['timestamp'])
+            if self.is_recording:
+                keep_pose = self.rate_policy.keep_pose(data_dict['timestamp'])
+                for rigid_body_id, position, rotation in self.frame_rigid_bodies:
+                    self.record_position(data_dict['timestamp'], rigid_body_id, position, rotation, keep_pose)
+                self.update_rate_policy()
+                if self.rate_policy.keep_photo(data_dict['timestamp']):
+                    for camera in self.cameras:
+                        camera.trigger(self.frame_number)
+            self.frame_rigid_bodies.clear()
+
+    # Slow the photo rate down while the photo writers or cameras are behind, checked about once a second
+    def update_rate_policy(self):
+        photo_counters = self.photo_writer.get_counters()
+        camera_backlog = max(camera.get_counters()['pending'] for camera in self.cameras)
+        self.rate_policy.update(photo_counters['pending'] / photo_counters['queue_size'],
+                                photo_counters['dropped'], camera_backlog)
 
     # Rigid body listener attached to NatNet client
     def on_rigid_body(self, id, position, rotation):
         with self.lock:
             # print('rigid body has lock')
-            rigid_body_data = position + rotation
             if self.is_recording:
-                self.record_position(rigid_body_data)
+                # Rigid bodies come before their frame, recorded with its number and timestamp in on_frame
+                self.frame_rigid_bodies.append((id, position, rotation))
 
-    def write_txt(self):
-        with open(Path(f'takes/{self.recording_name}') / 'optitrack_untimed.txt', 'w', newline='') as f:
-            for entry in self.rigid_body_positions:
-                row = [entry['frame_number']] + list(entry['data'])
-                line = ' '.join(map(str, row))
-                f.write(f'{line}\n')
-            f.close()
+    def write_photo_times(self):
+        with open(Path(f'takes/{self.recording_name}') / 'photo_times.txt', 'w', newline='') as f:
+            for frame_number, camera_name, capture_time, nearest_frame_number, frame_time, timestamp in sorted(self.photo_times):
+                f.write(f'{frame_number} {camera_name} {capture_time:.6f} {nearest_frame_number} {frame_time:.6f} {timestamp:.6f}\n')
 
     def run(self):
         # Create and configure the NatNet client
         client = NatNetClient()
         self.natnet = client
         client.new_frame_listener = self.on_frame
-        client.rigid_body_listener = self.on_rigid_body
+        if self.rigid_body is None:
+            client.rigid_body_listener = self.on_rigid_body
+        elif self.rigid_body.isdigit():
+            client.subscribe_rigid_body(int(self.rigid_body), self.on_rigid_body)
+        else:
+            client.subscribe_rigid_body_name(self.rigid_body, self.on_rigid_body)
         client.set_client_address(RECEIVING_CLIENT_ADDRESS)
-        client.set_server_address(OPTITRACK_SERVER_ADDRESS)
+        client.set_server_address(self.server_address)
         client.set_use_multicast(MULTICAST)
+        client.set_receive_buffer_size(RECEIVE_BUFFER_SIZE)
+        client.set_use_fast_decoder(True)
+        # Only rigid bodies are recorded, skip the rest of each frame
+        client.set_decode_sections(['rigid_bodies'])
 
         # Make directories to save data and check camera function
-        os.makedirs(f'takes/{self.recording_name}/frames/', exist_ok=True)
         self.natnet.set_print_level(0)
-        if not self.capture.isOpened():
-            print("Could not open camera.")
-            os._exit(1)
+        for camera in self.cameras:
+            if not camera.start():
+                print(f"Could not open {camera.name}.")
+                os._exit(1)
         
+        if self.replay_file is not None:
+            threading.Thread(target=NatNetCapture.replay_capture,
+                             args=(self.replay_file, client, 1.0, lambda: self.stop_replay)).start()
+            return
+
+        if self.capture_file is not None:
+            client.start_capture(self.capture_file)
+
         # Start NatNet client
         is_running = client.run()
         if not is_running:
@@ -112,9 +235,34 @@ class OptiTrackClient:
 
     # Closes the NatNet client and saves data based on file option
     def shutdown(self):
+        # Outside the lock, the photo writers take it to log each photo
+        for camera in self.cameras:
+            camera.stop()
+        self.photo_writer.close()
+        for frame_store in self.frame_stores:
+            frame_store.close()
         with self.lock:
-            self.write_txt()
-            self.natnet.shutdown()
+            # Everything but the last batch is on disk already
+            if self.pose_log is not None:
+                self.pose_log.close()
+                self.take_log.close()
+                self.rate_policy.close()
+            self.write_photo_times()
+            if self.replay_file is not None:
+                self.stop_replay = True
+            else:
+                self.natnet.shutdown()
+            stats = self.natnet.stats()
+            print(f'NatNet frames: {stats["frames_received"]} received, {stats["frames_missing"]} missing, '
+                  f'{stats["frames_out_of_order"]} out of order, {stats["packets_dropped"]} dropped, '
+                  f'decode p99 {stats["decode_ms"].get("p99_ms", 0.0):.3f} ms')
+            photo_counters = self.photo_writer.get_counters()
+            print(f'Photos: {photo_counters["written"]} written, {photo_counters["dropped"]} dropped, '
+                  f'{photo_counters["errors"]} failed')
+            if self.rate_policy is not None:
+                rate_counters = self.rate_policy.get_counters()
+                print(f'Photo rate: {rate_counters["reductions"]} reductions, {rate_counters["restores"]} restores, '
+                      f'ended at {RatePolicy.format_rate(rate_counters["photo_rate"])} Hz')
             print("shut off")
 
     def on_press(self, key):
@@ -137,10 +285,32 @@ def main():
                                     This applet records optitrack data concurrently with camera frames.
                                     
                                     Frames and data are saved to folder of same name as provided recording.''')
-    parser.add_argument('camera', type=str, help='Camera Source Number')
+    parser.add_argument('cameras', type=str, nargs='+',
+                        help='Camera source numbers or device paths, one capture thread each')
     parser.add_argument('name', type=str, help='Name of recording')
+    parser.add_argument('-r', '--rigid-body', type=str, default=None,
+                        help='ID or name of the rigid body to record. Default records every rigid body')
+    parser.add_argument('--capture', type=str, default=None,
+                        help='Also write the raw NatNet packets to this capture file')
+    parser.add_argument('--replay', type=str, default=None,
+                        help='Replay a NatNet capture file instead of connecting to Motive')
+    parser.add_argument('--server', type=str, default=OPTITRACK_SERVER_ADDRESS,
+                        help='Motive or NatNetSimulator address. Default ' + OPTITRACK_SERVER_ADDRESS)
+    parser.add_argument('--photos', type=str, default=FrameStore.ENCODING_JPEG,
+                        choices=FrameStore.ENCODINGS + [PHOTO_FILES],
+                        help='Store photos in one frames container as jpeg, png or raw images, '
+                             'or as one PNG file each with files. Default ' + FrameStore.ENCODING_JPEG)
+    parser.add_argument('--fsync', type=str, default=PoseLog.FSYNC_INTERVAL, choices=PoseLog.FSYNC_POLICIES,
+                        help='How often pose logs are forced to disk. Default ' + PoseLog.FSYNC_INTERVAL)
+    parser.add_argument('--pose-rate', type=float, default=RatePolicy.DEFAULT_POSE_RATE,
+                        help='Poses per second in optitrack_untimed.txt, 0 for every frame. Default %g'%RatePolicy.DEFAULT_POSE_RATE)
+    parser.add_argument('--photo-rate', type=float, default=RatePolicy.DEFAULT_PHOTO_RATE,
+                        help='Target photos per second, 0 for every frame. Default %g'%RatePolicy.DEFAULT_PHOTO_RATE)
+    parser.add_argument('--min-photo-rate', type=float, default=RatePolicy.DEFAULT_MIN_PHOTO_RATE,
+                        help='Lowest photo rate when the photo writers fall behind. Default %g'%RatePolicy.DEFAULT_MIN_PHOTO_RATE)
     args = parser.parse_args()
-    client = OptiTrackClient(args.camera, args.name)
+    client = OptiTrackClient(args.cameras, args.name, args.rigid_body, args.capture, args.replay, args.server,
+                             args.photos, args.fsync, args.pose_rate or None, args.photo_rate or None, args.min_photo_rate)
     threading.Thread(target=client.listen_for_keypress).start()
     client.run()
 
@@ -3,6 +3,7 @@ import pycolmap
 from hloc.hloc.utils import viz_3d
 import numpy as np
 from pathlib import Path
+from optitrack_utils import FrameStore
 
 def get_frame_num_from_time(first_frame, time, base=4):
     return first_frame + round(base * round(time/base), 2)
@@ -10,7 +11,9 @@ def get_frame_num_from_time(first_frame, time, base=4):
 if __name__ == '__main__':
     take_name = input('Take name: ')
     start_frame = int(input('First frame number: '))
-    query_processing_data_dir = Path(take_name) / 'frames'
+    # Photos from the take frame store or frames folder, pycolmap reads them from image files
+    frames = FrameStore.open_take_frames(take_name)
+    query_image_dir = Path(take_name) / 'localization' / 'query_images'
     dataset_name = 'Arena'
     dataset_path = f'/home/hwillia2/Desktop/spatial/optitrack_benchmarking_utils/maps/{dataset_name}/hloc_data'
     dataset = Path(dataset_path)
@@ -32,13 +35,15 @@ if __name__ == '__main__':
     random_sample = sorted(np.random.choice(len(localization), 30))
     for num in random_sample:
         lrow = localization[num]
-        query_image_name = f'photo_{get_frame_num_from_time(start_frame, lrow[0])}.png'
-        camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+        query_image_path = frames.extract(get_frame_num_from_time(start_frame, lrow[0]), query_image_dir)
+        query_image_name = query_image_path.name
+        camera = pycolmap.infer_camera_from_image(query_image_path)
         pose = pycolmap.Image(tvec=[lrow[1], lrow[2], lrow[3]], qvec=[lrow[4], lrow[5], lrow[6], lrow[7]])
         viz_3d.plot_camera_colmap(fig1, pose, camera, color='rgba(100,255,100,0.5)', name=query_image_name, fill=True)
         orow = optitrack[num]
-        query_image_name = f'photo_{get_frame_num_from_time(start_frame, orow[0])}.png'
-        camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+        query_image_path = frames.extract(get_frame_num_from_time(start_frame, orow[0]), query_image_dir)
+        query_image_name = query_image_path.name
+        camera = pycolmap.infer_camera_from_image(query_image_path)
         pose = pycolmap.Image(tvec=[orow[1], orow[2], orow[3]], qvec=[orow[4], orow[5], orow[6], orow[7]])
         viz_3d.plot_camera_colmap(fig1, pose, camera, color='rgba(255,100,100,0.5)', name=query_image_name, fill=True)
     fig1.add_trace(go.Scatter3d(
@@ -73,8 +78,9 @@ if __name__ == '__main__':
     viz_3d.plot_reconstruction(fig2, reconstruction, color='rgba(255,0,0,0.5)', points_rgb=True, cameras = False)
     for num in random_sample:
         lrow = localization[num]
-        query_image_name = f'photo_{get_frame_num_from_time(start_frame, lrow[0])}.png'
-        camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+        query_image_path = frames.extract(get_frame_num_from_time(start_frame, lrow[0]), query_image_dir)
+        query_image_name = query_image_path.name
+        camera = pycolmap.infer_camera_from_image(query_image_path)
         pose = pycolmap.Image(tvec=[lrow[1], lrow[2], lrow[3]], qvec=[lrow[4], lrow[5], lrow[6], lrow[7]])
         viz_3d.plot_camera_colmap(fig2, pose, camera, color='rgba(100,255,100,0.5)', name=query_image_name, fill=True)
         orow = optitrack[num]
@@ -2,10 +2,12 @@ import cv2
 import os
 import glob
 import re
+import time
+from optitrack_utils import CameraCapture
 
 def list_camera_files(dev_folder):
     # Use glob to find all image files in the dev folder
-    image_files = glob.glob(os.path.join(dev_folder, '/video*'))
+    image_files = glob.glob(os.path.join(dev_folder, 'video*'))
     return image_files
 
 def extract_camera_indices(filenames):
@@ -15,21 +17,30 @@ def extract_camera_indices(filenames):
         indices.append(int(re.sub('[^0-9]', '', filename)))
     return indices
 
-def capture_images(cameras):
+def capture_images(cameras, test_time=2.0):
     output_dir = "camera_captures"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    # All cameras run at once, as bm_record drives them, each on its own capture thread
+    threads = {}
     for cam_index in cameras:
-        cap = cv2.VideoCapture(cam_index, cv2.CAP_V4L2)
-        ret, frame = cap.read()
-        if ret:
+        thread = CameraCapture.CameraCaptureThread(cv2.VideoCapture(cam_index, cv2.CAP_V4L2), f"camera_{cam_index}")
+        if thread.start():
+            threads[cam_index] = thread
+        else:
+            print(f"Failed to open camera {cam_index}")
+    time.sleep(test_time)
+    for cam_index, thread in threads.items():
+        camera_image = thread.get_latest()
+        thread.stop()
+        if camera_image is not None:
             filename = f"{output_dir}/camera_{cam_index}.jpg"
-            cv2.imwrite(filename, frame)
-            print(f"Captured image from camera {cam_index} and saved to {filename}")
+            cv2.imwrite(filename, camera_image.image)
+            print(f"Captured image from camera {cam_index} and saved to {filename}, "
+                  f"{thread.get_counters()['grabbed'] / test_time:.1f} fps")
         else:
             print(f"Failed to capture image from camera {cam_index}")
-        cap.release()
 
 def main():
     dev_folder = '/dev'  # Change this to the folder where your camera image files are stored
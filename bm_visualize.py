@@ -2,6 +2,7 @@ import plotly.graph_objects as go
 import pycolmap
 from hloc.hloc.utils import viz_3d
 from pathlib import Path
+from optitrack_utils import FrameStore
 
 def get_frame_num_from_time(first_frame, time, base=4):
     return first_frame + round(base * round(time/base), 2)
@@ -9,7 +10,9 @@ def get_frame_num_from_time(first_frame, time, base=4):
 if __name__ == '__main__':
     take_name = input('Take name: ')
     start_frame = int(input('First frame number: '))
-    query_processing_data_dir = Path(take_name) / 'frames'
+    # Photos from the take frame store or frames folder, pycolmap reads them from image files
+    frames = FrameStore.open_take_frames(take_name)
+    query_image_dir = Path(take_name) / 'localization' / 'query_images'
     dataset_name = '2300Area'
     dataset_path = f'/home/hwillia2/Desktop/spatial/optitrack_benchmarking_utils/maps/{dataset_name}/colmap_known_poses/sparse/0'
     dataset = Path(dataset_path)
@@ -24,8 +27,8 @@ if __name__ == '__main__':
         counto = 0
         while (line := l.readline()) != '':
             row = list(map(float, line.split(' ')))
-            query_image_name = f'photo_{get_frame_num_from_time(start_frame, row[0])}.png'
-            camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+            query_image_path = frames.extract(get_frame_num_from_time(start_frame, row[0]), query_image_dir)
+            camera = pycolmap.infer_camera_from_image(query_image_path)
             pose = pycolmap.Image(tvec=[row[1], row[2], row[3]], qvec=[row[4], row[5], row[6], row[7]])
             viz_3d.plot_camera_colmap(fig1, pose, camera, color='rgba(100,255,100,0.5)', name='%.2f' % row[0], fill=True)
             # countl += 1
@@ -33,8 +36,8 @@ if __name__ == '__main__':
                 break
         while (line := o.readline()) != '':
             row = list(map(float, line.split(' ')))
-            query_image_name = f'photo_{get_frame_num_from_time(start_frame, row[0])}.png'
-            camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+            query_image_path = frames.extract(get_frame_num_from_time(start_frame, row[0]), query_image_dir)
+            camera = pycolmap.infer_camera_from_image(query_image_path)
             pose = pycolmap.Image(tvec=[row[1], row[2], row[3]], qvec=[row[4], row[5], row[6], row[7]])
             viz_3d.plot_camera_colmap(fig1, pose, camera, color='rgba(255,100,100,0.5)', name='%.2f' % row[0], fill=True)
             # counto += 1
@@ -73,8 +76,8 @@ if __name__ == '__main__':
     with open(f'{take_name}/localization/localization_data.txt') as l:
         while (line := l.readline()) != '':
             row = list(map(float, line.split(' ')))
-            query_image_name = f'photo_{get_frame_num_from_time(start_frame, row[0])}.png'
-            camera = pycolmap.infer_camera_from_image(query_processing_data_dir / query_image_name)
+            query_image_path = frames.extract(get_frame_num_from_time(start_frame, row[0]), query_image_dir)
+            camera = pycolmap.infer_camera_from_image(query_image_path)
             pose = pycolmap.Image(tvec=[row[1], row[2], row[3]], qvec=[row[4], row[5], row[6], row[7]])
             viz_3d.plot_camera_colmap(fig2, pose, camera, color='rgba(100,255,100,0.5)', name='%.2f' % row[0], fill=True)
             # countl += 1
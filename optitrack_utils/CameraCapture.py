@@ -0,0 +1,372 @@
+# Camera capture and photo writing off the NatNet threads for Python 3.x
+#
+# CameraCaptureThread reads a camera continuously on its own thread and
+# stamps every image with the host monotonic clock, the clock PoseHistory
+# uses by default.  A NatNet listener only calls trigger, which queues a
+# tag; the next image grabbed is handed to on_photo with every pending
+# tag.  PhotoWriterPool encodes and writes images on worker threads from a
+# bounded queue, so neither the camera nor disk I/O can stall decoding.
+# FrameTimeline maps host times back to the nearest NatNet frame, so the
+# images of several cameras can be lined up with the mocap stream.
+# OpenCV is only imported when a camera is opened by number or path or an
+# image is written with the default writer.
+
+import bisect
+import queue
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+DEFAULT_WRITE_QUEUE_SIZE = 32
+DEFAULT_WRITERS = 2
+# NatNet frames a FrameTimeline remembers, about 30 s at 240 Hz
+DEFAULT_TIMELINE_FRAMES = 8192
+
+
+class CameraImage:
+    """One image grabbed by a CameraCaptureThread"""
+    def __init__(self, image, capture_time, grab_time, index, camera_name=""):
+        self.image = image
+        # time.monotonic() when read returned, and when it was called
+        self.capture_time = capture_time
+        self.grab_time = grab_time
+        # Images grabbed before this one by the same thread
+        self.index = index
+        self.camera_name = camera_name
+
+
+def open_camera(source):
+    """cv2.VideoCapture for a camera number or a device or file path"""
+    import cv2
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+def write_image(file_name, image):
+    """Write an image file, the file extension picks the format"""
+    import cv2
+    if not cv2.imwrite(str(file_name), image):
+        raise IOError("Could not write %s"%file_name)
+
+def write_photo(file_name, camera_image):
+    """Default PhotoWriterPool writer, one image file per photo"""
+    write_image(file_name, camera_image.image)
+
+
+class FrameTimeline:
+    """Host time each NatNet frame arrived, for looking up the frame nearest to an image.
+
+    add is called from the frame listener, nearest from any thread.  The
+    NatNet timestamp kept with each frame relates the two clocks, see
+    PhotoAssociation."""
+    def __init__(self, max_frames=DEFAULT_TIMELINE_FRAMES):
+        self.max_frames = max(max_frames, 1)
+        self.lock = Lock()
+        self.times = []
+        self.frame_numbers = []
+        self.timestamps = []
+
+    def add(self, host_time, frame_number, timestamp=0.0):
+        with self.lock:
+            if self.times and host_time < self.times[-1]:
+                return
+            self.times.append(host_time)
+            self.frame_numbers.append(frame_number)
+            self.timestamps.append(timestamp)
+            # Trim in bulk, not on every frame
+            if len(self.times) >= 2 * self.max_frames:
+                del self.times[:self.max_frames]
+                del self.frame_numbers[:self.max_frames]
+                del self.timestamps[:self.max_frames]
+
+    def nearest(self, host_time):
+        """( frame number, host time, NatNet timestamp ) of the frame that arrived closest to host_time, None if empty"""
+        with self.lock:
+            if not self.times:
+                return None
+            position = bisect.bisect_left(self.times, host_time)
+            if position == len(self.times) or \
+               (position > 0 and host_time - self.times[position - 1] <= self.times[position] - host_time):
+                position -= 1
+            return self.frame_numbers[position], self.times[position], self.timestamps[position]
+
+
+class CameraCaptureThread:
+    """Grabs images from a camera as fast as it delivers them.
+
+    source is a camera number or path, or anything with read() returning
+    ( ok, image ) and release().  The latest image is kept for get_latest
+    and wait_next.  on_photo( camera_image, tags ) is called on the capture
+    thread with the first image grabbed after one or more trigger calls."""
+    def __init__(self, source, name="camera", on_photo=None, clock=time.monotonic):
+        self.source = source
+        self.name = name
+        self.on_photo = on_photo
+        self.clock = clock
+        self.capture = None
+        self.thread = None
+        self.stop_event = False
+        self.condition = Condition()
+        self.latest = None
+        self.triggers = deque()
+        self.trigger_lock = Lock()
+        # Counters, see get_counters
+        self.grabbed = 0
+        self.failed = 0
+        self.photos = 0
+
+    def start(self):
+        """Open the camera and start grabbing, False if it could not be opened"""
+        if hasattr(self.source, "read"):
+            self.capture = self.source
+        else:
+            self.capture = open_camera(self.source)
+        is_opened = getattr(self.capture, "isOpened", None)
+        if is_opened is not None and not is_opened():
+            return False
+        self.stop_event = False
+        self.thread = Thread( target = self.__capture_thread_function, name = "Camera %s"%self.name, daemon = True )
+        self.thread.start()
+        return True
+
+    def trigger(self, tag=None):
+        """Ask for a photo, cheap enough to call from a NatNet listener"""
+        with self.trigger_lock:
+            self.triggers.append((tag, self.clock()))
+
+    def get_latest(self):
+        """Most recent CameraImage, None before the first one"""
+        with self.condition:
+            return self.latest
+
+    def wait_next(self, index=-1, timeout=None):
+        """First CameraImage with an index above index, None on timeout or once stopped"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.stop_event or (self.latest is not None and self.latest.index > index), timeout)
+            if self.latest is None or self.latest.index <= index:
+                return None
+            return self.latest
+
+    def get_counters(self):
+        """grabbed: images read
+        failed: reads that returned no image
+        photos: images handed to on_photo
+        pending: triggers waiting for an image"""
+        with self.trigger_lock:
+            pending = len(self.triggers)
+        return { "grabbed" : self.grabbed,
+                 "failed"  : self.failed,
+                 "photos"  : self.photos,
+                 "pending" : pending }
+
+    def stop(self):
+        """Stop grabbing and release the camera"""
+        with self.condition:
+            self.stop_event = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def __capture_thread_function(self):
+        while not self.stop_event:
+            grab_time = self.clock()
+            ok, image = self.capture.read()
+            capture_time = self.clock()
+            if not ok:
+                self.failed += 1
+                # Unplugged or end of file, do not spin
+                time.sleep(0.01)
+                continue
+            camera_image = CameraImage(image, capture_time, grab_time, self.grabbed, self.name)
+            self.grabbed += 1
+            with self.condition:
+                self.latest = camera_image
+                self.condition.notify_all()
+            with self.trigger_lock:
+                # Only triggers from before the read started belong to this image
+                tags = []
+                while self.triggers and self.triggers[0][1] <= grab_time:
+                    tags.append(self.triggers.popleft()[0])
+            if tags and self.on_photo is not None:
+                self.photos += 1
+                self.on_photo(camera_image, tags)
+
+
+class PhotoWriterPool:
+    """Worker threads writing images from a bounded queue.
+
+    Each photo is handed to writer( key, camera_image ), by default
+    write_photo with the key as file name; FrameStore.FrameStoreWriter
+    .write_photo appends it to a frame container instead.  submit never
+    blocks: when the queue is full the photo is dropped and counted,
+    keeping the caller at its own pace."""
+    def __init__(self, num_writers=DEFAULT_WRITERS, max_queue=DEFAULT_WRITE_QUEUE_SIZE, writer=write_photo, on_written=None):
+        self.queue = queue.Queue(max(max_queue, 1))
+        self.writer = writer
+        # on_written( key, camera_image ) after each photo is written
+        self.on_written = on_written
+        self.lock = Lock()
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.closed = False
+        self.threads = [ Thread( target = self.__writer_thread_function, name = "Photo Writer %d"%i, daemon = True )
+                         for i in range(max(num_writers, 1)) ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, camera_image):
+        """Queue a CameraImage to be written under key, False if it was dropped"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((key, camera_image))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def get_counters(self):
+        """written: photos on disk
+        dropped: photos lost to a full queue
+        errors: photos that could not be written
+        pending: photos waiting for a writer
+        queue_size: most photos that can wait"""
+        with self.lock:
+            return { "written"    : self.written,
+                     "dropped"    : self.dropped,
+                     "errors"     : self.errors,
+                     "pending"    : self.queue.qsize(),
+                     "queue_size" : self.queue.maxsize }
+
+    def close(self):
+        """Write the queued photos and stop the workers"""
+        if self.closed:
+            return
+        self.closed = True
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __writer_thread_function(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            key, camera_image = item
+            try:
+                self.writer(key, camera_image)
+            except Exception as error:
+                print("ERROR: %s"%error)
+                with self.lock:
+                    self.errors += 1
+                continue
+            with self.lock:
+                self.written += 1
+            if self.on_written is not None:
+                self.on_written(key, camera_image)
+
+
+# test program
+
+class TestCamera:
+    """Delivers numbered images at a fixed rate, like a webcam"""
+    def __init__(self, frame_interval=0.005):
+        self.frame_interval = frame_interval
+        self.count = 0
+        self.released = False
+
+    def read(self):
+        time.sleep(self.frame_interval)
+        self.count += 1
+        return True, self.count
+
+    def release(self):
+        self.released = True
+
+def test_trigger():
+    """A trigger gets the first image grabbed after it, with every tag pending"""
+    photos = []
+    camera = CameraCaptureThread(TestCamera(), on_photo=lambda camera_image, tags: photos.append((camera_image, tags)))
+    camera.start()
+    diffs = []
+    first = camera.wait_next(timeout=1.0)
+    trigger_time = time.monotonic()
+    camera.trigger(1)
+    camera.trigger(2)
+    deadline = time.monotonic() + 1.0
+    while not photos and time.monotonic() < deadline:
+        time.sleep(0.001)
+    camera.stop()
+    if first is None:
+        diffs.append("no image")
+    if len(photos) != 1:
+        diffs.append("%d photos"%len(photos))
+    else:
+        camera_image, tags = photos[0]
+        if tags != [1, 2]:
+            diffs.append("tags %s"%str(tags))
+        if camera_image.grab_time < trigger_time or camera_image.capture_time < camera_image.grab_time:
+            diffs.append("photo grabbed before the trigger")
+    if not camera.source.released:
+        diffs.append("camera not released")
+    return diffs
+
+def test_frame_timeline():
+    timeline = FrameTimeline(max_frames=4)
+    for frame_number in range(10):
+        timeline.add(frame_number * 0.01, frame_number, 5.0 + frame_number * 0.01)
+    diffs = []
+    for host_time, expected in [(0.071, 7), (0.076, 8), (0.5, 9), (0.0, 4)]:
+        frame_number, frame_time, timestamp = timeline.nearest(host_time)
+        if frame_number != expected or abs(timestamp - frame_time - 5.0) > 1e-9:
+            diffs.append("nearest %.3f: %d != %d"%(host_time, frame_number, expected))
+    if len(timeline.times) > 8:
+        diffs.append("%d frames kept"%len(timeline.times))
+    return diffs
+
+def test_writer_pool():
+    """Slow writers never block submit, the overflow is dropped and counted"""
+    written = []
+    def slow_writer(file_name, camera_image):
+        time.sleep(0.01)
+        if camera_image.image == 3:
+            raise IOError("disk full")
+    pool = PhotoWriterPool(num_writers=2, max_queue=4, writer=slow_writer,
+                           on_written=lambda file_name, camera_image: written.append(file_name))
+    start = time.perf_counter()
+    results = [pool.submit("photo_%d.png"%i, CameraImage(i, 0.0, 0.0, i)) for i in range(20)]
+    submit_time = time.perf_counter() - start
+    pool.close()
+    counters = pool.get_counters()
+    diffs = []
+    if submit_time > 0.005:
+        diffs.append("submit took %.3f s"%submit_time)
+    if counters["written"] + counters["errors"] != results.count(True) or counters["dropped"] != results.count(False):
+        diffs.append("counters %s, %d queued"%(str(counters), results.count(True)))
+    if counters["errors"] != 1 or len(written) != counters["written"]:
+        diffs.append("errors %d, written %s"%(counters["errors"], str(written)))
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Camera Trigger", test_trigger, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Camera Frame Timeline", test_frame_timeline, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Camera Writer Pool", test_writer_pool, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
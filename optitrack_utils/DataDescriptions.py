@@ -482,6 +482,14 @@ class DataDescriptions():
         self.force_plate_list=[]
         self.device_list=[]
         self.camera_list=[]
+        # ID and name indexes, kept up to date by the add_* methods.
+        # The first description added wins when an ID or name repeats.
+        self.rigid_body_by_id={}
+        self.rigid_body_by_name={}
+        self.skeleton_by_id={}
+        self.skeleton_by_name={}
+        self.asset_by_id={}
+        self.asset_by_name={}
 
     def generate_order_name(self):
         """Generate the name for the order list based on the current length of the list"""
@@ -508,7 +516,10 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.rigid_body_list)
         self.data_order_dict[order_name]=("rigid_body_list", pos)
-        self.rigid_body_list.append(copy.deepcopy(new_rigid_body))
+        rigid_body = copy.deepcopy(new_rigid_body)
+        self.rigid_body_list.append(rigid_body)
+        self.rigid_body_by_id.setdefault(rigid_body.id_num, rigid_body)
+        self.rigid_body_by_name.setdefault(get_as_string(rigid_body.sz_name), rigid_body)
 
 
     # Add a skeleton
@@ -519,7 +530,10 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.skeleton_list)
         self.data_order_dict[order_name]=("skeleton_list", pos)
-        self.skeleton_list.append(copy.deepcopy(new_skeleton))
+        skeleton = copy.deepcopy(new_skeleton)
+        self.skeleton_list.append(skeleton)
+        self.skeleton_by_id.setdefault(skeleton.id_num, skeleton)
+        self.skeleton_by_name.setdefault(get_as_string(skeleton.name), skeleton)
 
 
     # Add an asset
@@ -530,7 +544,10 @@ class DataDescriptions():
         # generate order entry
         pos = len(self.asset_list)
         self.data_order_dict[order_name]=("asset_list", pos)
-        self.asset_list.append(copy.deepcopy(new_asset))
+        asset = copy.deepcopy(new_asset)
+        self.asset_list.append(asset)
+        self.asset_by_id.setdefault(asset.assetID, asset)
+        self.asset_by_name.setdefault(get_as_string(asset.name), asset)
 
 
     # Add a force plate
@@ -585,6 +602,44 @@ class DataDescriptions():
         else:
             print("ERROR: Type %s unknown"%str(data_type))
 
+    def get_rigid_body(self, rigid_body_id):
+        """RigidBodyDescription for a rigid body ID, None if there is no such rigid body"""
+        return self.rigid_body_by_id.get(rigid_body_id)
+
+    def get_rigid_body_by_name(self, name):
+        """RigidBodyDescription for a rigid body name, None if there is no such rigid body"""
+        return self.rigid_body_by_name.get(name)
+
+    def get_rigid_body_id(self, name):
+        """Rigid body ID for a rigid body name, None if there is no such rigid body"""
+        rigid_body = self.rigid_body_by_name.get(name)
+        if rigid_body is None:
+            return None
+        return rigid_body.id_num
+
+    def get_rigid_body_name(self, rigid_body_id):
+        """Rigid body name for a rigid body ID, None if there is no such rigid body"""
+        rigid_body = self.rigid_body_by_id.get(rigid_body_id)
+        if rigid_body is None:
+            return None
+        return get_as_string(rigid_body.sz_name)
+
+    def get_skeleton(self, skeleton_id):
+        """SkeletonDescription for a skeleton ID, None if there is no such skeleton"""
+        return self.skeleton_by_id.get(skeleton_id)
+
+    def get_skeleton_by_name(self, name):
+        """SkeletonDescription for a skeleton name, None if there is no such skeleton"""
+        return self.skeleton_by_name.get(name)
+
+    def get_asset(self, asset_id):
+        """AssetDescription for an asset ID, None if there is no such asset"""
+        return self.asset_by_id.get(asset_id)
+
+    def get_asset_by_name(self, name):
+        """AssetDescription for an asset name, None if there is no such asset"""
+        return self.asset_by_name.get(name)
+
     def get_object_from_list(self, list_name, pos_num):
         """Determine list name and position of the object"""
         ret_value = None
@@ -776,9 +831,70 @@ def generate_data_descriptions(data_desc_num=0):
     return data_descs
 
 
+def test_indexes():
+    """ID and name lookups against a scan of the lists"""
+    data_descs = generate_data_descriptions(0)
+    for skeleton_num in [3, 9]:
+        data_descs.add_asset(AssetDescription("Asset_%3.3d"%skeleton_num, 0, skeleton_num + 100, [], []))
+    rigid_body = RigidBodyDescription(b"RigidBody_007", 7)
+    data_descs.add_rigid_body(rigid_body)
+    diffs = []
+    if data_descs.get_rigid_body_id("RigidBody_007") != 7 or data_descs.get_rigid_body_name(7) != "RigidBody_007":
+        diffs.append("rigid body 7: %s %s"%(data_descs.get_rigid_body_id("RigidBody_007"), data_descs.get_rigid_body_name(7)))
+    # Descriptions are copied on add, the index points at the stored copy
+    if data_descs.get_rigid_body(7) is not data_descs.rigid_body_list[-1]:
+        diffs.append("rigid body 7 is not the stored description")
+    # Repeated IDs resolve to the first description, as a list scan would
+    if data_descs.get_rigid_body(3141) is not data_descs.rigid_body_list[0]:
+        diffs.append("repeated rigid body ID")
+    for skeleton in data_descs.skeleton_list:
+        if data_descs.get_skeleton(skeleton.id_num) is not skeleton or \
+           data_descs.get_skeleton_by_name(get_as_string(skeleton.name)) is not skeleton:
+            diffs.append("skeleton %d"%skeleton.id_num)
+    for asset in data_descs.asset_list:
+        if data_descs.get_asset(asset.assetID) is not asset or data_descs.get_asset_by_name(asset.name) is not asset:
+            diffs.append("asset %d"%asset.assetID)
+    if data_descs.get_rigid_body_id("missing") is not None or data_descs.get_rigid_body_name(-1) is not None:
+        diffs.append("missing rigid body found")
+    return diffs
+
+def test_client_cache(major, minor):
+    """NatNetClient keeps its data descriptions until tracked_models_changed is set"""
+    from . import MoCapData
+    from . import NatNetClient
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    client.set_use_fast_decoder(True)
+    client.set_print_level(0)
+    client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+    data_descs = DataDescriptions()
+    data_descs.add_rigid_body(RigidBodyDescription(b"RigidBody_001", 1))
+    client.process_message(NatNetPacker.pack_data_descriptions(data_descs, major, minor))
+    requests = []
+    client.request_data_descriptions = lambda: requests.append(client.data_descriptions_request_time)
+    diffs = []
+    frame = MoCapData.generate_mocap_data(0)
+    # One request per change, repeated once the retry interval passes without a reply
+    for param, expected, num_requests in [(0, False, 0), (0x02, True, 1), (0x02, True, 1), (0, True, 1), ("retry", True, 2)]:
+        if param == "retry":
+            client.data_descriptions_request_time -= NatNetClient.DATA_DESCRIPTIONS_RETRY
+            param = 0
+        frame.suffix_data.param = param
+        client.process_message(NatNetPacker.pack_mocap_data(frame, major, minor))
+        if client.data_descriptions_changed != expected or len(requests) != num_requests:
+            diffs.append("param %d: changed %s, %d requests"%(param, client.data_descriptions_changed, len(requests)))
+    client.process_message(NatNetPacker.pack_data_descriptions(data_descs, major, minor))
+    if client.data_descriptions_changed or client.data_descriptions.get_rigid_body_id("RigidBody_001") != 1:
+        diffs.append("descriptions not refreshed")
+    client.process_message(NatNetPacker.pack_mocap_data(frame, major, minor))
+    if len(requests) != 2:
+        diffs.append("%d requests after the reply"%len(requests))
+    return diffs
+
 # test_all - Test all the major classes
 def test_all(run_test=True):
     """Test all the Data Description classes"""
+    from . import NatNetDecoder
     totals=[0,0,0]
     if run_test is True:
         test_cases=[
@@ -796,6 +912,8 @@ def test_all(run_test=True):
             data = eval(test_cases[i][2])
             totals_tmp = test_hash2(test_cases[i][0],test_cases[i][1],data,test_cases[i][2],test_cases[i][3])
             totals=add_lists(totals, totals_tmp)
+    totals = NatNetDecoder.run_test_case("Test Data Description Indexes", test_indexes, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Data Description Client Cache 4.1", lambda: test_client_cache(4, 1), run_test, totals)
 
     print("--------------------")
     print("[PASS] Count = %3.1d"%totals[0])
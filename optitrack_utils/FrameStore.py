@@ -0,0 +1,397 @@
+# Camera frame containers for Python 3.x
+#
+# A frame store keeps every photo of a take in one file instead of one
+# image file per photo:
+#   header: magic, format version, encoding
+#   record: record header, frame number, capture time, image shape, image bytes
+#   index:  frame number, capture time and offset of every record, then a
+#           trailer pointing at the index
+# Images are stored as JPEG (a Motion JPEG stream, each frame stands on its
+# own), PNG or raw uint8 pixels.  Raw needs no encoding at all and JPEG is
+# several times cheaper to encode than PNG.  Records are appended in the
+# order the writers finish them; the index is sorted by frame number, so a
+# reader can fetch any frame with one seek.  A store that was not closed is
+# read by scanning the records instead.
+
+import bisect
+import struct
+from pathlib import Path
+from threading import Lock
+import numpy as np
+
+FRAMES_MAGIC = b'NNFRMS'
+FRAMES_FORMAT_VERSION = 1
+RECORD_MAGIC = b'NNFR'
+INDEX_MAGIC = b'NNFI'
+
+# Image encodings
+ENCODING_RAW = "raw"
+ENCODING_JPEG = "jpeg"
+ENCODING_PNG = "png"
+ENCODINGS = [ENCODING_RAW, ENCODING_JPEG, ENCODING_PNG]
+# File extension of an extracted image
+IMAGE_EXTENSIONS = { ENCODING_RAW : ".png", ENCODING_JPEG : ".jpg", ENCODING_PNG : ".png" }
+
+DEFAULT_JPEG_QUALITY = 95
+# Name of the frame store of a take, next to the frames directory
+TAKE_FRAMES_FILE = "frames.nnframes"
+
+FramesHeader = struct.Struct( '<6sBB' )
+# magic, frame number, capture time, height, width, channels, image size
+RecordHeader = struct.Struct( '<4sidIIBI' )
+# record offset, frame number, capture time
+IndexEntry = struct.Struct( '<qid' )
+# index offset, record count, magic
+IndexTrailer = struct.Struct( '<qI4s' )
+
+
+def get_image_name(frame_number, encoding=ENCODING_PNG):
+    """File name bm_record gives the photo of a frame"""
+    return "photo_%d%s"%(frame_number, IMAGE_EXTENSIONS[encoding])
+
+def encode_image(image, encoding, jpeg_quality=DEFAULT_JPEG_QUALITY):
+    if encoding == ENCODING_RAW:
+        return np.ascontiguousarray(image, dtype=np.uint8).tobytes()
+    import cv2
+    if encoding == ENCODING_JPEG:
+        ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        ok, data = cv2.imencode(".png", image)
+    if not ok:
+        raise IOError("Could not encode a %s image"%encoding)
+    return data.tobytes()
+
+def decode_image(data, encoding, shape):
+    if encoding == ENCODING_RAW:
+        return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+    import cv2
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class FrameStoreWriter:
+    """Appends images to a frame store, safe to share between writer threads.
+
+    Images are encoded on the calling thread, only the append is done under
+    the lock, so a CameraCapture.PhotoWriterPool encodes in parallel."""
+    def __init__(self, file_name, encoding=ENCODING_JPEG, jpeg_quality=DEFAULT_JPEG_QUALITY):
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding %s, valid encodings are %s"%(encoding, ", ".join(ENCODINGS)))
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.file = open(file_name, 'wb')
+        self.lock = Lock()
+        self.index = []
+        self.file.write(FramesHeader.pack(FRAMES_MAGIC, FRAMES_FORMAT_VERSION, ENCODINGS.index(encoding)))
+
+    def write(self, frame_number, capture_time, image):
+        """Append the image of frame_number, image is a uint8 height x width ( x channels ) array"""
+        data = encode_image(image, self.encoding, self.jpeg_quality)
+        height, width = image.shape[0:2]
+        channels = image.shape[2] if image.ndim > 2 else 1
+        with self.lock:
+            if self.file is None:
+                return
+            self.index.append((self.file.tell(), frame_number, capture_time))
+            self.file.write(RecordHeader.pack(RECORD_MAGIC, frame_number, capture_time, height, width, channels, len(data)))
+            self.file.write(data)
+
+    def write_photo(self, frame_number, camera_image):
+        """CameraCapture.PhotoWriterPool writer, keyed by frame number"""
+        self.write(frame_number, camera_image.capture_time, camera_image.image)
+
+    def get_frame_count(self):
+        with self.lock:
+            return len(self.index)
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            index_offset = self.file.tell()
+            for entry in sorted(self.index, key=lambda entry: entry[1]):
+                self.file.write(IndexEntry.pack(*entry))
+            self.file.write(IndexTrailer.pack(index_offset, len(self.index), INDEX_MAGIC))
+            self.file.close()
+            self.file = None
+
+
+class FrameStoreReader:
+    """Random access to the images of a frame store by frame number"""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, 'rb')
+        self.lock = Lock()
+        header = self.file.read(FramesHeader.size)
+        if len(header) < FramesHeader.size:
+            raise ValueError("%s: not a frame store"%file_name)
+        magic, format_version, encoding = FramesHeader.unpack(header)
+        if magic != FRAMES_MAGIC:
+            raise ValueError("%s: not a frame store"%file_name)
+        if format_version != FRAMES_FORMAT_VERSION:
+            raise ValueError("%s: unsupported frame store format version %d"%(file_name, format_version))
+        self.encoding = ENCODINGS[encoding]
+        index = self.__read_index()
+        if index is None:
+            index = sorted(self.__scan_records(), key=lambda entry: entry[1])
+        self.offsets = [entry[0] for entry in index]
+        self.frame_numbers = [entry[1] for entry in index]
+        self.capture_times = [entry[2] for entry in index]
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def __iter__(self):
+        """( frame number, capture time, image ) in frame order"""
+        for frame_number, capture_time in zip(self.frame_numbers, self.capture_times):
+            yield frame_number, capture_time, self.read(frame_number)
+
+    def get_frame_numbers(self):
+        return list(self.frame_numbers)
+
+    def get_capture_time(self, frame_number):
+        """time.monotonic() when the image was grabbed, None if there is no such frame"""
+        position = self.__find(frame_number)
+        if position is None:
+            return None
+        return self.capture_times[position]
+
+    def get_image_name(self, frame_number):
+        return get_image_name(frame_number, self.encoding)
+
+    def read_encoded(self, frame_number):
+        """( image bytes, ( height, width, channels ) ) as stored, None if there is no such frame"""
+        position = self.__find(frame_number)
+        if position is None:
+            return None
+        with self.lock:
+            self.file.seek(self.offsets[position])
+            magic, frame_number, capture_time, height, width, channels, size = \
+                RecordHeader.unpack(self.file.read(RecordHeader.size))
+            data = self.file.read(size)
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return data, shape
+
+    def read(self, frame_number):
+        """Decoded image of frame_number, None if there is no such frame"""
+        encoded = self.read_encoded(frame_number)
+        if encoded is None:
+            return None
+        return decode_image(encoded[0], self.encoding, encoded[1])
+
+    def extract(self, frame_number, directory):
+        """Write the image of frame_number to directory as an image file and return its path.
+
+        For tools that take an image path.  JPEG and PNG images are copied
+        as stored, without decoding them."""
+        path = Path(directory) / self.get_image_name(frame_number)
+        if path.exists():
+            return path
+        encoded = self.read_encoded(frame_number)
+        if encoded is None:
+            return None
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        if self.encoding == ENCODING_RAW:
+            from .CameraCapture import write_image
+            write_image(path, decode_image(encoded[0], self.encoding, encoded[1]))
+        else:
+            with open(path, 'wb') as image_file:
+                image_file.write(encoded[0])
+        return path
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __find(self, frame_number):
+        position = bisect.bisect_left(self.frame_numbers, frame_number)
+        if position < len(self.frame_numbers) and self.frame_numbers[position] == frame_number:
+            return position
+        return None
+
+    def __read_index(self):
+        """Index entries from the end of the file, None if the store was not closed"""
+        self.file.seek(0, 2)
+        file_size = self.file.tell()
+        if file_size < FramesHeader.size + IndexTrailer.size:
+            return None
+        self.file.seek(file_size - IndexTrailer.size)
+        index_offset, record_count, magic = IndexTrailer.unpack(self.file.read(IndexTrailer.size))
+        if magic != INDEX_MAGIC or index_offset + record_count * IndexEntry.size + IndexTrailer.size != file_size:
+            return None
+        self.file.seek(index_offset)
+        data = self.file.read(record_count * IndexEntry.size)
+        return [IndexEntry.unpack_from(data, i * IndexEntry.size) for i in range(record_count)]
+
+    def __scan_records(self):
+        """Rebuild the index from the record headers, stops at a truncated record"""
+        index = []
+        offset = FramesHeader.size
+        self.file.seek(0, 2)
+        file_size = self.file.tell()
+        while offset + RecordHeader.size <= file_size:
+            self.file.seek(offset)
+            magic, frame_number, capture_time, height, width, channels, size = \
+                RecordHeader.unpack(self.file.read(RecordHeader.size))
+            if magic != RECORD_MAGIC or offset + RecordHeader.size + size > file_size:
+                break
+            index.append((offset, frame_number, capture_time))
+            offset += RecordHeader.size + size
+        return index
+
+
+class PhotoDirectoryReader:
+    """FrameStoreReader interface over a directory of photo_<frame number> images"""
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.paths = {}
+        for path in self.directory.glob('photo_*'):
+            frame_number = path.stem[len('photo_'):]
+            if frame_number.isdigit():
+                self.paths[int(frame_number)] = path
+        self.frame_numbers = sorted(self.paths)
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def __iter__(self):
+        for frame_number in self.frame_numbers:
+            yield frame_number, None, self.read(frame_number)
+
+    def get_frame_numbers(self):
+        return list(self.frame_numbers)
+
+    def get_capture_time(self, frame_number):
+        # Not recorded with the photos
+        return None
+
+    def get_image_name(self, frame_number):
+        return self.paths[frame_number].name
+
+    def read(self, frame_number):
+        import cv2
+        path = self.paths.get(frame_number)
+        if path is None:
+            return None
+        return cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+
+    def extract(self, frame_number, directory=None):
+        """Path of the image of frame_number, already a file"""
+        return self.paths.get(frame_number)
+
+    def close(self):
+        pass
+
+
+def open_take_frames(take_dir):
+    """Reader for the photos of a take, its frame store if there is one or else its frames directory"""
+    take_dir = Path(take_dir)
+    if (take_dir / TAKE_FRAMES_FILE).exists():
+        return FrameStoreReader(take_dir / TAKE_FRAMES_FILE)
+    return PhotoDirectoryReader(take_dir / 'frames')
+
+
+# test program
+
+def generate_test_image(frame_number, height=48, width=64):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :, 0] = frame_number % 256
+    image[:, :, 1] = np.arange(width, dtype=np.uint8)
+    image[:, :, 2] = np.arange(height, dtype=np.uint8)[:, np.newaxis]
+    return image
+
+def test_random_access():
+    """Images written out of order come back by frame number"""
+    import os
+    import tempfile
+    handle, file_name = tempfile.mkstemp(suffix='.nnframes')
+    os.close(handle)
+    frame_numbers = [8, 0, 4, 16, 12]
+    diffs = []
+    try:
+        writer = FrameStoreWriter(file_name, ENCODING_RAW)
+        for frame_number in frame_numbers:
+            writer.write(frame_number, frame_number * 0.1, generate_test_image(frame_number))
+        writer.close()
+        reader = FrameStoreReader(file_name)
+        if reader.get_frame_numbers() != sorted(frame_numbers):
+            diffs.append("frame numbers %s"%str(reader.get_frame_numbers()))
+        for frame_number in frame_numbers:
+            if not np.array_equal(reader.read(frame_number), generate_test_image(frame_number)):
+                diffs.append("frame %d image differs"%frame_number)
+            if reader.get_capture_time(frame_number) != frame_number * 0.1:
+                diffs.append("frame %d capture time %s"%(frame_number, reader.get_capture_time(frame_number)))
+        if reader.read(5) is not None or reader.get_capture_time(5) is not None:
+            diffs.append("missing frame found")
+        reader.close()
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_unclosed_store():
+    """A store that was never closed is read back by scanning its records"""
+    import os
+    import tempfile
+    handle, file_name = tempfile.mkstemp(suffix='.nnframes')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = FrameStoreWriter(file_name, ENCODING_RAW)
+        for frame_number in [4, 0]:
+            writer.write(frame_number, 0.0, generate_test_image(frame_number))
+        writer.file.flush()
+        # Half a record, as left by a crash in the middle of a write
+        with open(file_name, 'ab') as store_file:
+            store_file.write(RecordHeader.pack(RECORD_MAGIC, 8, 0.0, 48, 64, 3, 48*64*3))
+        reader = FrameStoreReader(file_name)
+        if reader.get_frame_numbers() != [0, 4]:
+            diffs.append("frame numbers %s"%str(reader.get_frame_numbers()))
+        elif not np.array_equal(reader.read(4), generate_test_image(4)):
+            diffs.append("frame 4 image differs")
+        reader.close()
+        writer.file.close()
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_writer_pool():
+    """PhotoWriterPool appends photos to a store from several threads"""
+    import os
+    import tempfile
+    from .CameraCapture import CameraImage, PhotoWriterPool
+    handle, file_name = tempfile.mkstemp(suffix='.nnframes')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = FrameStoreWriter(file_name, ENCODING_RAW)
+        pool = PhotoWriterPool(num_writers=3, max_queue=64, writer=writer.write_photo)
+        for frame_number in range(0, 160, 4):
+            pool.submit(frame_number, CameraImage(generate_test_image(frame_number), frame_number / 240.0, 0.0, frame_number))
+        pool.close()
+        writer.close()
+        reader = FrameStoreReader(file_name)
+        if reader.get_frame_numbers() != list(range(0, 160, 4)):
+            diffs.append("frame numbers %s"%str(reader.get_frame_numbers()))
+        for frame_number, capture_time, image in reader:
+            if image[0, 0, 0] != frame_number % 256 or capture_time != frame_number / 240.0:
+                diffs.append("frame %d"%frame_number)
+        reader.close()
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Frame Store Random Access", test_random_access, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Frame Store Unclosed", test_unclosed_store, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Frame Store Writer Pool", test_writer_pool, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -25,6 +25,7 @@
 import copy
 import hashlib
 import random
+import types
 
 K_SKIP = [0,0,1]
 K_FAIL = [0,1,0]
@@ -849,6 +850,66 @@ class MoCapData:
         return out_str
 
 
+#Compact MoCap Frame Classes
+# Attributes of every frame class, including the ones the decoders set
+# after construction ( RigidBodyMarker.id )
+FRAME_CLASS_SLOTS = {
+    "FramePrefixData"       : ("frame_number",),
+    "MarkerData"            : ("model_name", "marker_pos_list"),
+    "MarkerSetData"         : ("marker_data_list", "unlabeled_markers"),
+    "LegacyMarkerData"      : ("marker_pos_list",),
+    "RigidBodyMarker"       : ("pos", "id_num", "size", "error", "marker_num", "id"),
+    "RigidBody"             : ("id_num", "pos", "rot", "rb_marker_list", "tracking_valid", "error", "marker_num"),
+    "RigidBodyData"         : ("rigid_body_list",),
+    "Skeleton"              : ("id_num", "rigid_body_list"),
+    "SkeletonData"          : ("skeleton_list",),
+    "AssetMarkerData"       : ("marker_id", "pos", "marker_size", "marker_params", "residual", "marker_num"),
+    "AssetRigidBodyData"    : ("id_num", "pos", "rot", "mean_error", "param", "rb_num"),
+    "Asset"                 : ("asset_id", "rigid_body_list", "marker_list"),
+    "AssetData"             : ("asset_list",),
+    "LabeledMarker"         : ("id_num", "pos", "size", "param", "residual", "marker_num"),
+    "LabeledMarkerData"     : ("labeled_marker_list",),
+    "ForcePlateChannelData" : ("frame_list",),
+    "ForcePlate"            : ("id_num", "channel_data_list"),
+    "ForcePlateData"        : ("force_plate_list",),
+    "DeviceChannelData"     : ("frame_list",),
+    "Device"                : ("id_num", "channel_data_list"),
+    "DeviceData"            : ("device_list",),
+    "FrameSuffixData"       : ("timecode", "timecode_sub", "timestamp", "stamp_camera_mid_exposure",
+                               "stamp_data_received", "stamp_transmit", "prec_timestamp_secs",
+                               "prec_timestamp_frac_secs", "param", "is_recording", "tracked_models_changed"),
+    "MoCapData"             : ("prefix_data", "marker_set_data", "legacy_other_markers", "rigid_body_data",
+                               "asset_data", "skeleton_data", "labeled_marker_data", "force_plate_data",
+                               "device_data", "suffix_data"),
+}
+
+def make_compact_classes():
+    """Namespace of __slots__ versions of the frame classes, under the same names.
+
+    Compact objects have no per instance __dict__, so they are smaller and
+    quicker to build, but no attribute outside FRAME_CLASS_SLOTS can be
+    added to them.  The methods are those of the regular classes, bound to
+    the compact classes, so MarkerSetData() builds a compact MarkerData."""
+    compact_classes = types.SimpleNamespace()
+    compact_globals = dict(globals())
+    for class_name, slots in FRAME_CLASS_SLOTS.items():
+        namespace = { "__slots__" : slots, "__module__" : __name__, "__qualname__" : "Compact" + class_name }
+        for name, value in vars(globals()[class_name]).items():
+            if name in ("__dict__", "__weakref__", "__module__", "__qualname__"):
+                continue
+            if isinstance(value, types.FunctionType):
+                value = types.FunctionType(value.__code__, compact_globals, value.__name__, value.__defaults__, value.__closure__)
+            namespace[name] = value
+        compact_class = type("Compact" + class_name, (), namespace)
+        setattr(compact_classes, class_name, compact_class)
+        compact_globals[class_name] = compact_class
+        # Module level name so compact frames can be pickled
+        globals()[compact_class.__name__] = compact_class
+    return compact_classes
+
+compact_classes = make_compact_classes()
+
+
 
 # test program
 
@@ -938,6 +999,34 @@ def generate_skeleton_data(frame_num = 0):
     skeleton_data.add_skeleton(generate_skeleton(frame_num, 2, 3))
     return skeleton_data
 
+def generate_legacy_marker_data(frame_num = 0, num_points=4):
+    legacy_marker_data = LegacyMarkerData()
+    start_num=(frame_num * 100000) + 20000
+    for point_num in range(start_num, start_num+num_points):
+        legacy_marker_data.add_pos(generate_position_srand(point_num))
+    return legacy_marker_data
+
+def generate_asset(frame_num=0, asset_num=0, num_rbs=2, num_markers=3):
+    asset = Asset()
+    asset.set_id(asset_num)
+    for rb_num in range(num_rbs):
+        pos=generate_position_srand(30000+rb_num, frame_num)
+        rigid_body = AssetRigidBodyData(rb_num, pos, [1,0,0,0], 0.25, 1)
+        rigid_body.rb_num = rb_num
+        asset.add_rigid_body(rigid_body)
+    for marker_num in range(num_markers):
+        pos=generate_position_srand(31000+marker_num, frame_num)
+        marker = AssetMarkerData(marker_num, pos, 1.5, 4, 0.5)
+        marker.marker_num = marker_num
+        asset.add_marker(marker)
+    return asset
+
+def generate_asset_data(frame_num = 0):
+    asset_data = AssetData()
+    asset_data.add_asset(generate_asset(frame_num, 0, 2, 3))
+    asset_data.add_asset(generate_asset(frame_num, 1, 1, 5))
+    return asset_data
+
 def generate_labeled_marker(frame_num=0, marker_num=0):
     point_num = (frame_num *2000) + marker_num
     pos = generate_position_srand(point_num)
@@ -0,0 +1,384 @@
+# OptiTrack NatNet NumPy bulk decoding for Python 3.x
+#
+# From NatNet 3.0 on rigid body and labeled marker records are fixed size,
+# so each of those frame sections can be read with a single np.frombuffer
+# call into a structured array instead of one Python object per record.
+# The arrays are copied out of the packet because NatNetClient reuses its
+# receive buffers once a packet has been processed.
+
+import numpy as np
+from . import MoCapData
+from .NatNetDecoder import FrameDecoder
+
+# id, position, orientation, mean marker error, params (NatNet 3.0 and later)
+RIGID_BODY_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('pos', '<f4', (3,)),
+    ('rot', '<f4', (4,)),
+    ('error', '<f4'),
+    ('params', '<i2'),
+])
+
+# id, position, size, params, residual in meters (NatNet 3.0 and later)
+LABELED_MARKER_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('pos', '<f4', (3,)),
+    ('size', '<f4'),
+    ('params', '<i2'),
+    ('residual', '<f4'),
+])
+
+
+def rigid_body_array_from_list(rigid_body_list):
+    """Build a RIGID_BODY_DTYPE array from decoded MoCapData.RigidBody objects"""
+    rigid_bodies = np.zeros(len(rigid_body_list), dtype=RIGID_BODY_DTYPE)
+    for i, rigid_body in enumerate(rigid_body_list):
+        rigid_bodies[i] = (rigid_body.id_num, rigid_body.pos, rigid_body.rot,
+                           rigid_body.error, int(rigid_body.tracking_valid))
+    return rigid_bodies
+
+def labeled_marker_array_from_list(labeled_marker_list):
+    """Build a LABELED_MARKER_DTYPE array from decoded MoCapData.LabeledMarker objects"""
+    labeled_markers = np.zeros(len(labeled_marker_list), dtype=LABELED_MARKER_DTYPE)
+    for i, labeled_marker in enumerate(labeled_marker_list):
+        labeled_markers[i] = (labeled_marker.id_num, labeled_marker.pos, labeled_marker.size,
+                              labeled_marker.param, labeled_marker.residual / 1000.0)
+    return labeled_markers
+
+
+class RigidBodyArrayData:
+    """Rigid body section held as a RIGID_BODY_DTYPE structured array"""
+    def __init__(self, rigid_bodies):
+        self.rigid_bodies = rigid_bodies
+
+    def get_rigid_body_count(self):
+        return len(self.rigid_bodies)
+
+    def get_as_string(self, tab_str="  ", level=0):
+        out_tab_str = MoCapData.get_tab_str(tab_str, level)
+        out_tab_str2 = MoCapData.get_tab_str(tab_str, level+1)
+        out_str = "%sRigid Body Count: %3.1d\n"%(out_tab_str, len(self.rigid_bodies))
+        for rigid_body in self.rigid_bodies:
+            pos = rigid_body['pos']
+            rot = rigid_body['rot']
+            out_str += "%sID %3.1d Position: [%3.2f, %3.2f, %3.2f] Orientation: [%3.2f, %3.2f, %3.2f, %3.2f]\n"%(
+                out_tab_str2, rigid_body['id'], pos[0], pos[1], pos[2], rot[0], rot[1], rot[2], rot[3])
+        return out_str
+
+class LabeledMarkerArrayData:
+    """Labeled marker section held as a LABELED_MARKER_DTYPE structured array"""
+    def __init__(self, labeled_markers):
+        self.labeled_markers = labeled_markers
+
+    def get_labeled_marker_count(self):
+        return len(self.labeled_markers)
+
+    def get_as_string(self, tab_str="  ", level=0):
+        out_tab_str = MoCapData.get_tab_str(tab_str, level)
+        out_tab_str2 = MoCapData.get_tab_str(tab_str, level+1)
+        out_str = "%sLabeled Marker Count:%3.1d\n"%(out_tab_str, len(self.labeled_markers))
+        for labeled_marker in self.labeled_markers:
+            pos = labeled_marker['pos']
+            out_str += "%sID %3.1d pos : [%3.2f, %3.2f, %3.2f] size : [%3.2f]\n"%(
+                out_tab_str2, labeled_marker['id'], pos[0], pos[1], pos[2], labeled_marker['size'])
+        return out_str
+
+
+# Frames per batch when neither a frame count nor a time span is given
+DEFAULT_BATCH_FRAMES = 60
+
+class FrameBatch:
+    """Columnar rigid body data for a run of frames.
+
+    Row i is frame frame_number[i], column j is rigid body rigid_body_id[j].
+    pos is (frames, rigid bodies, 3), rot (frames, rigid bodies, 4) and
+    error (frames, rigid bodies).  Rigid bodies missing from a frame are
+    NaN and tracking_valid is False for them.
+    """
+    def __init__(self, frame_number, timestamp, rigid_body_id, pos, rot, error, tracking_valid):
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.rigid_body_id = rigid_body_id
+        self.pos = pos
+        self.rot = rot
+        self.error = error
+        self.tracking_valid = tracking_valid
+
+    def get_frame_count(self):
+        return len(self.frame_number)
+
+    def get_rigid_body_column(self, rigid_body_id):
+        """Column of rigid_body_id in pos/rot, None if it is not in the batch"""
+        column = np.searchsorted(self.rigid_body_id, rigid_body_id)
+        if column < len(self.rigid_body_id) and self.rigid_body_id[column] == rigid_body_id:
+            return int(column)
+        return None
+
+    def get_as_string(self, tab_str="  ", level=0):
+        out_tab_str = MoCapData.get_tab_str(tab_str, level)
+        out_str = "%sFrame Batch: %d frames, %d rigid bodies\n"%(out_tab_str, len(self.frame_number), len(self.rigid_body_id))
+        if len(self.frame_number):
+            out_str += "%sFrames %d - %d, Timestamps %3.3f - %3.3f\n"%(out_tab_str,
+                self.frame_number[0], self.frame_number[-1], self.timestamp[0], self.timestamp[-1])
+        return out_str
+
+def make_frame_batch(frame_numbers, timestamps, rigid_body_arrays):
+    """Build a FrameBatch from per frame RIGID_BODY_DTYPE arrays"""
+    num_frames = len(frame_numbers)
+    if rigid_body_arrays:
+        rigid_body_id = np.unique(np.concatenate([rigid_bodies['id'] for rigid_bodies in rigid_body_arrays]))
+    else:
+        rigid_body_id = np.zeros(0, dtype=RIGID_BODY_DTYPE['id'])
+    shape = (num_frames, len(rigid_body_id))
+    pos = np.full(shape + (3,), np.nan, dtype=np.float32)
+    rot = np.full(shape + (4,), np.nan, dtype=np.float32)
+    error = np.full(shape, np.nan, dtype=np.float32)
+    tracking_valid = np.zeros(shape, dtype=bool)
+    for i, rigid_bodies in enumerate(rigid_body_arrays):
+        if len(rigid_bodies) == 0:
+            continue
+        columns = np.searchsorted(rigid_body_id, rigid_bodies['id'])
+        pos[i, columns] = rigid_bodies['pos']
+        rot[i, columns] = rigid_bodies['rot']
+        error[i, columns] = rigid_bodies['error']
+        tracking_valid[i, columns] = (rigid_bodies['params'] & 0x01) != 0
+    return FrameBatch(np.array(frame_numbers, dtype=np.int32), np.array(timestamps, dtype=np.float64),
+                      rigid_body_id, pos, rot, error, tracking_valid)
+
+class FrameBatcher:
+    """Collects frames and hands them to listener as a FrameBatch.
+
+    A batch is delivered once it holds max_frames frames or spans
+    max_time_ms of stream time, whichever comes first.  flush delivers
+    whatever is waiting.
+    """
+    def __init__(self, listener, max_frames=None, max_time_ms=None):
+        if max_frames is None and max_time_ms is None:
+            max_frames = DEFAULT_BATCH_FRAMES
+        self.listener = listener
+        self.max_frames = max_frames
+        self.max_time = None
+        if max_time_ms is not None:
+            self.max_time = max_time_ms / 1000.0
+        self.frame_numbers = []
+        self.timestamps = []
+        self.rigid_body_arrays = []
+
+    def add_frame(self, frame_number, timestamp, rigid_bodies=None):
+        if rigid_bodies is None:
+            rigid_bodies = np.zeros(0, dtype=RIGID_BODY_DTYPE)
+        self.frame_numbers.append(frame_number)
+        self.timestamps.append(timestamp)
+        self.rigid_body_arrays.append(rigid_bodies)
+        if self.max_frames is not None and len(self.frame_numbers) >= self.max_frames:
+            self.flush()
+        elif self.max_time is not None and timestamp - self.timestamps[0] >= self.max_time:
+            self.flush()
+
+    def flush(self):
+        if not self.frame_numbers:
+            return
+        frame_batch = make_frame_batch(self.frame_numbers, self.timestamps, self.rigid_body_arrays)
+        self.frame_numbers = []
+        self.timestamps = []
+        self.rigid_body_arrays = []
+        self.listener(frame_batch)
+
+
+class ArrayFrameDecoder(FrameDecoder):
+    """FrameDecoder that returns the rigid body and labeled marker sections as arrays.
+
+    rigid_body_data is a RigidBodyArrayData and labeled_marker_data a
+    LabeledMarkerArrayData.  Per rigid body listener callbacks are not made,
+    NatNetClient hands the arrays to its array listeners instead.  With a
+    rigid body filter only the subscribed rows are kept and each is passed
+    to its subscriber as ( id, pos, rot ) array views.  Streams
+    older than NatNet 3.0 are decoded record by record and then converted.
+    """
+
+    def empty_section(self, section_name):
+        if section_name == "rigid_bodies":
+            return RigidBodyArrayData(rigid_body_array_from_list([]))
+        if section_name == "labeled_markers":
+            return LabeledMarkerArrayData(labeled_marker_array_from_list([]))
+        return FrameDecoder.empty_section(self, section_name)
+
+    def unpack_rigid_body_data(self, buf, offset, plan, rigid_body_listener):
+        if plan.major < 3:
+            offset, rigid_body_data = FrameDecoder.unpack_rigid_body_data(self, buf, offset, plan, None)
+            return offset, RigidBodyArrayData(rigid_body_array_from_list(rigid_body_data.rigid_body_list))
+        # Rigid body count (4 bytes)
+        offset, rigid_body_count = self.unpack_count(buf, offset, plan)
+        rigid_bodies = np.frombuffer(buf, dtype=RIGID_BODY_DTYPE, count=rigid_body_count, offset=offset).copy()
+        offset += rigid_body_count * RIGID_BODY_DTYPE.itemsize
+        rigid_body_filter = self.rigid_body_filter
+        if rigid_body_filter is not None:
+            rigid_bodies = rigid_bodies[np.isin(rigid_bodies['id'], list(rigid_body_filter))]
+            for rigid_body in rigid_bodies:
+                listener = rigid_body_filter[int(rigid_body['id'])]
+                if listener is not None:
+                    listener( int(rigid_body['id']), rigid_body['pos'], rigid_body['rot'] )
+        return offset, RigidBodyArrayData(rigid_bodies)
+
+    def unpack_skeleton_data(self, buf, offset, plan, rigid_body_listener):
+        return FrameDecoder.unpack_skeleton_data(self, buf, offset, plan, None)
+
+    def unpack_labeled_marker_data(self, buf, offset, plan, rigid_body_listener=None):
+        if plan.major < 3:
+            offset, labeled_marker_data = FrameDecoder.unpack_labeled_marker_data(self, buf, offset, plan)
+            return offset, LabeledMarkerArrayData(labeled_marker_array_from_list(labeled_marker_data.labeled_marker_list))
+        offset, labeled_marker_count = self.unpack_count(buf, offset, plan)
+        labeled_markers = np.frombuffer(buf, dtype=LABELED_MARKER_DTYPE, count=labeled_marker_count, offset=offset).copy()
+        offset += labeled_marker_count * LABELED_MARKER_DTYPE.itemsize
+        return offset, LabeledMarkerArrayData(labeled_markers)
+
+
+# test program
+
+def test_array_decoder(frame_num, major, minor):
+    """Compare ArrayFrameDecoder sections with the object decoder"""
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor)
+    packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+    ref_offset, ref_data = NatNetDecoder.FrameDecoder().unpack_mocap_data(packet, 4, packet_size, major, minor)
+    offset, array_data = ArrayFrameDecoder().unpack_mocap_data(packet, 4, packet_size, major, minor)
+
+    diffs = []
+    if ref_offset != offset:
+        diffs.append("offset: %d != %d"%(ref_offset, offset))
+    ref_rigid_bodies = rigid_body_array_from_list(ref_data.rigid_body_data.rigid_body_list)
+    if not np.array_equal(ref_rigid_bodies, array_data.rigid_body_data.rigid_bodies):
+        diffs.append("rigid body arrays differ")
+    ref_labeled_markers = labeled_marker_array_from_list(ref_data.labeled_marker_data.labeled_marker_list)
+    labeled_markers = array_data.labeled_marker_data.labeled_markers
+    for name in ('id', 'pos', 'size', 'params'):
+        if not np.array_equal(ref_labeled_markers[name], labeled_markers[name]):
+            diffs.append("labeled marker %s differs"%name)
+    if not np.allclose(ref_labeled_markers['residual'], labeled_markers['residual']):
+        diffs.append("labeled marker residual differs")
+    diffs += NatNetDecoder.compare_objects(ref_data.suffix_data, array_data.suffix_data, "suffix_data")
+    return diffs
+
+def test_array_rigid_body_filter(frame_num, major, minor):
+    """Only the subscribed rigid body row is kept and passed to its listener"""
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor)
+    packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+    ref_offset, ref_data = ArrayFrameDecoder().unpack_mocap_data(packet, 4, packet_size, major, minor)
+    calls = []
+    decoder = ArrayFrameDecoder()
+    decoder.set_rigid_body_filter({1: lambda *args: calls.append(args), 99: None})
+    offset, array_data = decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)
+
+    diffs = []
+    if ref_offset != offset:
+        diffs.append("offset: %d != %d"%(ref_offset, offset))
+    ref_rigid_bodies = ref_data.rigid_body_data.rigid_bodies
+    ref_rigid_bodies = ref_rigid_bodies[ref_rigid_bodies['id'] == 1]
+    if not np.array_equal(ref_rigid_bodies, array_data.rigid_body_data.rigid_bodies):
+        diffs.append("rigid body arrays differ")
+    if len(calls) != 1 or calls[0][0] != 1 or not np.allclose(calls[0][1], ref_rigid_bodies[0]['pos']):
+        diffs.append("listener calls differ: %s"%str(calls))
+    return diffs
+
+def test_array_truncated_frame(major, minor):
+    """A frame cut short inside the marker sets reaches the array listeners with empty sections"""
+    import contextlib
+    import io
+    from . import NatNetClient
+    from . import NatNetDecoder
+    packet = NatNetDecoder.pack_truncated_frame(NatNetDecoder.generate_test_frame(11), major, minor)
+    client = NatNetClient.NatNetClient()
+    client.set_nat_net_version(major, minor)
+    client.set_use_array_decoder(True)
+    rigid_body_arrays = []
+    client.rigid_body_array_listener = lambda frame_number, rigid_bodies: rigid_body_arrays.append(rigid_bodies)
+    batches = []
+    client.set_frame_batch_listener(batches.append, max_frames=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.process_message(packet)
+
+    diffs = []
+    if len(rigid_body_arrays) != 1 or len(rigid_body_arrays[0]) != 0:
+        diffs.append("rigid body array listener got %s"%str(rigid_body_arrays))
+    if len(batches) != 1 or batches[0].frame_number[0] != 11:
+        diffs.append("frame batch listener got %d batches"%len(batches))
+    return diffs
+
+def test_frame_batcher(major, minor):
+    """Batches of 3 frames from 7 decoded frames, the last one flushed"""
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    decoder = ArrayFrameDecoder()
+    batches = []
+    batcher = FrameBatcher(batches.append, max_frames=3)
+    ref_rigid_bodies = []
+    for frame_num in range(7):
+        packet = NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor)
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        offset, mocap_data = decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)
+        rigid_bodies = mocap_data.rigid_body_data.rigid_bodies
+        # Leave rigid body 2 out of frame 4
+        if frame_num == 4:
+            rigid_bodies = rigid_bodies[rigid_bodies['id'] != 2]
+        ref_rigid_bodies.append(rigid_bodies)
+        batcher.add_frame(mocap_data.prefix_data.frame_number, mocap_data.suffix_data.timestamp, rigid_bodies)
+    batcher.flush()
+
+    diffs = []
+    frame_counts = [batch.get_frame_count() for batch in batches]
+    if frame_counts != [3, 3, 1]:
+        return ["frame counts %s != [3, 3, 1]"%str(frame_counts)]
+    for batch_num, batch in enumerate(batches):
+        for row in range(batch.get_frame_count()):
+            rigid_bodies = ref_rigid_bodies[batch_num*3 + row]
+            for rigid_body in rigid_bodies:
+                column = batch.get_rigid_body_column(rigid_body['id'])
+                if not np.array_equal(batch.pos[row, column], rigid_body['pos']) or \
+                   not np.array_equal(batch.rot[row, column], rigid_body['rot']):
+                    diffs.append("batch %d row %d rigid body %d differs"%(batch_num, row, rigid_body['id']))
+    column = batches[1].get_rigid_body_column(2)
+    if not np.isnan(batches[1].pos[1, column]).all() or batches[1].tracking_valid[1, column]:
+        diffs.append("missing rigid body not NaN")
+    return diffs
+
+def test_frame_batcher_time():
+    """Batches cut by stream time"""
+    batches = []
+    batcher = FrameBatcher(batches.append, max_time_ms=20)
+    for frame_num in range(10):
+        batcher.add_frame(frame_num, frame_num / 240.0)
+    batcher.flush()
+    frame_counts = [batch.get_frame_count() for batch in batches]
+    if frame_counts != [6, 4]:
+        return ["frame counts %s != [6, 4]"%str(frame_counts)]
+    return []
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    for major, minor in NatNetDecoder.TEST_VERSIONS:
+        test_name = "Test Array Decoder %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_array_decoder(7, major, minor), run_test, totals)
+    for major, minor in NatNetDecoder.TEST_VERSIONS:
+        test_name = "Test Array Rigid Body Filter %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_array_rigid_body_filter(7, major, minor), run_test, totals)
+    for major, minor in NatNetDecoder.TEST_VERSIONS:
+        test_name = "Test Frame Batcher %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_frame_batcher(major, minor), run_test, totals)
+    for major, minor in [[3,1],[4,1]]:
+        test_name = "Test Array Truncated Frame %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_array_truncated_frame(major, minor), run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Frame Batcher Time", test_frame_batcher_time, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
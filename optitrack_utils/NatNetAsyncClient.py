@@ -0,0 +1,373 @@
+# OptiTrack NatNet asyncio client for Python 3.x
+#
+# NatNetClient on asyncio datagram transports instead of receive threads.
+# Frames come out of an async iterator and commands are awaitable, so a
+# recorder, a live localizer and a metrics exporter can share one event
+# loop.  Configuration, subscriptions and message handling are inherited
+# from NatNetClient.
+
+import asyncio
+import time
+from collections import deque
+from . import NatNetClient
+
+# Seconds to wait for the server to answer a request
+DEFAULT_COMMAND_TIMEOUT = 2.0
+
+# Seconds between keep alive messages in unicast mode
+KEEP_ALIVE_INTERVAL = 1.0
+
+# Frames waiting for the iterator before the oldest is dropped
+DEFAULT_FRAME_QUEUE_SIZE = 64
+
+
+class NatNetProtocol(asyncio.DatagramProtocol):
+    """Passes every datagram of one socket to packet_listener( data )"""
+    def __init__(self, packet_listener):
+        self.packet_listener = packet_listener
+
+    def datagram_received(self, data, addr):
+        self.packet_listener(data)
+
+    def error_received(self, exc):
+        if NatNetClient.TRACE:
+            NatNetClient.trace( "ERROR: socket error received: ", exc )
+
+
+class AsyncNatNetClient(NatNetClient.NatNetClient):
+    """NatNetClient driven by an asyncio event loop.
+
+    Configure it like NatNetClient, then
+        async with AsyncNatNetClient() as client:
+            response = await client.send_command_async("Bitstream")
+            async for mocap_data in client.frames():
+                ...
+    NatNet replies carry no request ID but the server answers in order, so
+    each reply completes the oldest request waiting for that reply type.
+    """
+    def __init__(self, frame_queue_size=DEFAULT_FRAME_QUEUE_SIZE):
+        super().__init__()
+        self.frame_queue_size = frame_queue_size
+        self.frame_queue = None
+        self.frames_dropped = 0
+        self.data_transport = None
+        self.command_transport = None
+        self.keep_alive_task = None
+        # Futures waiting for each reply message ID, oldest first
+        self.pending_replies = { self.NAT_SERVERINFO : deque(),
+                                 self.NAT_RESPONSE   : deque(),
+                                 self.NAT_MODELDEF   : deque() }
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def connect(self, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Open the sockets and wait for the server info reply to NAT_CONNECT.
+
+        Returns False, with everything closed again, if the sockets cannot be
+        opened or the server does not answer within timeout seconds."""
+        if not self.create_sockets():
+            return False
+        if self.frame_decoder is None:
+            self.set_use_fast_decoder(True)
+        self.frame_queue = asyncio.Queue(self.frame_queue_size)
+        loop = asyncio.get_running_loop()
+        self.data_transport, _ = await loop.create_datagram_endpoint(
+            lambda: NatNetProtocol(self.__packet_received), sock=self.data_socket)
+        self.command_transport, _ = await loop.create_datagram_endpoint(
+            lambda: NatNetProtocol(self.__packet_received), sock=self.command_socket)
+        if not self.use_multicast:
+            self.keep_alive_task = loop.create_task(self.__keep_alive())
+
+        reply = self.__send_and_expect(self.NAT_CONNECT, "", self.NAT_SERVERINFO)
+        try:
+            await self.__wait_reply(reply, timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            return False
+        # Rigid body names are resolved to IDs from the model definitions
+        if self.rigid_body_name_subscriptions:
+            self.__send_and_expect(self.NAT_REQUEST_MODELDEF, "", self.NAT_MODELDEF)
+        return True
+
+    async def send_command_async(self, command_str, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Send a command and return the server response.
+
+        The response is the int result code or the reply string, -1 if the
+        server did not recognize the request.  Raises asyncio.TimeoutError
+        when there is no answer within timeout seconds."""
+        reply = self.__send_and_expect(self.NAT_REQUEST, command_str, self.NAT_RESPONSE)
+        return await self.__wait_reply(reply, timeout)
+
+    async def request_model_definitions(self, timeout=DEFAULT_COMMAND_TIMEOUT, refresh=False):
+        """Return the server DataDescriptions.
+
+        The cached descriptions are returned until a frame reports
+        tracked_models_changed, or refresh asks for new ones anyway."""
+        if not refresh and self.data_descriptions is not None and not self.data_descriptions_changed:
+            return self.data_descriptions
+        reply = self.__send_and_expect(self.NAT_REQUEST_MODELDEF, "", self.NAT_MODELDEF)
+        return await self.__wait_reply(reply, timeout)
+
+    async def frames(self):
+        """Async iterator over decoded MoCapData frames, ends when the client is closed"""
+        while True:
+            mocap_data = await self.frame_queue.get()
+            if mocap_data is None:
+                return
+            yield mocap_data
+
+    def close(self):
+        """Close the transports, end frames() and cancel requests still waiting"""
+        if self.keep_alive_task is not None:
+            self.keep_alive_task.cancel()
+            self.keep_alive_task = None
+        for transport in (self.data_transport, self.command_transport):
+            if transport is not None:
+                transport.close()
+        self.data_transport = None
+        self.command_transport = None
+        for replies in self.pending_replies.values():
+            while replies:
+                replies.popleft().cancel()
+        if self.frame_batcher is not None:
+            self.frame_batcher.flush()
+        self.stop_pose_board()
+        self.stop_latency_dump()
+        if self.frame_queue is not None:
+            self.__put_frame(None)
+
+    def shutdown(self):
+        self.close()
+
+    def request_data_descriptions(self):
+        """Send NAT_REQUEST_MODELDEF in order with the awaited requests.
+
+        Nothing waits for the reply, its place in the queue is given up
+        after DEFAULT_COMMAND_TIMEOUT so a lost reply cannot shift later
+        replies onto the wrong request."""
+        if self.command_transport is None:
+            return
+        reply = self.__send_and_expect(self.NAT_REQUEST_MODELDEF, "", self.NAT_MODELDEF)
+        asyncio.get_running_loop().call_later(DEFAULT_COMMAND_TIMEOUT, reply.cancel)
+
+    def __send_and_expect(self, command, command_str, reply_id):
+        reply = asyncio.get_running_loop().create_future()
+        self.pending_replies[reply_id].append(reply)
+        # Transports have the socket sendto signature
+        self.send_request(self.command_transport, command, command_str, (self.server_ip_address, self.command_port))
+        return reply
+
+    async def __wait_reply(self, reply, timeout):
+        # A timed out future is cancelled and skipped when its reply arrives late
+        return await asyncio.wait_for(reply, timeout)
+
+    def __complete_reply(self, reply_id, result):
+        replies = self.pending_replies[reply_id]
+        while replies:
+            reply = replies.popleft()
+            if not reply.done():
+                reply.set_result(result)
+                return
+
+    def __put_frame(self, mocap_data):
+        if self.frame_queue.full():
+            self.frame_queue.get_nowait()
+            self.frames_dropped += 1
+        self.frame_queue.put_nowait(mocap_data)
+
+    def __packet_received(self, data):
+        if len(data) < 4:
+            return
+        message_id = NatNetClient.get_message_id(data)
+        if message_id == self.NAT_FRAMEOFDATA:
+            self.__frame_received(data)
+            return
+
+        # Everything else updates the client state as it would with threads
+        self.process_message(data)
+        if message_id == self.NAT_SERVERINFO:
+            self.__complete_reply(self.NAT_SERVERINFO, True)
+        elif message_id == self.NAT_MODELDEF:
+            self.__complete_reply(self.NAT_MODELDEF, self.data_descriptions)
+        elif message_id == self.NAT_RESPONSE:
+            packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
+            if packet_size == 4:
+                response = int.from_bytes( data[4:8], byteorder='little',  signed=True )
+            else:
+                response, separator, remainder = bytes(data[4:]).partition( b'\0' )
+                response = response.decode('utf-8')
+            self.__complete_reply(self.NAT_RESPONSE, response)
+        elif message_id == self.NAT_UNRECOGNIZED_REQUEST:
+            self.__complete_reply(self.NAT_RESPONSE, -1)
+
+    def __frame_received(self, data):
+        receive_time = time.perf_counter()
+        self.count_packet(data, len(data))
+        self.message_counts[self.NAT_FRAMEOFDATA] = self.message_counts.get(self.NAT_FRAMEOFDATA, 0) + 1
+        frame_number = int.from_bytes( data[4:8], byteorder='little',  signed=True )
+
+        packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
+        offset, mocap_data = self.frame_decoder.unpack_mocap_data( data, 4, packet_size, self.get_major(), self.get_minor(), self.rigid_body_listener )
+        self.packets_decoded += 1
+        decoded_time = time.perf_counter()
+        if mocap_data.suffix_data.tracked_models_changed or self.data_descriptions_changed:
+            # Keeps name subscriptions on the right IDs, retried while the reply is missing
+            self.invalidate_data_descriptions()
+        if self.use_array_decoder and self.frame_batcher is not None:
+            rigid_bodies = None
+            if mocap_data.rigid_body_data is not None:
+                rigid_bodies = mocap_data.rigid_body_data.rigid_bodies
+            self.frame_batcher.add_frame( frame_number, mocap_data.suffix_data.timestamp, rigid_bodies )
+        if self.pose_board is not None:
+            self.pose_board.publish_frame( mocap_data )
+        if self.pose_history is not None:
+            self.pose_history.add_frame( mocap_data )
+        if self.frame_hub is not None:
+            self.frame_hub.publish( mocap_data )
+        self.__put_frame(mocap_data)
+        done_time = time.perf_counter()
+        self.decode_times.add( decoded_time - receive_time )
+        self.listener_times.add( done_time - decoded_time )
+        latency_stats = self.latency_stats
+        if latency_stats is not None:
+            latency_stats.add_frame( mocap_data.suffix_data, receive_time, decoded_time, done_time,
+                                     self.high_resolution_clock_frequency )
+
+    async def __keep_alive(self):
+        while True:
+            await asyncio.sleep(KEEP_ALIVE_INTERVAL)
+            self.send_keep_alive(self.command_transport, self.server_ip_address, self.command_port)
+
+
+# test program
+
+class TestServerProtocol(asyncio.DatagramProtocol):
+    """Answers NAT_CONNECT with server info and frames, echoes commands back"""
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+        self.transport = None
+        self.modeldef_requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        from . import NatNetDecoder
+        from . import NatNetPacker
+        message_id = NatNetClient.get_message_id(data)
+        if message_id == NatNetClient.NatNetClient.NAT_CONNECT:
+            self.transport.sendto(NatNetPacker.pack_server_info("Test Server", [3,1,0,0], [4,1,0,0]), addr)
+            for frame_num in range(self.num_frames):
+                self.transport.sendto(NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), 4, 1), addr)
+        elif message_id == NatNetClient.NatNetClient.NAT_REQUEST_MODELDEF:
+            from . import DataDescriptions
+            self.modeldef_requests += 1
+            data_descs = DataDescriptions.DataDescriptions()
+            data_descs.add_rigid_body(DataDescriptions.RigidBodyDescription(b"RigidBody_001", 1))
+            self.transport.sendto(NatNetPacker.pack_data_descriptions(data_descs, 4, 1), addr)
+        elif message_id == NatNetClient.NatNetClient.NAT_REQUEST:
+            command_str = bytes(data[4:]).partition(b'\0')[0].decode('utf-8')
+            if command_str == "ModelsChanged":
+                # Reply, then a frame flagged tracked_models_changed
+                self.transport.sendto(NatNetPacker.pack_response(command_str + " Ok"), addr)
+                mocap_data = NatNetDecoder.generate_test_frame(self.num_frames)
+                mocap_data.suffix_data.param = 0x02
+                self.transport.sendto(NatNetPacker.pack_mocap_data(mocap_data, 4, 1), addr)
+            elif command_str == "Unknown":
+                self.transport.sendto(NatNetPacker.pack_message(NatNetPacker.NAT_UNRECOGNIZED_REQUEST, b''), addr)
+            else:
+                self.transport.sendto(NatNetPacker.pack_response(command_str + " Ok"), addr)
+
+async def run_test_client(num_frames):
+    loop = asyncio.get_running_loop()
+    server_transport, server = await loop.create_datagram_endpoint(
+        lambda: TestServerProtocol(num_frames), local_addr=('127.0.0.1', 0))
+    client = AsyncNatNetClient()
+    client.set_client_address('127.0.0.1')
+    client.set_server_address('127.0.0.1')
+    client.set_use_multicast(False)
+    # Unicast without joining a multicast group
+    client.multicast_address = "255.255.255.255"
+    client.command_port = server_transport.get_extra_info('sockname')[1]
+
+    diffs = []
+    try:
+        async with client:
+            frame_numbers = []
+            async for mocap_data in client.frames():
+                frame_numbers.append(mocap_data.prefix_data.frame_number)
+                if len(frame_numbers) == num_frames:
+                    break
+            if frame_numbers != list(range(num_frames)):
+                diffs.append("frames %s"%str(frame_numbers))
+            commands = ["First", "Unknown", "Third"]
+            responses = await asyncio.gather(*[client.send_command_async(command) for command in commands])
+            if responses != ["First Ok", -1, "Third Ok"]:
+                diffs.append("responses %s"%str(responses))
+            if client.get_major() != 4 or client.get_minor() != 1:
+                diffs.append("version %d.%d"%(client.get_major(), client.get_minor()))
+            # A model change sends one request for new descriptions
+            data_descs = await client.request_model_definitions()
+            if data_descs is None or data_descs.get_rigid_body_id("RigidBody_001") != 1:
+                diffs.append("model definitions %s"%str(data_descs))
+            await client.send_command_async("ModelsChanged")
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if not client.data_descriptions_changed and server.modeldef_requests > 1:
+                    break
+            await asyncio.sleep(0.05)
+            if client.data_descriptions_changed or server.modeldef_requests != 2:
+                diffs.append("%d model definition requests, changed %s"%(server.modeldef_requests, client.data_descriptions_changed))
+    finally:
+        server_transport.close()
+    return diffs
+
+async def run_test_connect_timeout():
+    """connect returns False and closes up when the server never answers"""
+    loop = asyncio.get_running_loop()
+    server_transport, _ = await loop.create_datagram_endpoint(
+        asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0))
+    client = AsyncNatNetClient()
+    client.set_client_address('127.0.0.1')
+    client.set_server_address('127.0.0.1')
+    client.set_use_multicast(False)
+    client.multicast_address = "255.255.255.255"
+    client.command_port = server_transport.get_extra_info('sockname')[1]
+
+    diffs = []
+    try:
+        is_connected = await client.connect(0.2)
+        if is_connected:
+            diffs.append("connected to a silent server")
+        if client.data_transport is not None or client.command_transport is not None or \
+           client.keep_alive_task is not None:
+            diffs.append("transports or keep alive left open")
+        # The transports release their sockets on the next loop iteration
+        await asyncio.sleep(0)
+        if client.data_socket.fileno() != -1 or client.command_socket.fileno() != -1:
+            diffs.append("sockets left open")
+    finally:
+        server_transport.close()
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Async Client", lambda: asyncio.run(run_test_client(5)), run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Async Connect Timeout", lambda: asyncio.run(run_test_connect_timeout()),
+                                         run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
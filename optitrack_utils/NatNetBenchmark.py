@@ -0,0 +1,249 @@
+# OptiTrack NatNet decoder benchmarks for Python 3.x
+#
+# Packs synthetic frames with NatNetPacker and measures how many frames per
+# second each decode path sustains.  Run with
+#   python -m optitrack_utils.NatNetBenchmark
+# or, on frames recorded with NatNetClient.start_capture,
+#   python -m optitrack_utils.NatNetBenchmark -c take.nncap
+
+import argparse
+import contextlib
+import gc
+import io
+import logging
+import time
+import tracemalloc
+from . import NatNetClient
+from . import NatNetDecoder
+from . import NatNetPacker
+from .NatNetSimulator import generate_scene_frame, generate_scene_descriptions
+
+BENCHMARK_VERSIONS = [[3,1],[4,1]]
+
+
+def time_frames(decode, packets, num_frames):
+    """Run decode over packets until num_frames are done, returns frames per second"""
+    num_packets = len(packets)
+    start = time.perf_counter()
+    for i in range(num_frames):
+        decode(packets[i % num_packets])
+    elapsed = time.perf_counter() - start
+    return num_frames / elapsed
+
+def print_result(name, fps, base_fps=None):
+    out_str = "  %-32s %10.1f frames/s"%(name, fps)
+    if base_fps is not None:
+        out_str += "  x%4.2f"%(fps / base_fps)
+    print(out_str)
+
+def benchmark_fast_decoder(packets, major, minor, num_frames):
+    client = NatNetClient.NatNetClient()
+    decoder = NatNetDecoder.FrameDecoder()
+    unpack_reference = client._NatNetClient__unpack_mocap_data
+
+    def decode_reference(packet):
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        unpack_reference(packet[4:], packet_size, major, minor)
+
+    def decode_fast(packet):
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)
+
+    base_fps = time_frames(decode_reference, packets, num_frames)
+    print_result("NatNetClient", base_fps)
+    print_result("FrameDecoder", time_frames(decode_fast, packets, num_frames), base_fps)
+
+    decoder.set_sections(["rigid_bodies"])
+    print_result("FrameDecoder rigid bodies", time_frames(decode_fast, packets, num_frames), base_fps)
+    decoder.set_rigid_body_filter({0: None})
+    print_result("FrameDecoder rigid bodies, 1 ID", time_frames(decode_fast, packets, num_frames), base_fps)
+    decoder.set_rigid_body_filter(None)
+    decoder.set_sections(None)
+
+    try:
+        from . import NatNetArrays
+    except ImportError:
+        print("  ArrayFrameDecoder skipped, NumPy not installed")
+        return
+    array_decoder = NatNetArrays.ArrayFrameDecoder()
+
+    def decode_arrays(packet):
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        array_decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)
+
+    print_result("ArrayFrameDecoder", time_frames(decode_arrays, packets, num_frames), base_fps)
+
+def time_records(decode, num_records):
+    """Run decode num_records times, returns records per second"""
+    start = time.perf_counter()
+    for _ in range(num_records):
+        decode()
+    elapsed = time.perf_counter() - start
+    return num_records / elapsed
+
+def print_record_result(name, rps, base_rps=None):
+    out_str = "  %-32s %10.1f records/s"%(name, rps)
+    if base_rps is not None:
+        out_str += "  x%4.2f"%(rps / base_rps)
+    print(out_str)
+
+def find_rigid_body_record(decoder, packet, plan, section_handlers):
+    """Offset of the first rigid body record in a packet, walking the sections before it"""
+    buf = memoryview(packet)
+    # Message header and frame number
+    offset = 4 + 4
+    for section_name, (unpack_section, set_section) in zip(plan.section_names, section_handlers):
+        if section_name == "rigid_bodies":
+            offset, rigid_body_count = decoder.unpack_count(buf, offset, plan)
+            return offset
+        offset, section_data = unpack_section(buf, offset, plan, None)
+    return None
+
+def benchmark_decode_plan(mocap_data, packet, major, minor, num_records):
+    """Single rigid body record, per field version checks against a DecodePlan"""
+    client = NatNetClient.NatNetClient()
+    decoder = NatNetDecoder.FrameDecoder()
+    plan, section_handlers = decoder.prepare(major, minor)
+    unpack_reference = client._NatNetClient__unpack_rigid_body
+    offset = find_rigid_body_record(decoder, packet, plan, section_handlers)
+    record = bytes(packet[offset:offset + decoder.rigid_body_size(packet, offset, plan)])
+    buf = memoryview(record)
+    # Both decoders must be timed on a real record
+    expected = mocap_data.rigid_body_data.rigid_body_list[0]
+    record_size, rigid_body = decoder.unpack_rigid_body(buf, 0, plan, None)
+    assert record_size == len(record) and rigid_body.id_num == expected.id_num and \
+           all(abs(a - b) < 1e-4 for a, b in zip(rigid_body.pos, expected.pos)), \
+           "rigid body record %d %s is not %d %s"%(rigid_body.id_num, str(rigid_body.pos), expected.id_num, str(expected.pos))
+    with contextlib.redirect_stdout(io.StringIO()):
+        record_size, reference_rigid_body = unpack_reference(record, major, minor, 0)
+    assert record_size == len(record) and reference_rigid_body.id_num == expected.id_num, \
+           "NatNetClient read rigid body %d"%reference_rigid_body.id_num
+
+    base_rps = time_records(lambda: unpack_reference(record, major, minor, 0), num_records)
+    print_record_result("NatNetClient rigid body", base_rps)
+    print_record_result("DecodePlan rigid body",
+                        time_records(lambda: decoder.unpack_rigid_body(buf, 0, plan, None), num_records), base_rps)
+
+def benchmark_trace(packets, major, minor, num_frames, num_rigid_bodies):
+    """NatNetClient with its trace points formatted but not logged, against disabled trace points"""
+    client = NatNetClient.NatNetClient()
+    unpack_reference = client._NatNetClient__unpack_mocap_data
+
+    def decode_reference(packet):
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        unpack_reference(packet[4:], packet_size, major, minor)
+
+    # Enabled trace points build their strings, the logger then discards them
+    level = NatNetClient.logger.level
+    NatNetClient.logger.setLevel(logging.WARNING)
+    NatNetClient.set_trace(True, True, True)
+    base_fps = time_frames(decode_reference, packets, num_frames)
+    NatNetClient.set_trace()
+    NatNetClient.logger.setLevel(level)
+    print_result("NatNetClient trace formatted", base_fps)
+    fps = time_frames(decode_reference, packets, num_frames)
+    print_result("NatNetClient trace disabled", fps, base_fps)
+    print("  %-32s %10.1f us/frame"%("saved", 1e6/base_fps - 1e6/fps))
+
+    # Model definitions are only turned into a string when print_level prints them
+    modeldef_packet = NatNetPacker.pack_data_descriptions(generate_scene_descriptions(num_rigid_bodies), major, minor)
+    num_modeldefs = max(num_frames // 10, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.process_message(NatNetPacker.pack_server_info("Benchmark", [0,0,0,0], [major,minor,0,0]))
+        base_modeldef_rate = time_records(lambda: client.process_message(modeldef_packet, client.get_print_level()),
+                                          num_modeldefs)
+        modeldef_rate = time_records(lambda: client.process_message(modeldef_packet, 0), num_modeldefs)
+    print("  %-32s %10.1f us/modeldef"%("NAT_MODELDEF printed", 1e6/base_modeldef_rate))
+    print("  %-32s %10.1f us/modeldef"%("NAT_MODELDEF print_level 0", 1e6/modeldef_rate))
+    print("  %-32s %10.1f us/modeldef"%("saved get_as_string", 1e6/base_modeldef_rate - 1e6/modeldef_rate))
+
+def get_gc_collections():
+    return sum(generation["collections"] for generation in gc.get_stats())
+
+def frame_memory(decoder, packets, major, minor, num_frames):
+    """Bytes allocated per decoded frame while num_frames frames are kept"""
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    frames = []
+    for i in range(num_frames):
+        packet = packets[i % len(packets)]
+        packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+        frames.append(decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)[1])
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size - start_size) / num_frames
+
+def benchmark_frame_objects(packets, major, minor, num_frames):
+    """MoCapData classes against the compact classes and the frame pool"""
+    regular = NatNetDecoder.FrameDecoder()
+    compact = NatNetDecoder.FrameDecoder()
+    compact.set_compact(True)
+    pooled = NatNetDecoder.FrameDecoder()
+    pooled.set_compact(True)
+    frame_pool = NatNetDecoder.FramePool()
+    pooled.set_frame_pool(frame_pool)
+
+    def decoder_function(decoder, release=None):
+        def decode(packet):
+            packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+            offset, mocap_data = decoder.unpack_mocap_data(packet, 4, packet_size, major, minor)
+            if release is not None:
+                release(mocap_data)
+        return decode
+
+    base_fps = None
+    for name, decode in [("MoCapData classes", decoder_function(regular)),
+                         ("compact classes", decoder_function(compact)),
+                         ("compact classes, frame pool", decoder_function(pooled, frame_pool.release))]:
+        collections = get_gc_collections()
+        fps = time_frames(decode, packets, num_frames)
+        print_result(name, fps, base_fps)
+        print("  %-32s %10d"%("  gc collections", get_gc_collections() - collections))
+        if base_fps is None:
+            base_fps = fps
+    num_kept = max(num_frames // 10, 1)
+    base_size = frame_memory(regular, packets, major, minor, num_kept)
+    size = frame_memory(compact, packets, major, minor, num_kept)
+    print("  %-32s %10.0f bytes/frame"%("MoCapData classes", base_size))
+    print("  %-32s %10.0f bytes/frame  x%4.2f"%("compact classes", size, size / base_size))
+
+def benchmark_all(num_frames, num_rigid_bodies, num_labeled_markers):
+    for major, minor in BENCHMARK_VERSIONS:
+        frames = [generate_scene_frame(frame_num, num_rigid_bodies, num_labeled_markers) for frame_num in range(8)]
+        packets = [NatNetPacker.pack_mocap_data(mocap_data, major, minor) for mocap_data in frames]
+        print("NatNet %d.%d, %d rigid bodies, %d labeled markers, %d bytes per frame"%(
+            major, minor, num_rigid_bodies, num_labeled_markers, len(packets[0])))
+        benchmark_fast_decoder(packets, major, minor, num_frames)
+        benchmark_frame_objects(packets, major, minor, num_frames)
+        if num_rigid_bodies > 0:
+            benchmark_decode_plan(frames[0], packets[0], major, minor, num_frames*num_rigid_bodies)
+        benchmark_trace(packets, major, minor, num_frames // 4, num_rigid_bodies)
+
+def benchmark_capture(file_name, num_frames):
+    from . import NatNetCapture
+    reader = NatNetCapture.PacketCaptureReader(file_name)
+    packets = reader.frame_packets()
+    if not packets:
+        print("%s has no frames"%file_name)
+        return
+    major = reader.get_major()
+    minor = reader.get_minor()
+    print("NatNet %d.%d, %d captured frames, %d bytes per frame on average"%(
+        major, minor, len(packets), sum(len(packet) for packet in packets) // len(packets)))
+    benchmark_fast_decoder(packets, major, minor, num_frames)
+
+def main():
+    parser = argparse.ArgumentParser(description='''\
+                                    Benchmarks the NatNet frame decoders on synthetic frames.''')
+    parser.add_argument('-n', type=int, metavar='FRAMES', default=2000, help='Frames decoded per measurement. Default 2000')
+    parser.add_argument('-r', type=int, metavar='RIGID BODIES', default=20, help='Rigid bodies per frame. Default 20')
+    parser.add_argument('-m', type=int, metavar='MARKERS', default=100, help='Labeled markers per frame. Default 100')
+    parser.add_argument('-c', type=str, metavar='CAPTURE', default=None, help='Decode frames from a packet capture file instead')
+    args = parser.parse_args()
+    if args.c is not None:
+        benchmark_capture(args.c, args.n)
+    else:
+        benchmark_all(args.n, args.r, args.m)
+
+if __name__ == '__main__':
+    main()
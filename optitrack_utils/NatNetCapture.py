@@ -0,0 +1,194 @@
+# OptiTrack NatNet raw packet capture and replay for Python 3.x
+#
+# A capture file is a header followed by one record per packet received
+# by NatNetClient on its data or command socket:
+#   header: magic, format version, NatNet stream version (4 bytes)
+#   record: host monotonic time in ns, channel, packet size, packet bytes
+# Replaying a capture feeds the packets back through the client message
+# handling at recorded speed, a multiple of it or as fast as possible.
+
+import struct
+import time
+from threading import Lock
+from . import NatNetPacker
+
+CAPTURE_MAGIC = b'NNCAP'
+CAPTURE_FORMAT_VERSION = 1
+
+# Socket a packet arrived on
+CHANNEL_DATA = 0
+CHANNEL_COMMAND = 1
+
+CaptureHeader = struct.Struct( '<5sBBBBB' )
+PacketHeader = struct.Struct( '<qBI' )
+
+
+class PacketCaptureWriter:
+    """Appends packets to a capture file, safe to share between receive threads"""
+    def __init__(self, file_name, nat_net_version=(0,0,0,0)):
+        self.file = open(file_name, 'wb')
+        self.lock = Lock()
+        self.packet_count = 0
+        self.file.write(CaptureHeader.pack(CAPTURE_MAGIC, CAPTURE_FORMAT_VERSION, *nat_net_version[:4]))
+
+    def write_packet(self, channel, data, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(PacketHeader.pack(timestamp_ns, channel, len(data)))
+            self.file.write(data)
+            self.packet_count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class PacketCaptureReader:
+    """Reads a capture file written by PacketCaptureWriter"""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as capture_file:
+            header = capture_file.read(CaptureHeader.size)
+        if len(header) < CaptureHeader.size:
+            raise ValueError("%s: not a NatNet capture file"%file_name)
+        magic, format_version, *nat_net_version = CaptureHeader.unpack(header)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("%s: not a NatNet capture file"%file_name)
+        if format_version != CAPTURE_FORMAT_VERSION:
+            raise ValueError("%s: unsupported capture format version %d"%(file_name, format_version))
+        # Captures started before connecting have the version in the server info reply
+        if nat_net_version[0] == 0:
+            for timestamp_ns, channel, data in self.packets():
+                if int.from_bytes( data[0:2], byteorder='little',  signed=True ) == NatNetPacker.NAT_SERVERINFO:
+                    nat_net_version = list(data[4+256+4:4+256+8])
+                    break
+        self.nat_net_version = nat_net_version
+
+    def get_major(self):
+        return self.nat_net_version[0]
+
+    def get_minor(self):
+        return self.nat_net_version[1]
+
+    def packets(self):
+        """Iterate over ( timestamp_ns, channel, packet bytes ), stops at a truncated record"""
+        with open(self.file_name, 'rb') as capture_file:
+            capture_file.seek(CaptureHeader.size)
+            while True:
+                header = capture_file.read(PacketHeader.size)
+                if len(header) < PacketHeader.size:
+                    return
+                timestamp_ns, channel, packet_size = PacketHeader.unpack(header)
+                data = capture_file.read(packet_size)
+                if len(data) < packet_size:
+                    return
+                yield timestamp_ns, channel, data
+
+    def frame_packets(self):
+        """Only the NAT_FRAMEOFDATA packets, as a list"""
+        return [data for timestamp_ns, channel, data in self.packets()
+                if int.from_bytes( data[0:2], byteorder='little',  signed=True ) == NatNetPacker.NAT_FRAMEOFDATA]
+
+
+def replay_capture(file_name, client, speed=1.0, stop=None, print_level=0):
+    """Feed a capture through client.process_message.
+
+    speed 1.0 keeps the recorded packet timing, 2.0 replays twice as fast
+    and None or 0 as fast as possible.  stop, if given, is polled and ends
+    the replay when it returns True.  If the client has no NatNet version
+    yet it is set from the capture header.  The client stats restart with
+    the replay and count data channel packets as received and decoded, as
+    the client threads would.  Returns the number of packets replayed."""
+    reader = PacketCaptureReader(file_name)
+    if client.get_major() == 0 and reader.get_major() != 0:
+        client.process_message(NatNetPacker.pack_server_info("Capture Replay", [0,0,0,0], reader.nat_net_version))
+
+    client.reset_stats()
+    packet_count = 0
+    first_timestamp_ns = None
+    start = time.perf_counter()
+    for timestamp_ns, channel, data in reader.packets():
+        if stop is not None and stop():
+            break
+        if speed:
+            if first_timestamp_ns is None:
+                first_timestamp_ns = timestamp_ns
+            delay = (timestamp_ns - first_timestamp_ns) / 1e9 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if channel == CHANNEL_DATA:
+            client.count_packet(data, len(data))
+            client.process_message(data, print_level)
+            client.count_decoded_packet()
+        else:
+            client.process_message(data, print_level)
+        packet_count += 1
+    return packet_count
+
+
+# test program
+
+def test_capture_replay(major, minor):
+    """Capture packed frames, replay them and compare the frame listener output"""
+    import os
+    import tempfile
+    from . import NatNetClient
+    from . import NatNetDecoder
+    frames = [NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor)
+              for frame_num in range(5)]
+    handle, file_name = tempfile.mkstemp(suffix='.nncap')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = PacketCaptureWriter(file_name, [major, minor, 0, 0])
+        writer.write_packet(CHANNEL_COMMAND, NatNetPacker.pack_response("Ok"), 1000)
+        for frame_num, packet in enumerate(frames):
+            writer.write_packet(CHANNEL_DATA, memoryview(packet), 2000 + frame_num*1000)
+        writer.close()
+
+        reader = PacketCaptureReader(file_name)
+        if reader.frame_packets() != frames:
+            diffs.append("frame packets differ")
+
+        client = NatNetClient.NatNetClient()
+        client.set_use_fast_decoder(True)
+        frame_dicts = []
+        client.new_frame_listener = frame_dicts.append
+        packet_count = replay_capture(file_name, client, speed=None)
+        if packet_count != 6:
+            diffs.append("replayed %d packets != 6"%packet_count)
+        if (client.get_major(), client.get_minor()) != (major, minor):
+            diffs.append("version %d.%d"%(client.get_major(), client.get_minor()))
+        frame_numbers = [frame_dict['frame_number'] for frame_dict in frame_dicts]
+        if frame_numbers != list(range(5)):
+            diffs.append("frame numbers %s"%str(frame_numbers))
+        stats = client.stats()
+        if stats["frames_received"] != 5 or stats["packets_received"] != 5 or stats["packets_decoded"] != 5 or \
+           stats["bytes_received"] != sum(len(packet) for packet in frames):
+            diffs.append("stats %s"%str({ name : stats[name] for name in
+                         ["frames_received", "packets_received", "packets_decoded", "bytes_received"] }))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    for major, minor in [[3,1],[4,1]]:
+        test_name = "Test Capture Replay %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_capture_replay(major, minor), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -15,35 +15,64 @@
 # OptiTrack NatNet direct depacketization library for Python 3.x
 
 import sys
+import logging
 import socket
 import struct
-from threading import Thread
+from threading import Lock, Thread
 import copy
 import time
 from . import DataDescriptions
 from . import MoCapData
+from . import NatNetDecoder
+from . import NatNetRing
+from . import NatNetCapture
+from . import NatNetPoseBoard
+from . import NatNetLatency
+
+# Trace output is logged at DEBUG level
+logger = logging.getLogger(__name__)
+
+# Every trace point is guarded by its flag, so a disabled trace point costs
+# one global lookup: its arguments are never formatted.  Turn them on with
+# set_trace.
+TRACE = False
+#Used for Data Description functions
+TRACE_DD = False
+#Used for MoCap Frame Data functions
+TRACE_MF = False
+
+def set_trace( trace=False, trace_dd=False, trace_mf=False ):
+    """Enable the general, data description and mocap frame trace points"""
+    global TRACE, TRACE_DD, TRACE_MF
+    TRACE = trace
+    TRACE_DD = trace_dd
+    TRACE_MF = trace_mf
 
 def trace( *args ):
-    # uncomment the one you want to use
-    #print( "".join(map(str,args)) )
-    pass
+    logger.debug( "".join(map(str,args)) )
 
-#Used for Data Description functions
 def trace_dd( *args ):
-    # uncomment the one you want to use
-    #print( "".join(map(str,args)) )
-    pass
+    logger.debug( "".join(map(str,args)) )
 
-#Used for MoCap Frame Data functions
 def trace_mf( *args ):
-    # uncomment the one you want to use
-    #print( "".join(map(str,args)) )
-    pass
+    logger.debug( "".join(map(str,args)) )
 
 def get_message_id(data):
     message_id = int.from_bytes( data[0:2], byteorder='little',  signed=True )
     return message_id
 
+# Message names reported by NatNetClient.stats
+MESSAGE_NAMES = { 0 : "NAT_CONNECT", 1 : "NAT_SERVERINFO", 2 : "NAT_REQUEST", 3 : "NAT_RESPONSE",
+                  4 : "NAT_REQUEST_MODELDEF", 5 : "NAT_MODELDEF", 6 : "NAT_REQUEST_FRAMEOFDATA",
+                  7 : "NAT_FRAMEOFDATA", 8 : "NAT_MESSAGESTRING", 9 : "NAT_DISCONNECT",
+                  10 : "NAT_KEEPALIVE", 100 : "NAT_UNRECOGNIZED_REQUEST" }
+
+# A frame number this far below the last one is a restarted stream, not a late frame
+FRAME_NUMBER_RESET = 1000
+
+# Seconds before stale data descriptions are requested again when no reply came
+DATA_DESCRIPTIONS_RETRY = 2.0
+
 
 # Create structs for reading various object types to speed up parsing.
 Vector2 = struct.Struct( '<ff' )
@@ -83,6 +112,65 @@ class NatNetClient:
         self.rigid_body_listener = None
         self.new_frame_listener  = None
 
+        # Offset based frame decoder, enabled with set_use_fast_decoder
+        self.frame_decoder = None
+
+        # Frame sections to decode, None for all. See set_decode_sections
+        self.decode_sections = None
+
+        # Frame object reuse, see set_use_compact_frames and set_use_frame_pool
+        self.use_compact_frames = False
+        self.frame_pool = None
+
+        # Array decode mode, enabled with set_use_array_decoder.
+        # Listeners are called once per frame with ( frame_number, structured array ).
+        self.use_array_decoder = False
+        self.rigid_body_array_listener = None
+        self.labeled_marker_array_listener = None
+
+        # Batched frame delivery, see set_frame_batch_listener
+        self.frame_batcher = None
+
+        # Decoded frame fan-out to several consumers, see set_frame_hub
+        self.frame_hub = None
+
+        # Latest rigid body poses in shared memory, see start_pose_board
+        self.pose_board = None
+
+        # Time indexed rigid body poses, see set_pose_history
+        self.pose_history = None
+
+        # Per stage frame latency, see enable_latency_stats
+        self.latency_stats = None
+        self.latency_dump = None
+
+        # Rigid body subscriptions, see subscribe_rigid_body.
+        # Dictionaries of rigid body ID or name to listener.
+        self.rigid_body_subscriptions = {}
+        self.rigid_body_name_subscriptions = {}
+
+        # Latest data descriptions received from the server, kept until a
+        # frame reports tracked_models_changed, see invalidate_data_descriptions
+        self.data_descriptions = None
+        self.data_descriptions_changed = False
+        # time.monotonic() of the last request for new descriptions
+        self.data_descriptions_request_time = 0.0
+
+        # Data socket SO_RCVBUF size in bytes, None keeps the system default
+        self.receive_buffer_size = None
+
+        # Packets waiting between the receive and decode threads, see NatNetRing
+        self.receive_ring_size = NatNetRing.DEFAULT_NUM_SLOTS
+        self.receive_ring = None
+        # Packets are counted on the data thread and, in unicast mode, the command thread
+        self.counter_lock = Lock()
+
+        # Raw packet capture, see start_capture
+        self.packet_capture = None
+
+        # Data channel counters, see get_receive_counters and stats
+        self.reset_stats()
+
         # Set Application Name
         self.__application_name = "Not Set"
 
@@ -95,6 +183,9 @@ class NatNetClient:
         # server stream version. This will be updated to the actual version the server is using during initialization.
         self.__server_version = [0,0,0,0]
 
+        # Tick rate of the frame suffix stamps, 0 until the server info has it
+        self.high_resolution_clock_frequency = 0
+
         # Lock values once run is called
         self.__is_locked = False
 
@@ -103,6 +194,7 @@ class NatNetClient:
 
         self.command_thread = None
         self.data_thread = None
+        self.decode_thread = None
         self.command_socket = None
         self.data_socket = None
 
@@ -144,6 +236,327 @@ class NatNetClient:
         if not self.__is_locked:
             self.use_multicast = use_multicast
 
+    def set_receive_buffer_size(self, receive_buffer_size):
+        """Data socket SO_RCVBUF size in bytes, None keeps the system default"""
+        if not self.__is_locked:
+            self.receive_buffer_size = receive_buffer_size
+
+    def set_receive_ring_size(self, receive_ring_size):
+        """Number of packets that can wait for the decode thread before the oldest is dropped, at least 1"""
+        if not self.__is_locked:
+            self.receive_ring_size = receive_ring_size
+
+    def reset_stats(self):
+        """Restart the counters and times reported by get_receive_counters and stats"""
+        with self.counter_lock:
+            self.__reset_counters()
+        self.decode_times = NatNetLatency.LatencyHistogram()
+        self.listener_times = NatNetLatency.LatencyHistogram()
+        self.stats_start_time = time.perf_counter()
+
+    def __reset_counters(self):
+        self.packets_received = 0
+        self.packets_decoded = 0
+        self.frames_received = 0
+        self.frames_missing = 0
+        self.frames_out_of_order = 0
+        self.last_frame_number = None
+        self.bytes_received = 0
+        self.message_counts = {}
+
+    def stats(self):
+        """Frame loss, message and timing statistics since run or reset_stats.
+
+        frames_received: NAT_FRAMEOFDATA packets read from the data channel
+        frames_missing: frames never received, from gaps in the frame numbers
+        frames_out_of_order: frames arriving after a later frame, or twice
+        packets_received, packets_decoded, packets_dropped: see get_receive_counters
+        messages: processed message counts by message name
+        decode_ms: frame decode times, see NatNetLatency.LatencyHistogram.get_stats
+        listener_ms: times from the end of decoding to the last listener,
+            pose board, pose history and frame hub returning.
+            rigid_body_listener and, with the __unpack_* decoder, the other
+            listeners run while decoding and are part of decode_ms.
+        bytes_received, bytes_per_second: data channel bytes and average rate"""
+        elapsed = time.perf_counter() - self.stats_start_time
+        counters = self.get_receive_counters()
+        with self.counter_lock:
+            message_counts = dict(self.message_counts)
+            frames_received = self.frames_received
+            frames_out_of_order = self.frames_out_of_order
+            bytes_received = self.bytes_received
+        return { "frames_received"     : frames_received,
+                 "frames_missing"      : counters["missing"],
+                 "frames_out_of_order" : frames_out_of_order,
+                 "packets_received"    : counters["received"],
+                 "packets_decoded"     : counters["decoded"],
+                 "packets_dropped"     : counters["dropped"],
+                 "messages"            : { MESSAGE_NAMES.get(message_id, str(message_id)) : count
+                                           for message_id, count in message_counts.items() },
+                 "decode_ms"           : self.decode_times.get_stats(),
+                 "listener_ms"         : self.listener_times.get_stats(),
+                 "bytes_received"      : bytes_received,
+                 "bytes_per_second"    : bytes_received / elapsed if elapsed > 0 else 0.0,
+                 "elapsed_s"           : elapsed }
+
+    def get_receive_counters(self):
+        """Data channel packet counts.
+
+        received: packets read from the data socket
+        decoded: packets processed by the decode thread
+        dropped: packets discarded because the decode thread fell behind
+        missing: frames never received, from gaps in the frame numbers"""
+        dropped = 0
+        if self.receive_ring is not None:
+            dropped = self.receive_ring.dropped
+        with self.counter_lock:
+            return { "received" : self.packets_received,
+                     "decoded"  : self.packets_decoded,
+                     "dropped"  : dropped,
+                     "missing"  : self.frames_missing }
+
+    def set_frame_hub(self, frame_hub):
+        """Publish the MoCapData of every decoded frame to a NatNetHub.FrameHub, None to stop.
+
+        Each hub subscriber gets its own bounded queue, so slow consumers do
+        not hold up the decode thread.  The hub is not closed by shutdown."""
+        self.frame_hub = frame_hub
+
+    def start_capture(self, file_name):
+        """Write every packet received on the data and command sockets to a capture file.
+
+        See NatNetCapture for the format and replay_capture to play it back."""
+        self.stop_capture()
+        self.packet_capture = NatNetCapture.PacketCaptureWriter(file_name, self.__nat_net_requested_version)
+
+    def stop_capture(self):
+        packet_capture = self.packet_capture
+        self.packet_capture = None
+        if packet_capture is not None:
+            packet_capture.close()
+
+    def set_pose_history(self, pose_history):
+        """Add every decoded frame to a NatNetPoseHistory.PoseHistory, None to stop.
+
+        Frames are added on the decode thread, when the history uses the
+        host clock their time is taken as they are decoded."""
+        self.pose_history = pose_history
+
+    def start_pose_board(self, name=None, max_rigid_bodies=NatNetPoseBoard.DEFAULT_MAX_RIGID_BODIES):
+        """Publish the latest pose of every rigid body to shared memory, returns the block name.
+
+        Other processes read it with NatNetPoseBoard.PoseBoardReader( name ).
+        The block is removed by stop_pose_board or shutdown."""
+        self.stop_pose_board()
+        self.pose_board = NatNetPoseBoard.PoseBoardWriter(name, max_rigid_bodies)
+        return self.pose_board.get_name()
+
+    def stop_pose_board(self):
+        pose_board = self.pose_board
+        self.pose_board = None
+        if pose_board is not None:
+            pose_board.close()
+
+    def enable_latency_stats(self, enable=True, window=NatNetLatency.DEFAULT_WINDOW):
+        """Record the latency of every frame in a NatNetLatency.LatencyStats.
+
+        The Motive side stages need NatNet 3.0 or later stamps and a server
+        that sends its clock frequency.  With the __unpack_* decoder the
+        listeners run while decoding, so their time is in receive_to_decoded."""
+        self.stop_latency_dump()
+        if enable:
+            self.latency_stats = NatNetLatency.LatencyStats(window)
+        else:
+            self.latency_stats = None
+
+    def get_latency_stats(self):
+        """Dictionary from NatNetLatency.LatencyStats.get_stats, None if not enabled"""
+        latency_stats = self.latency_stats
+        if latency_stats is None:
+            return None
+        return latency_stats.get_stats()
+
+    def start_latency_dump(self, file_name, interval=1.0):
+        """Append the latency stats as a JSON line to file_name every interval seconds.
+
+        Enables the latency stats if needed, stopped by stop_latency_dump or shutdown."""
+        if self.latency_stats is None:
+            self.enable_latency_stats()
+        self.stop_latency_dump()
+        self.latency_dump = NatNetLatency.LatencyDump(self.latency_stats, file_name, interval)
+
+    def stop_latency_dump(self):
+        latency_dump = self.latency_dump
+        self.latency_dump = None
+        if latency_dump is not None:
+            latency_dump.stop()
+
+    def set_use_fast_decoder(self, use_fast_decoder):
+        """Decode frames with NatNetDecoder.FrameDecoder instead of the __unpack_* methods"""
+        self.use_array_decoder = False
+        if use_fast_decoder:
+            self.frame_decoder = NatNetDecoder.FrameDecoder(self.decode_sections)
+            self.__configure_frame_decoder()
+        else:
+            self.frame_decoder = None
+
+    def set_use_compact_frames(self, use_compact_frames):
+        """Decode into the __slots__ frame classes of MoCapData.compact_classes.
+
+        Needs the fast decoder.  Compact objects are smaller and quicker to
+        build, but listeners cannot add attributes of their own to them."""
+        self.use_compact_frames = use_compact_frames
+        if self.frame_decoder is not None:
+            self.frame_decoder.set_compact(use_compact_frames)
+
+    def set_use_frame_pool(self, use_frame_pool, max_frames=NatNetDecoder.DEFAULT_POOL_FRAMES):
+        """Reuse the objects of each frame for the following ones.
+
+        Needs the fast decoder.  A frame goes back to the pool once the
+        listeners, pose board and pose history are done with it, so
+        listeners must copy any object they keep.  Frames are not reused
+        while a frame hub is attached, its subscribers hold on to them, nor
+        by NatNetAsyncClient, which hands every frame to frames()."""
+        if use_frame_pool:
+            self.frame_pool = NatNetDecoder.FramePool(max_frames)
+        else:
+            self.frame_pool = None
+        if self.frame_decoder is not None:
+            self.frame_decoder.set_frame_pool(self.frame_pool)
+
+    def __configure_frame_decoder(self):
+        # Apply the client settings to a new frame decoder
+        self.frame_decoder.set_compact(self.use_compact_frames)
+        self.frame_decoder.set_frame_pool(self.frame_pool)
+        self.__update_rigid_body_filter()
+        self.__prepare_frame_decoder()
+
+    def __prepare_frame_decoder(self):
+        # Build the frame decoder plan once the stream version is known
+        if self.frame_decoder is not None and self.get_major() != 0:
+            self.frame_decoder.prepare(self.get_major(), self.get_minor())
+
+    def set_use_array_decoder(self, use_array_decoder):
+        """Decode rigid bodies and labeled markers into NumPy structured arrays.
+
+        rigid_body_listener is not called in this mode, rigid_body_array_listener
+        and labeled_marker_array_listener receive the whole section instead."""
+        if use_array_decoder:
+            # NumPy is only needed for this mode
+            from . import NatNetArrays
+            self.frame_decoder = NatNetArrays.ArrayFrameDecoder(self.decode_sections)
+            self.use_array_decoder = True
+            self.__configure_frame_decoder()
+        else:
+            self.set_use_fast_decoder(False)
+
+    def set_frame_batch_listener(self, frame_batch_listener, max_frames=None, max_time_ms=None):
+        """Deliver rigid body data in batches instead of once per frame.
+
+        frame_batch_listener is called with a NatNetArrays.FrameBatch holding
+        max_frames frames or max_time_ms of stream time, as columnar arrays of
+        frame number, timestamp and per rigid body pos/rot.  Frames still
+        waiting are delivered on shutdown.  Enables the array decoder, None
+        stops batching."""
+        if frame_batch_listener is None:
+            self.frame_batcher = None
+            return
+        from . import NatNetArrays
+        if not self.use_array_decoder:
+            self.set_use_array_decoder(True)
+        self.frame_batcher = NatNetArrays.FrameBatcher(frame_batch_listener, max_frames, max_time_ms)
+
+    def set_decode_sections(self, sections=None):
+        """Selective decode: only decode the listed frame sections, None for all.
+
+        Section names are NatNetDecoder.SECTION_NAMES, e.g. ["rigid_bodies"].
+        With NatNet 4.1 and later the other sections are jumped over using the
+        byte counts the server sends ahead of them and are left as None in the
+        decoded MoCapData.  Enables the fast decoder if it is not in use."""
+        self.decode_sections = sections
+        if self.frame_decoder is None:
+            self.set_use_fast_decoder(True)
+        else:
+            self.frame_decoder.set_sections(sections)
+
+    def subscribe_rigid_body(self, rigid_body_id, listener=None):
+        """Call listener( id, position, rotation ) for one rigid body only.
+
+        Once there is a subscription, rigid bodies nobody subscribed to are
+        stepped over by the decoder without building objects or calling any
+        listener, including rigid_body_listener.  Enables the fast decoder
+        if it is not in use."""
+        self.rigid_body_subscriptions[rigid_body_id] = listener
+        self.__update_rigid_body_filter()
+
+    def subscribe_rigid_body_name(self, name, listener=None):
+        """Same as subscribe_rigid_body, with the ID looked up in the data descriptions.
+
+        The data descriptions are requested from the server unless they are
+        already cached, the subscription takes effect once they arrive and
+        follows the name if they change."""
+        self.rigid_body_name_subscriptions[name] = listener
+        self.__update_rigid_body_filter()
+        if self.data_descriptions is None or self.data_descriptions_changed:
+            self.request_data_descriptions()
+
+    def unsubscribe_rigid_body(self, rigid_body):
+        """Remove a subscription by rigid body ID or name"""
+        self.rigid_body_subscriptions.pop(rigid_body, None)
+        self.rigid_body_name_subscriptions.pop(rigid_body, None)
+        self.__update_rigid_body_filter()
+
+    def mark_data_descriptions_stale(self):
+        """Mark the cached data descriptions as out of date.
+
+        Returns True when new ones should be requested: the first time
+        after a change, then again every DATA_DESCRIPTIONS_RETRY seconds
+        until the reply arrives."""
+        if self.data_descriptions is None:
+            return False
+        now = time.monotonic()
+        if self.data_descriptions_changed and now - self.data_descriptions_request_time < DATA_DESCRIPTIONS_RETRY:
+            return False
+        self.data_descriptions_changed = True
+        self.data_descriptions_request_time = now
+        return True
+
+    def request_data_descriptions(self):
+        """Send NAT_REQUEST_MODELDEF on the command socket, if it is open"""
+        if self.command_socket is not None:
+            self.send_request(self.command_socket, self.NAT_REQUEST_MODELDEF, "",  (self.server_ip_address, self.command_port) )
+
+    def invalidate_data_descriptions(self):
+        """Mark the cached data descriptions as out of date and request new ones.
+
+        Called when a frame suffix reports tracked_models_changed, and on
+        later frames while the descriptions are stale.  The cached
+        descriptions stay in use until the new ones arrive.  Returns True
+        if a request was sent."""
+        if not self.mark_data_descriptions_stale():
+            return False
+        self.request_data_descriptions()
+        return True
+
+    def __update_rigid_body_filter(self):
+        """Hand the decoder a new ID to listener dictionary built from the subscriptions"""
+        if not self.rigid_body_subscriptions and not self.rigid_body_name_subscriptions:
+            if self.frame_decoder is not None:
+                self.frame_decoder.set_rigid_body_filter(None)
+            return
+        rigid_body_filter = dict(self.rigid_body_subscriptions)
+        if self.data_descriptions is not None:
+            for name, listener in self.rigid_body_name_subscriptions.items():
+                rigid_body_id = self.data_descriptions.get_rigid_body_id(name)
+                if rigid_body_id is not None:
+                    rigid_body_filter[rigid_body_id] = listener
+        if self.frame_decoder is None:
+            # set_use_fast_decoder calls back in here once the decoder exists
+            self.set_use_fast_decoder(True)
+        else:
+            # A new dictionary rather than an update in place, the data thread may be decoding
+            self.frame_decoder.set_rigid_body_filter(rigid_body_filter)
+
     def can_change_bitstream_version(self):
         return self.__can_change_bitstream_version
 
@@ -160,6 +573,7 @@ class NatNetClient:
                 self.__nat_net_requested_version[1] = minor
                 self.__nat_net_requested_version[2] = 0
                 self.__nat_net_requested_version[3] = 0
+                self.__prepare_frame_decoder()
                 print("changing bitstream MAIN")
                 # get original output state
                 #print_results = self.get_print_results()
@@ -318,6 +732,11 @@ class NatNetClient:
             if(self.multicast_address != "255.255.255.255"):
                 result.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(self.multicast_address) + socket.inet_aton(self.local_ip_address))
 
+        if result is not None and self.receive_buffer_size is not None:
+            result.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+            if TRACE:
+                trace( "Data socket SO_RCVBUF: ", result.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) )
+
         return result
 
     # Unpack a rigid body object from a data packet
@@ -328,16 +747,19 @@ class NatNetClient:
         new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
 
-        trace_mf( "RB: %3.1d ID: %3.1d"% (rb_num, new_id))
+        if TRACE_MF:
+            trace_mf( "RB: %3.1d ID: %3.1d"% (rb_num, new_id))
 
         # Position and orientation
         pos = Vector3.unpack( data[offset:offset+12] )
         offset += 12
-        trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
+        if TRACE_MF:
+            trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
 
         rot = Quaternion.unpack( data[offset:offset+16] )
         offset += 16
-        trace_mf( "\tOrientation : [%3.2f, %3.2f, %3.2f, %3.2f]"% (rot[0], rot[1], rot[2], rot[3] ))
+        if TRACE_MF:
+            trace_mf( "\tOrientation : [%3.2f, %3.2f, %3.2f, %3.2f]"% (rot[0], rot[1], rot[2], rot[3] ))
 
         rigid_body = MoCapData.RigidBody(new_id, pos, rot)
 
@@ -351,7 +773,8 @@ class NatNetClient:
             marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
             marker_count_range = range( 0, marker_count )
-            trace_mf( "\tMarker Count:", marker_count )
+            if TRACE_MF:
+                trace_mf( "\tMarker Count:", marker_count )
 
             rb_marker_list=[]
             for i in marker_count_range:
@@ -361,7 +784,8 @@ class NatNetClient:
             for i in marker_count_range:
                 pos = Vector3.unpack( data[offset:offset+12] )
                 offset += 12
-                trace_mf( "\tMarker", i, ":", pos[0],",", pos[1],",", pos[2] )
+                if TRACE_MF:
+                    trace_mf( "\tMarker", i, ":", pos[0],",", pos[1],",", pos[2] )
                 rb_marker_list[i].pos=pos
 
             if major >= 2:
@@ -369,14 +793,16 @@ class NatNetClient:
                 for i in marker_count_range:
                     new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                     offset += 4
-                    trace_mf( "\tMarker ID", i, ":", new_id )
+                    if TRACE_MF:
+                        trace_mf( "\tMarker ID", i, ":", new_id )
                     rb_marker_list[i].id=new_id
 
                 # Marker sizes
                 for i in marker_count_range:
                     size = FloatValue.unpack( data[offset:offset+4] )
                     offset += 4
-                    trace_mf( "\tMarker Size", i, ":", size[0] )
+                    if TRACE_MF:
+                        trace_mf( "\tMarker Size", i, ":", size[0] )
                     rb_marker_list[i].size=size
 
             for i in marker_count_range:
@@ -384,7 +810,8 @@ class NatNetClient:
         if major >= 2 :
             marker_error, = FloatValue.unpack( data[offset:offset+4] )
             offset += 4
-            trace_mf( "\tMean Marker Error: %3.2f"% marker_error )
+            if TRACE_MF:
+                trace_mf( "\tMean Marker Error: %3.2f"% marker_error )
             rigid_body.error = marker_error
 
         # Version 2.6 and later
@@ -392,10 +819,11 @@ class NatNetClient:
             param, = struct.unpack( 'h', data[offset:offset+2] )
             tracking_valid = ( param & 0x01 ) != 0
             offset += 2
-            is_valid_str='False'
-            if tracking_valid:
-                is_valid_str = 'True'
-            trace_mf( "\tTracking Valid: %s"%is_valid_str)
+            if TRACE_MF:
+                is_valid_str='False'
+                if tracking_valid:
+                    is_valid_str = 'True'
+                trace_mf( "\tTracking Valid: %s"%is_valid_str)
             if tracking_valid:
                 rigid_body.tracking_valid = True
             else:
@@ -408,12 +836,14 @@ class NatNetClient:
         offset = 0
         new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Skeleton %3.1d ID: %3.1d"% (skeleton_num, new_id ))
+        if TRACE_MF:
+            trace_mf( "Skeleton %3.1d ID: %3.1d"% (skeleton_num, new_id ))
         skeleton = MoCapData.Skeleton(new_id)
 
         rigid_body_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Rigid Body Count : %3.1d"% rigid_body_count )
+        if TRACE_MF:
+            trace_mf( "Rigid Body Count : %3.1d"% rigid_body_count )
         if(rigid_body_count > 0):
             for rb_num in range( 0, rigid_body_count ):
                 offset_tmp, rigid_body = self.__unpack_rigid_body( data[offset:], major, minor, rb_num )
@@ -424,19 +854,22 @@ class NatNetClient:
 
     def __unpack_asset( self, data, major, minor, asset_num=0):
         offset = 0
-        trace_dd( "\tAsset        : %d"% (asset_num ))
+        if TRACE_DD:
+            trace_dd( "\tAsset        : %d"% (asset_num ))
         # Asset ID 4 bytes
         new_id =  int.from_bytes(data[offset:offset+4],'little',  signed=True)
         offset += 4
         asset = MoCapData.Asset()
     
-        trace_dd( "\tAsset ID     : %d"% (new_id ))
+        if TRACE_DD:
+            trace_dd( "\tAsset ID     : %d"% (new_id ))
         asset.set_id(new_id)
 
         # # of RigidBodies
         numRBs =  int.from_bytes(data[offset:offset+4],'little',  signed=True)
         offset += 4
-        trace_dd( "\tRigid Bodies : %d" % (numRBs))
+        if TRACE_DD:
+            trace_dd( "\tRigid Bodies : %d" % (numRBs))
         
         offset1=0
         for rb_num in range(numRBs):
@@ -449,7 +882,8 @@ class NatNetClient:
         # # of Markers
         numMarkers =  int.from_bytes(data[offset:offset+4],'little',  signed=True)
         offset += 4
-        trace_dd( "\tMarkers      : %d" % (numMarkers))
+        if TRACE_DD:
+            trace_dd( "\tMarkers      : %d" % (numMarkers))
         
         for marker_num in range(numMarkers):
             # # of Markers
@@ -466,7 +900,8 @@ class NatNetClient:
         # Frame number (4 bytes)
         frame_number = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Frame #: %3.1d"% frame_number )
+        if TRACE_MF:
+            trace_mf( "Frame #: %3.1d"% frame_number )
         frame_prefix_data=MoCapData.FramePrefixData(frame_number)
         return offset, frame_prefix_data
 
@@ -477,7 +912,8 @@ class NatNetClient:
         if( ( (major == 4) and (minor>0) ) or (major > 4)):
             sizeInBytes = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_mf( "Byte Count: %3.1d"% sizeInBytes )
+            if TRACE_MF:
+                trace_mf( "Byte Count: %3.1d"% sizeInBytes )
 
         return offset, sizeInBytes
 
@@ -487,7 +923,8 @@ class NatNetClient:
         # Markerset count (4 bytes)
         other_marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Other Marker Count:", other_marker_count )
+        if TRACE_MF:
+            trace_mf( "Other Marker Count:", other_marker_count )
 
         # get data size (4 bytes)
         offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -500,7 +937,8 @@ class NatNetClient:
             for j in range( 0, other_marker_count ):
                 pos = Vector3.unpack( data[offset:offset+12] )
                 offset += 12
-                trace_mf( "\tMarker %3.1d : [x=%3.2f,y=%3.2f,z=%3.2f]"%( j, pos[0], pos[1], pos[2] ))
+                if TRACE_MF:
+                    trace_mf( "\tMarker %3.1d : [x=%3.2f,y=%3.2f,z=%3.2f]"%( j, pos[0], pos[1], pos[2] ))
                 other_marker_data.add_pos(pos)
  
         return offset, other_marker_data
@@ -511,7 +949,8 @@ class NatNetClient:
         # Markerset count (4 bytes)
         marker_set_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Markerset Count:", marker_set_count )
+        if TRACE_MF:
+            trace_mf( "Markerset Count:", marker_set_count )
 
         # get data size (4 bytes)
         offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -522,7 +961,8 @@ class NatNetClient:
             # Model name
             model_name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( model_name ) + 1
-            trace_mf( "Model Name      : ", model_name.decode( 'utf-8' ) )
+            if TRACE_MF:
+                trace_mf( "Model Name      : ", model_name.decode( 'utf-8' ) )
             marker_data.set_model_name(model_name)
             # Marker count (4 bytes)
             marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
@@ -536,7 +976,8 @@ class NatNetClient:
                 offset = len(data)
                 return offset, marker_set_data
 
-            trace_mf( "Marker Count    : ", marker_count )
+            if TRACE_MF:
+                trace_mf( "Marker Count    : ", marker_count )
             for j in range( 0, marker_count ):
                 if(len(data)<(offset+12)):
                     print("WARNING: Early return.  Out of data at marker ",j," of ", marker_count)
@@ -545,7 +986,8 @@ class NatNetClient:
                     break
                 pos = Vector3.unpack( data[offset:offset+12] )
                 offset += 12
-                trace_mf( "\tMarker %3.1d : [x=%3.2f,y=%3.2f,z=%3.2f]"%( j, pos[0], pos[1], pos[2] ))
+                if TRACE_MF:
+                    trace_mf( "\tMarker %3.1d : [x=%3.2f,y=%3.2f,z=%3.2f]"%( j, pos[0], pos[1], pos[2] ))
                 marker_data.add_pos(pos)
             marker_set_data.add_marker_data(marker_data)
 
@@ -567,7 +1009,8 @@ class NatNetClient:
         # Rigid body count (4 bytes)
         rigid_body_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Rigid Body Count:", rigid_body_count )
+        if TRACE_MF:
+            trace_mf( "Rigid Body Count:", rigid_body_count )
 
         # get data size (4 bytes)
         offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -590,7 +1033,8 @@ class NatNetClient:
         if( ( major == 2 and minor > 0 ) or major > 2 ):
             skeleton_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_mf( "Skeleton Count:", skeleton_count )
+            if TRACE_MF:
+                trace_mf( "Skeleton Count:", skeleton_count )
             
             # Get data size (4 bytes)
             offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -618,7 +1062,8 @@ class NatNetClient:
         if( ( major == 2 and minor > 3 ) or major > 2 ):
             labeled_marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_mf( "Labeled Marker Count:", labeled_marker_count )
+            if TRACE_MF:
+                trace_mf( "Labeled Marker Count:", labeled_marker_count )
 
             # get data size (4 bytes)
             offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -634,9 +1079,10 @@ class NatNetClient:
                 offset += 12
                 size = FloatValue.unpack( data[offset:offset+4] )
                 offset += 4
-                trace_mf("%3.1d ID     : [MarkerID: %3.1d] [ModelID: %3.1d]"%(lm_num, marker_id,model_id))
-                trace_mf("    pos  : [%3.2f, %3.2f, %3.2f]"%(pos[0],pos[1],pos[2]))
-                trace_mf("    size : [%3.2f]"%size)
+                if TRACE_MF:
+                    trace_mf("%3.1d ID     : [MarkerID: %3.1d] [ModelID: %3.1d]"%(lm_num, marker_id,model_id))
+                    trace_mf("    pos  : [%3.2f, %3.2f, %3.2f]"%(pos[0],pos[1],pos[2]))
+                    trace_mf("    size : [%3.2f]"%size)
 
 
                 # Version 2.6 and later
@@ -654,7 +1100,8 @@ class NatNetClient:
                     residual, = FloatValue.unpack( data[offset:offset+4] )
                     offset += 4
                     residual = residual * 1000.0
-                    trace_mf( "    err  : [%3.2f]"% residual )
+                    if TRACE_MF:
+                        trace_mf( "    err  : [%3.2f]"% residual )
 
                 labeled_marker = MoCapData.LabeledMarker(tmp_id,pos,size,param, residual)
                 labeled_marker_data.add_labeled_marker(labeled_marker)
@@ -670,7 +1117,8 @@ class NatNetClient:
         if( ( major == 2 and minor >= 9 ) or major > 2 ):
             force_plate_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_mf( "Force Plate Count:", force_plate_count )
+            if TRACE_MF:
+                trace_mf( "Force Plate Count:", force_plate_count )
 
             # get data size (4 bytes)
             offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -686,15 +1134,17 @@ class NatNetClient:
                 force_plate_channel_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                 offset += 4
 
-                trace_mf( "\tForce Plate %3.1d ID: %3.1d Num Channels: %3.1d"% (i, force_plate_id, force_plate_channel_count ))
+                if TRACE_MF:
+                    trace_mf( "\tForce Plate %3.1d ID: %3.1d Num Channels: %3.1d"% (i, force_plate_id, force_plate_channel_count ))
 
                 # Channel Data
                 for j in range( force_plate_channel_count ):
                     fp_channel_data = MoCapData.ForcePlateChannelData()
                     force_plate_channel_frame_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                     offset += 4
-                    out_string="\tChannel %3.1d: "%( j )
-                    out_string+="  %3.1d Frames - Frame Data: "%(force_plate_channel_frame_count)
+                    if TRACE_MF:
+                        out_string="\tChannel %3.1d: "%( j )
+                        out_string+="  %3.1d Frames - Frame Data: "%(force_plate_channel_frame_count)
 
                     # Force plate frames
                     n_frames_show = min(force_plate_channel_frame_count, n_frames_show_max)
@@ -703,11 +1153,12 @@ class NatNetClient:
                         offset += 4
                         fp_channel_data.add_frame_entry(force_plate_channel_val)
 
-                        if k < n_frames_show:
+                        if TRACE_MF and k < n_frames_show:
                             out_string += "%3.2f "%(force_plate_channel_val)
-                    if n_frames_show < force_plate_channel_frame_count:
-                        out_string += " showing %3.1d of %3.1d frames"%(n_frames_show, force_plate_channel_frame_count)
-                    trace_mf( "%s"% out_string )
+                    if TRACE_MF:
+                        if n_frames_show < force_plate_channel_frame_count:
+                            out_string += " showing %3.1d of %3.1d frames"%(n_frames_show, force_plate_channel_frame_count)
+                        trace_mf( "%s"% out_string )
                     force_plate.add_channel_data(fp_channel_data)
                 force_plate_data.add_force_plate(force_plate)
         return offset, force_plate_data
@@ -721,7 +1172,8 @@ class NatNetClient:
         if ( major == 2 and minor >= 11 ) or (major > 2) :
             device_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_mf( "Device Count:", device_count )
+            if TRACE_MF:
+                trace_mf( "Device Count:", device_count )
 
             # get data size (4 bytes)
             offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -737,15 +1189,17 @@ class NatNetClient:
                 device_channel_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                 offset += 4
 
-                trace_mf( "\tDevice %3.1d      ID: %3.1d Num Channels: %3.1d"% (i, device_id, device_channel_count ))
+                if TRACE_MF:
+                    trace_mf( "\tDevice %3.1d      ID: %3.1d Num Channels: %3.1d"% (i, device_id, device_channel_count ))
 
                 # Channel Data
                 for j in range( 0, device_channel_count ):
                     device_channel_data = MoCapData.DeviceChannelData()
                     device_channel_frame_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                     offset += 4
-                    out_string="\tChannel %3.1d "% (j)
-                    out_string+="  %3.1d Frames - Frame Data: "%(device_channel_frame_count)
+                    if TRACE_MF:
+                        out_string="\tChannel %3.1d "% (j)
+                        out_string+="  %3.1d Frames - Frame Data: "%(device_channel_frame_count)
 
                     # Device Frame Data
                     n_frames_show = min(device_channel_frame_count, n_frames_show_max)
@@ -753,13 +1207,14 @@ class NatNetClient:
                         device_channel_val = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
                         device_channel_val = FloatValue.unpack( data[offset:offset+4] )
                         offset += 4
-                        if k < n_frames_show:
+                        if TRACE_MF and k < n_frames_show:
                             out_string += "%3.2f "%(device_channel_val)
 
                         device_channel_data.add_frame_entry(device_channel_val)
-                    if n_frames_show < device_channel_frame_count:
-                        out_string += " showing %3.1d of %3.1d frames"%(n_frames_show, device_channel_frame_count)
-                    trace_mf( "%s"% out_string )
+                    if TRACE_MF:
+                        if n_frames_show < device_channel_frame_count:
+                            out_string += " showing %3.1d of %3.1d frames"%(n_frames_show, device_channel_frame_count)
+                        trace_mf( "%s"% out_string )
                     device.add_channel_data(device_channel_data)
                 device_data.add_device(device)
         return offset, device_data
@@ -790,24 +1245,28 @@ class NatNetClient:
             else:
                 timestamp, = FloatValue.unpack( data[offset:offset+4] )
                 offset += 4
-            trace_mf("Timestamp : %3.2f"%timestamp)
+            if TRACE_MF:
+                trace_mf("Timestamp : %3.2f"%timestamp)
             frame_suffix_data.timestamp = timestamp
 
             # Hires Timestamp (Version 3.0 and later)
             if major >= 3 :
                 stamp_camera_mid_exposure = int.from_bytes( data[offset:offset+8], byteorder='little',  signed=True )
-                trace_mf("Mid-exposure timestamp         : %3.1d"%stamp_camera_mid_exposure)
+                if TRACE_MF:
+                    trace_mf("Mid-exposure timestamp         : %3.1d"%stamp_camera_mid_exposure)
                 offset += 8
                 frame_suffix_data.stamp_camera_mid_exposure = stamp_camera_mid_exposure
 
                 stamp_data_received = int.from_bytes( data[offset:offset+8], byteorder='little',  signed=True )
                 offset += 8
                 frame_suffix_data.stamp_data_received = stamp_data_received
-                trace_mf("Camera data received timestamp : %3.1d"%stamp_data_received)
+                if TRACE_MF:
+                    trace_mf("Camera data received timestamp : %3.1d"%stamp_data_received)
 
                 stamp_transmit = int.from_bytes( data[offset:offset+8], byteorder='little',  signed=True )
                 offset += 8
-                trace_mf("Transmit timestamp             : %3.1d"%stamp_transmit)
+                if TRACE_MF:
+                    trace_mf("Transmit timestamp             : %3.1d"%stamp_transmit)
                 frame_suffix_data.stamp_transmit = stamp_transmit
 
             # Precision Timestamp (Version 4.1 and later) (defaults as 0 if N/A)
@@ -818,12 +1277,14 @@ class NatNetClient:
                 #seconds=prec_timestamp_secs%60
                 #out_string="Precision timestamp (h:m:s) - %4.1d:%2.2d:%2.2d"%(hours, minutes, seconds)
                 #trace_mf("%s"%out_string)
-                trace_mf("Precision timestamp (sec)      : %3.1d"%prec_timestamp_secs)
+                if TRACE_MF:
+                    trace_mf("Precision timestamp (sec)      : %3.1d"%prec_timestamp_secs)
                 offset += 4
                 frame_suffix_data.prec_timestamp_secs = prec_timestamp_secs
 
                 prec_timestamp_frac_secs = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
-                trace_mf("Precision timestamp (frac sec) : %3.1d"%prec_timestamp_frac_secs)
+                if TRACE_MF:
+                    trace_mf("Precision timestamp (frac sec) : %3.1d"%prec_timestamp_frac_secs)
                 offset += 4
                 frame_suffix_data.prec_timestamp_frac_secs = prec_timestamp_frac_secs
 
@@ -943,17 +1404,20 @@ class NatNetClient:
 
         name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
         offset += len( name ) + 1
-        trace_dd( "Markerset Name: %s" % (name.decode( 'utf-8' )) )
+        if TRACE_DD:
+            trace_dd( "Markerset Name: %s" % (name.decode( 'utf-8' )) )
         ms_desc.set_name(name)
 
         marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "Marker Count : %3.1d" % marker_count)
+        if TRACE_DD:
+            trace_dd( "Marker Count : %3.1d" % marker_count)
         if(marker_count > 0):
             for i in range( 0, marker_count ):
                 name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
                 offset += len( name ) + 1
-                trace_dd( "\t%2.1d Marker Name: %s"%(i, name.decode( 'utf-8' ) ))
+                if TRACE_DD:
+                    trace_dd( "\t%2.1d Marker Name: %s"%(i, name.decode( 'utf-8' ) ))
                 ms_desc.add_marker_name(name)
 
         return offset, ms_desc
@@ -968,35 +1432,41 @@ class NatNetClient:
             name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( name ) + 1
             rb_desc.set_name(name)
-            trace_dd( "\tRigid Body Name   : ", name.decode( 'utf-8' ) )
+            if TRACE_DD:
+                trace_dd( "\tRigid Body Name   : ", name.decode( 'utf-8' ) )
 
         # ID
         new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
         rb_desc.set_id(new_id)
-        trace_dd( "\tRigid Body ID       : ", str(new_id))
+        if TRACE_DD:
+            trace_dd( "\tRigid Body ID       : ", str(new_id))
 
         #Parent ID
         parent_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
         rb_desc.set_parent_id(parent_id)
-        trace_dd( "\tParent ID         : ", parent_id)
+        if TRACE_DD:
+            trace_dd( "\tParent ID         : ", parent_id)
 
         # Position Offsets
         pos = Vector3.unpack( data[offset:offset+12] )
         offset += 12
         rb_desc.set_pos(pos[0],pos[1],pos[2])
 
-        trace_dd( "\tPosition          : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
+        if TRACE_DD:
+            trace_dd( "\tPosition          : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
 
         # Version 3.0 and higher, rigid body marker information contained in description
         if (major >= 3) or (major == 0) :
             # Marker Count
             marker_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_dd( "\tNumber of Markers : ", marker_count )
+            if TRACE_DD:
+                trace_dd( "\tNumber of Markers : ", marker_count )
             if marker_count > 0:
-                trace_dd( "\tMarker Positions : " )
+                if TRACE_DD:
+                    trace_dd( "\tMarker Positions : " )
             
             marker_count_range = range( 0, marker_count )
             offset1 = offset
@@ -1022,12 +1492,14 @@ class NatNetClient:
 
                 rb_marker=DataDescriptions.RBMarker(marker_name,active_label,marker_offset)
                 rb_desc.add_rb_marker(rb_marker)
-                trace_dd( "\t%3.1d Marker Label: %s Position: [ %3.2f %3.2f %3.2f] %s" % (marker,active_label,\
-                   marker_offset[0], marker_offset[1], marker_offset[2],marker_name ))
+                if TRACE_DD:
+                    trace_dd( "\t%3.1d Marker Label: %s Position: [ %3.2f %3.2f %3.2f] %s" % (marker,active_label,\
+                       marker_offset[0], marker_offset[1], marker_offset[2],marker_name ))
 
             offset = offset3
         
-        trace_dd("\tunpack_rigid_body_description processed bytes: ", offset)
+        if TRACE_DD:
+            trace_dd("\tunpack_rigid_body_description processed bytes: ", offset)
         return offset, rb_desc
 
     # Unpack a skeleton description packet
@@ -1039,22 +1511,26 @@ class NatNetClient:
         name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
         offset += len( name ) + 1
         skeleton_desc.set_name(name)
-        trace_dd( "Name : %s"% name.decode( 'utf-8' ) )
+        if TRACE_DD:
+            trace_dd( "Name : %s"% name.decode( 'utf-8' ) )
 
         #ID
         new_id = int.from_bytes( data[offset:offset+4], byteorder='little', signed=True )
         offset += 4
         skeleton_desc.set_id(new_id)
-        trace_dd( "ID : %3.1d"% new_id )
+        if TRACE_DD:
+            trace_dd( "ID : %3.1d"% new_id )
 
         # # of RigidBodies
         rigid_body_count = int.from_bytes( data[offset:offset+4], byteorder='little', signed=True )
         offset += 4
-        trace_dd( "Rigid Body (Bone) Count : %3.1d" % rigid_body_count)
+        if TRACE_DD:
+            trace_dd( "Rigid Body (Bone) Count : %3.1d" % rigid_body_count)
 
         # Loop over all Rigid Bodies
         for i in range( 0, rigid_body_count ):
-            trace_dd("Rigid Body (Bone) %d:" % (i))
+            if TRACE_DD:
+                trace_dd("Rigid Body (Bone) %d:" % (i))
             offset_tmp, rb_desc_tmp = self.__unpack_rigid_body_description( data[offset:], major, minor )
             offset+= offset_tmp
             skeleton_desc.add_rigid_body_description(rb_desc_tmp)
@@ -1069,39 +1545,46 @@ class NatNetClient:
             new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
             fp_desc.set_id(new_id)
-            trace_dd("\tID : ", str(new_id))
+            if TRACE_DD:
+                trace_dd("\tID : ", str(new_id))
 
             # Serial Number
             serial_number, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( serial_number ) + 1
             fp_desc.set_serial_number(serial_number)
-            trace_dd( "\tSerial Number : ", serial_number.decode( 'utf-8' ) )
+            if TRACE_DD:
+                trace_dd( "\tSerial Number : ", serial_number.decode( 'utf-8' ) )
 
             # Dimensions
             f_width = FloatValue.unpack( data[offset:offset+4])
             offset += 4
-            trace_dd( "\tWidth  : %3.2f"% f_width)
+            if TRACE_DD:
+                trace_dd( "\tWidth  : %3.2f"% f_width)
             f_length = FloatValue.unpack( data[offset:offset+4])
             offset += 4
             fp_desc.set_dimensions(f_width[0], f_length[0])
-            trace_dd( "\tLength : %3.2f"% f_length)
+            if TRACE_DD:
+                trace_dd( "\tLength : %3.2f"% f_length)
 
             # Origin
             origin = Vector3.unpack( data[offset:offset+12] )
             offset += 12
             fp_desc.set_origin(origin[0],origin[1],origin[2])
-            trace_dd( "\tOrigin : [%3.2f, %3.2f, %3.2f]"%( origin[0], origin[1], origin[2] ))
+            if TRACE_DD:
+                trace_dd( "\tOrigin : [%3.2f, %3.2f, %3.2f]"%( origin[0], origin[1], origin[2] ))
 
             # Calibration Matrix 12x12 floats
-            trace_dd("Cal Matrix:")
+            if TRACE_DD:
+                trace_dd("Cal Matrix:")
             cal_matrix_tmp= [[0.0 for col in range(12)] for row in range(12)]
 
             for i in range(0,12):
                 cal_matrix_row=FPCalMatrixRow.unpack(data[offset:offset+(12*4)])
-                trace_dd("\t%3.1d %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e" % (i
-                      , cal_matrix_row[0], cal_matrix_row[1], cal_matrix_row[2], cal_matrix_row[3]
-                      , cal_matrix_row[4], cal_matrix_row[5], cal_matrix_row[6], cal_matrix_row[7]
-                      , cal_matrix_row[8], cal_matrix_row[9], cal_matrix_row[10], cal_matrix_row[11]))
+                if TRACE_DD:
+                    trace_dd("\t%3.1d %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e %3.3e" % (i
+                          , cal_matrix_row[0], cal_matrix_row[1], cal_matrix_row[2], cal_matrix_row[3]
+                          , cal_matrix_row[4], cal_matrix_row[5], cal_matrix_row[6], cal_matrix_row[7]
+                          , cal_matrix_row[8], cal_matrix_row[9], cal_matrix_row[10], cal_matrix_row[11]))
                 cal_matrix_tmp[i] = copy.deepcopy(cal_matrix_row)
                 offset += (12*4)
             fp_desc.set_cal_matrix(cal_matrix_tmp)
@@ -1109,10 +1592,12 @@ class NatNetClient:
             corners = FPCorners.unpack(data[offset:offset + (12*4)])
             offset += (12*4)
             o_2=0
-            trace_dd("Corners:")
+            if TRACE_DD:
+                trace_dd("Corners:")
             corners_tmp = [[0.0 for col in range(3)] for row in range(4)]
             for i in range(0,4):
-                trace_dd("\t%3.1d %3.3e %3.3e %3.3e"%(i, corners[o_2], corners[o_2+1], corners[o_2+2]))
+                if TRACE_DD:
+                    trace_dd("\t%3.1d %3.3e %3.3e %3.3e"%(i, corners[o_2], corners[o_2+1], corners[o_2+2]))
                 corners_tmp[i][0]=corners[o_2]
                 corners_tmp[i][1]=corners[o_2+1]
                 corners_tmp[i][2]=corners[o_2+2]
@@ -1123,27 +1608,32 @@ class NatNetClient:
             plate_type = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
             fp_desc.set_plate_type(plate_type)
-            trace_dd ("Plate Type : ", plate_type)
+            if TRACE_DD:
+                trace_dd ("Plate Type : ", plate_type)
 
             # Channel Data Type int
             channel_data_type = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
             fp_desc.set_channel_data_type(channel_data_type)
-            trace_dd("Channel Data Type : ", channel_data_type)
+            if TRACE_DD:
+                trace_dd("Channel Data Type : ", channel_data_type)
 
             # Number of Channels int
             num_channels = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
-            trace_dd("Number of Channels : ", num_channels)
+            if TRACE_DD:
+                trace_dd("Number of Channels : ", num_channels)
 
             # Channel Names list of NoC strings
             for i in range(0, num_channels):
                 channel_name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
                 offset += len( channel_name ) + 1
-                trace_dd( "\tChannel Name %3.1d: %s"%(i, channel_name.decode( 'utf-8' ) ))
+                if TRACE_DD:
+                    trace_dd( "\tChannel Name %3.1d: %s"%(i, channel_name.decode( 'utf-8' ) ))
                 fp_desc.add_channel_name(channel_name)
 
-        trace_dd("unpackForcePlate processed ", offset, " bytes")
+        if TRACE_DD:
+            trace_dd("unpackForcePlate processed ", offset, " bytes")
         return offset, fp_desc
 
     def __unpack_device_description(self, data, major, minor):
@@ -1153,44 +1643,52 @@ class NatNetClient:
             # new_id
             new_id = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
-            trace_dd("\tID : ", str(new_id))
+            if TRACE_DD:
+                trace_dd("\tID : ", str(new_id))
 
             # Name
             name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( name ) + 1
-            trace_dd( "\tName : ", name.decode( 'utf-8' ) )
+            if TRACE_DD:
+                trace_dd( "\tName : ", name.decode( 'utf-8' ) )
 
             # Serial Number
             serial_number, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( serial_number ) + 1
-            trace_dd( "\tSerial Number : ", serial_number.decode( 'utf-8' ) )
+            if TRACE_DD:
+                trace_dd( "\tSerial Number : ", serial_number.decode( 'utf-8' ) )
 
 
             # Device Type int
             device_type = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
-            trace_dd ("Device Type : ", device_type)
+            if TRACE_DD:
+                trace_dd ("Device Type : ", device_type)
 
             # Channel Data Type int
             channel_data_type = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
-            trace_dd("Channel Data Type : ", channel_data_type)
+            if TRACE_DD:
+                trace_dd("Channel Data Type : ", channel_data_type)
 
             device_desc = DataDescriptions.DeviceDescription(new_id,name,serial_number,device_type,channel_data_type)
 
             # Number of Channels int
             num_channels = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset+=4
-            trace_dd("Number of Channels ", num_channels)
+            if TRACE_DD:
+                trace_dd("Number of Channels ", num_channels)
 
             # Channel Names list of NoC strings
             for i in range(0, num_channels):
                 channel_name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
                 offset += len( channel_name ) + 1
                 device_desc.add_channel_name(channel_name)
-                trace_dd( "\tChannel ",i," Name : ", channel_name.decode( 'utf-8' ) )
+                if TRACE_DD:
+                    trace_dd( "\tChannel ",i," Name : ", channel_name.decode( 'utf-8' ) )
 
-        trace_dd("unpack_device_description processed ", offset, " bytes")
+        if TRACE_DD:
+            trace_dd("unpack_device_description processed ", offset, " bytes")
         return offset, device_desc
 
     def __unpack_camera_description(self, data, major, minor):
@@ -1198,17 +1696,20 @@ class NatNetClient:
         # Name
         name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
         offset += len( name ) + 1
-        trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
+        if TRACE_DD:
+            trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
         # Position
         position = Vector3.unpack( data[offset:offset+12] )
         offset += 12
-        trace_dd( "\tPosition   : [%3.2f, %3.2f, %3.2f]"% (position[0], position[1], position[2] ))
+        if TRACE_DD:
+            trace_dd( "\tPosition   : [%3.2f, %3.2f, %3.2f]"% (position[0], position[1], position[2] ))
 
         # Orientation
         orientation = Quaternion.unpack( data[offset:offset+16] )
         offset += 16
-        trace_dd( "\tOrientation: [%3.2f, %3.2f, %3.2f, %3.2f]"% (orientation[0], orientation[1], orientation[2], orientation[3] ))
-        trace_dd("unpack_camera_description processed %3.1d bytes"% offset)
+        if TRACE_DD:
+            trace_dd( "\tOrientation: [%3.2f, %3.2f, %3.2f, %3.2f]"% (orientation[0], orientation[1], orientation[2], orientation[3] ))
+            trace_dd("unpack_camera_description processed %3.1d bytes"% offset)
 
         camera_desc=DataDescriptions.CameraDescription(name, position, orientation)
         return offset, camera_desc
@@ -1220,29 +1721,35 @@ class NatNetClient:
         # Name
         name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
         offset += len( name ) + 1
-        trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
+        if TRACE_DD:
+            trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
 
         # ID
         marker_id =  int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "\tID         : %d"% (marker_id ))
+        if TRACE_DD:
+            trace_dd( "\tID         : %d"% (marker_id ))
 
         # Initial Position
         initialPosition = Vector3.unpack( data[offset:offset+12] )
         offset += 12
-        trace_dd( "\tPosition   : [%3.2f, %3.2f, %3.2f]"% (initialPosition[0], initialPosition[1], initialPosition[2] ))
+        if TRACE_DD:
+            trace_dd( "\tPosition   : [%3.2f, %3.2f, %3.2f]"% (initialPosition[0], initialPosition[1], initialPosition[2] ))
 
         # Size
         marker_size = FloatValue.unpack( data[offset:offset+4] )
         offset += 4
-        trace_mf( "\tMarker Size:", marker_size )
+        if TRACE_MF:
+            trace_mf( "\tMarker Size:", marker_size )
 
         # Params
         marker_params, = struct.unpack( 'h', data[offset:offset+2] )
         offset += 2
-        trace_mf( "\tParams     :", marker_params )
+        if TRACE_MF:
+            trace_mf( "\tParams     :", marker_params )
 
-        trace_dd("\tunpack_marker_description processed %3.1d bytes"% offset)
+        if TRACE_DD:
+            trace_dd("\tunpack_marker_description processed %3.1d bytes"% offset)
 
         # Package for return object
         marker_desc=DataDescriptions.MarkerDescription(name, marker_id, initialPosition, marker_size, marker_params)
@@ -1253,29 +1760,35 @@ class NatNetClient:
         # ID
         rbID =  int.from_bytes(data[offset:offset+4],'little',  signed=True)
         offset += 4
-        trace_dd( "\tID         : %d"% (rbID ))
+        if TRACE_DD:
+            trace_dd( "\tID         : %d"% (rbID ))
 
         # Position: x,y,z
         pos = Vector3.unpack( data[offset:offset+12] )
         offset += 12
-        trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
+        if TRACE_MF:
+            trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
 
         # Orientation: qx, qy, qz, qw
         rot = Quaternion.unpack( data[offset:offset+16] )
         offset += 16
-        trace_mf( "\tOrientation : [%3.2f, %3.2f, %3.2f, %3.2f]"% (rot[0], rot[1], rot[2], rot[3] ))
+        if TRACE_MF:
+            trace_mf( "\tOrientation : [%3.2f, %3.2f, %3.2f, %3.2f]"% (rot[0], rot[1], rot[2], rot[3] ))
 
         # Mean error
         mean_error, = FloatValue.unpack( data[offset:offset+4] )
         offset += 4
-        trace_mf( "\tMean Error  : %3.2f"% mean_error )
+        if TRACE_MF:
+            trace_mf( "\tMean Error  : %3.2f"% mean_error )
 
         # Params
         marker_params, = struct.unpack( 'h', data[offset:offset+2] )
         offset += 2
-        trace_mf( "\tParams      :", marker_params )
+        if TRACE_MF:
+            trace_mf( "\tParams      :", marker_params )
 
-        trace_dd("unpack_marker_description processed %3.1d bytes"% offset)
+        if TRACE_DD:
+            trace_dd("unpack_marker_description processed %3.1d bytes"% offset)
                 
         # Package for return object
         rigid_body_data=MoCapData.AssetRigidBodyData(rbID, pos, rot, mean_error, marker_params)
@@ -1287,27 +1800,32 @@ class NatNetClient:
         # ID
         marker_id =  int.from_bytes(data[offset:offset+4],'little',  signed=True)
         offset += 4
-        trace_dd( "\tID          : %d"% (marker_id ))
+        if TRACE_DD:
+            trace_dd( "\tID          : %d"% (marker_id ))
 
         # Position: x,y,z
         pos = Vector3.unpack( data[offset:offset+12] )
         offset += 12
-        trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
+        if TRACE_MF:
+            trace_mf( "\tPosition    : [%3.2f, %3.2f, %3.2f]"% (pos[0], pos[1], pos[2] ))
 
         # Size
         marker_size, = FloatValue.unpack( data[offset:offset+4] )
         offset += 4
-        trace_mf( "\tMarker Size : %3.2f"% marker_size )
+        if TRACE_MF:
+            trace_mf( "\tMarker Size : %3.2f"% marker_size )
 
         # Params
         marker_params, = struct.unpack( 'h', data[offset:offset+2] )
         offset += 2
-        trace_mf( "\tParams      :", marker_params )
+        if TRACE_MF:
+            trace_mf( "\tParams      :", marker_params )
 
         # Residual
         residual, = FloatValue.unpack( data[offset:offset+4] )
         offset += 4
-        trace_mf( "\tResidual    : %3.2f"% residual )
+        if TRACE_MF:
+            trace_mf( "\tResidual    : %3.2f"% residual )
 
         marker_data = MoCapData.AssetMarkerData(marker_id, pos, marker_size, marker_params, residual)
         return offset, marker_data
@@ -1320,7 +1838,8 @@ class NatNetClient:
         # Asset Count
         asset_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_mf( "Asset Count:", asset_count )
+        if TRACE_MF:
+            trace_mf( "Asset Count:", asset_count )
 
         # Get data size (4 bytes)
         offset_tmp, unpackedDataSize = self.__unpack_data_size(data[offset:],major, minor)
@@ -1340,28 +1859,33 @@ class NatNetClient:
         # Name
         name, separator, remainder = bytes(data[offset:]).partition( b'\0' )
         offset += len( name ) + 1
-        trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
+        if TRACE_DD:
+            trace_dd( "\tName       : %s"% name.decode( 'utf-8' ) )
 
         # Asset Type 4 bytes
         assetType =  int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "\tType       : %d"% (assetType ))
+        if TRACE_DD:
+            trace_dd( "\tType       : %d"% (assetType ))
 
         # ID 4 bytes
         assetID =  int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "\tID         : %d"% (assetID ))
+        if TRACE_DD:
+            trace_dd( "\tID         : %d"% (assetID ))
 
         # # of RigidBodies
         numRBs =  int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "\tRigid Body (Bone) Count : %d" % (numRBs))
+        if TRACE_DD:
+            trace_dd( "\tRigid Body (Bone) Count : %d" % (numRBs))
         
         rigidbodyArray=[]
         offset1=0
         for rbNum in range(numRBs):
             # # of RigidBodies
-            trace_dd( "\tRigid Body (Bone) %d:" % (rbNum))
+            if TRACE_DD:
+                trace_dd( "\tRigid Body (Bone) %d:" % (rbNum))
             offset1,rigidbody = self.__unpack_rigid_body_description(data[offset:], major, minor)
             offset += offset1
             rigidbodyArray.append(rigidbody)
@@ -1370,17 +1894,20 @@ class NatNetClient:
         # # of Markers
         numMarkers = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd( "\tMarker Count: %d" % (numMarkers))
+        if TRACE_DD:
+            trace_dd( "\tMarker Count: %d" % (numMarkers))
         
         markerArray=[]
         for markerNum in range(numMarkers):
             # # of Markers
-            trace_dd( "\tMarker %d:" % (markerNum))
+            if TRACE_DD:
+                trace_dd( "\tMarker %d:" % (markerNum))
             offset1,marker = self.__unpack_marker_description( data[offset:], major, minor)
             offset += offset1
             markerArray.append(marker)
 
-        trace_dd("\tunpack_asset_description processed %3.1d bytes"% offset)
+        if TRACE_DD:
+            trace_dd("\tunpack_asset_description processed %3.1d bytes"% offset)
 
         # package for output
         asset_desc = DataDescriptions.AssetDescription(name, assetType, assetID, rigidbodyArray, markerArray)
@@ -1394,9 +1921,11 @@ class NatNetClient:
         # # of data sets to process
         dataset_count = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
         offset += 4
-        trace_dd("Dataset Count : ", str(dataset_count))
+        if TRACE_DD:
+            trace_dd("Dataset Count : ", str(dataset_count))
         for i in range( 0, dataset_count ):
-            trace_dd("Dataset ", str(i))
+            if TRACE_DD:
+                trace_dd("Dataset ", str(i))
             data_type = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
             offset += 4
             if ( (major == 4) and (minor>=1) ) or (major > 4) :
@@ -1404,25 +1933,32 @@ class NatNetClient:
                 offset += 4
             data_tmp=None
             if data_type == 0 :
-                trace_dd("Type: 0 Markerset")
+                if TRACE_DD:
+                    trace_dd("Type: 0 Markerset")
                 offset_tmp, data_tmp = self.__unpack_marker_set_description( data[offset:], major, minor )
             elif data_type == 1 :
-                trace_dd("Type: 1 Rigid Body")
+                if TRACE_DD:
+                    trace_dd("Type: 1 Rigid Body")
                 offset_tmp, data_tmp = self.__unpack_rigid_body_description( data[offset:], major, minor )
             elif data_type == 2 :
-                trace_dd("Type: 2 Skeleton")
+                if TRACE_DD:
+                    trace_dd("Type: 2 Skeleton")
                 offset_tmp, data_tmp = self.__unpack_skeleton_description( data[offset:], major, minor )
             elif data_type == 3 :
-                trace_dd("Type: 3 Force Plate")
+                if TRACE_DD:
+                    trace_dd("Type: 3 Force Plate")
                 offset_tmp, data_tmp = self.__unpack_force_plate_description(data[offset:], major, minor)
             elif data_type == 4 :
-                trace_dd("Type: 4 Device")
+                if TRACE_DD:
+                    trace_dd("Type: 4 Device")
                 offset_tmp, data_tmp = self.__unpack_device_description(data[offset:], major, minor)
             elif data_type == 5 :
-                trace_dd("Type: 5 Camera")
+                if TRACE_DD:
+                    trace_dd("Type: 5 Camera")
                 offset_tmp, data_tmp = self.__unpack_camera_description(data[offset:], major, minor)
             elif data_type == 6 :
-                trace_dd("Type: 6 Asset")
+                if TRACE_DD:
+                    trace_dd("Type: 6 Asset")
                 offset_tmp, data_tmp = self.__unpack_asset_description(data[offset:], major, minor)
             else:
                 print("Type: Unknown " + str(data_type))
@@ -1433,8 +1969,9 @@ class NatNetClient:
                 return offset
             offset += offset_tmp
             data_descs.add_data(data_tmp)
-            trace_dd("\t"+ str(i+1) +" datasets processed of " + str(dataset_count))
-            trace_dd("\t "+ str(offset) +" bytes processed of " + str(packet_size) )
+            if TRACE_DD:
+                trace_dd("\t"+ str(i+1) +" datasets processed of " + str(dataset_count))
+                trace_dd("\t "+ str(offset) +" bytes processed of " + str(packet_size) )
 
         return offset, data_descs
 
@@ -1463,6 +2000,11 @@ class NatNetClient:
         self.__nat_net_stream_version_server[1]=nnsvs[1]
         self.__nat_net_stream_version_server[2]=nnsvs[2]
         self.__nat_net_stream_version_server[3]=nnsvs[3]
+
+        # High resolution clock frequency, not sent by older servers
+        if packet_size >= offset + 8:
+            self.high_resolution_clock_frequency = int.from_bytes( data[offset:offset+8], byteorder='little' )
+            offset += 8
         if (self.__nat_net_requested_version[0] == 0) and\
            (self.__nat_net_requested_version[1] == 0):
             print("resetting requested version to %d %d %d %d from %d %d %d %d"%(
@@ -1479,22 +2021,25 @@ class NatNetClient:
             self.__nat_net_requested_version[1] = self.__nat_net_stream_version_server[1]
             self.__nat_net_requested_version[2] = self.__nat_net_stream_version_server[2]
             self.__nat_net_requested_version[3] = self.__nat_net_stream_version_server[3]
+            self.__prepare_frame_decoder()
             # Determine if the bitstream version can be changed
             if (self.__nat_net_stream_version_server[0] >= 4) and (self.use_multicast == False):
                 self.__can_change_bitstream_version = True
 
 
 
-        trace_mf("Sending Application Name: ", self.__application_name)
-        trace_mf("NatNetVersion " , str(self.__nat_net_stream_version_server[0]), " "
-            , str(self.__nat_net_stream_version_server[1]), " "
-            , str(self.__nat_net_stream_version_server[2]), " "
-                , str(self.__nat_net_stream_version_server[3]))
+        if TRACE_MF:
+            trace_mf("Sending Application Name: ", self.__application_name)
+            trace_mf("NatNetVersion " , str(self.__nat_net_stream_version_server[0]), " "
+                , str(self.__nat_net_stream_version_server[1]), " "
+                , str(self.__nat_net_stream_version_server[2]), " "
+                    , str(self.__nat_net_stream_version_server[3]))
 
-        trace_mf("ServerVersion " , str(self.__server_version[0]), " "
-            , str(self.__server_version[1]), " "
-            , str(self.__server_version[2]), " "
-                , str(self.__server_version[3]) )
+        if TRACE_MF:
+            trace_mf("ServerVersion " , str(self.__server_version[0]), " "
+                , str(self.__server_version[1]), " "
+                , str(self.__server_version[2]), " "
+                    , str(self.__server_version[3]) )
         return offset
 
     # __unpack_bitstream_info is for local use of the client
@@ -1538,6 +2083,9 @@ class NatNetClient:
                     #return 4
 
             if len( data ) > 0 :
+                packet_capture = self.packet_capture
+                if packet_capture is not None:
+                    packet_capture.write_packet( NatNetCapture.CHANNEL_COMMAND, data )
                 #peek ahead at message_id
                 message_id = get_message_id(data)
                 tmp_str="mi_%1.1d"%message_id
@@ -1546,13 +2094,17 @@ class NatNetClient:
                 message_id_dict[tmp_str] += 1
                 
                 print_level = gprint_level()
-                if message_id == self.NAT_FRAMEOFDATA:
-                    if print_level > 0:
-                        if (message_id_dict[tmp_str] % print_level) == 0:
-                            print_level = 1
-                        else:
-                            print_level = 0
-                message_id = self.__process_message( data , print_level)
+                if message_id == self.NAT_FRAMEOFDATA and self.receive_ring is not None:
+                    # Unicast frames arrive here, decode them on the decode thread too
+                    self.__queue_packet( data )
+                else:
+                    if message_id == self.NAT_FRAMEOFDATA:
+                        if print_level > 0:
+                            if (message_id_dict[tmp_str] % print_level) == 0:
+                                print_level = 1
+                            else:
+                                print_level = 0
+                    message_id = self.__process_message( data , print_level)
 
                 data=bytearray(0)
 
@@ -1562,101 +2114,203 @@ class NatNetClient:
         return 0
 
     def __data_thread_function( self, in_socket, stop, gprint_level):
-        message_id_dict={}
-        data=bytearray(0)
-        # 64k buffer size
-        recv_buffer_size=64*1024
-
+        """Receive thread: read packets into the receive ring as fast as they arrive"""
+        ring = self.receive_ring
+        # Spare slot, a waiting packet is only dropped once the next one is in hand
+        slot = ring.acquire()
         while not stop():
             # Block for input
             try:
-                data, addr = in_socket.recvfrom( recv_buffer_size )
+                data_size = in_socket.recv_into( ring.get_view(slot) )
+                receive_time = time.perf_counter()
             except socket.error as msg:
                 if not stop():
                     print("ERROR: data socket access error occurred:\n  %s" %msg)
+                    ring.release(slot)
                     return 1
-            except  socket.herror:
-                print("ERROR: data socket access herror occurred")
-                #return 2
-            except  socket.gaierror:
-                print("ERROR: data socket access gaierror occurred")
-                #return 3
-            except  socket.timeout:
-                #if self.use_multicast:
-                print("ERROR: data socket access timeout occurred. Server not responding")
-                #return 4
-            if len( data ) > 0 :
-                #peek ahead at message_id
-                message_id = get_message_id(data)
-                tmp_str="mi_%1.1d"%message_id
-                if tmp_str not in message_id_dict:
-                    message_id_dict[tmp_str]=0
-                message_id_dict[tmp_str] += 1
-                
-                print_level = gprint_level()
-                if message_id == self.NAT_FRAMEOFDATA:
-                    if print_level > 0:
-                        if (message_id_dict[tmp_str] % print_level) == 0:
-                            print_level = 1
-                        else:
-                            print_level = 0
-                message_id = self.__process_message( data , print_level)
+                continue
+            if data_size < 4 :
+                continue
+            data = ring.get_view(slot)
+            packet_capture = self.packet_capture
+            if packet_capture is not None:
+                packet_capture.write_packet( NatNetCapture.CHANNEL_DATA, data[:data_size] )
+            self.__count_packet( data, data_size )
+            slot = ring.exchange(slot, data_size, receive_time)
+        ring.release(slot)
+        return 0
 
-                data=bytearray(0)
+    def __queue_packet( self, data ):
+        """Copy a packet received elsewhere into the receive ring"""
+        receive_time = time.perf_counter()
+        ring = self.receive_ring
+        data_size = len( data )
+        self.__count_packet( data, data_size )
+        slot = ring.acquire()
+        if slot is None:
+            # Every slot is held, this packet is the one dropped
+            ring.drop()
+            return
+        ring.get_view(slot)[:data_size] = data
+        ring.publish(slot, data_size, receive_time)
+
+    def __count_packet( self, data, data_size ):
+        """Update the data channel counters, frame number gaps add to frames_missing"""
+        with self.counter_lock:
+            self.packets_received += 1
+            self.bytes_received += data_size
+            if get_message_id(data) == self.NAT_FRAMEOFDATA:
+                self.frames_received += 1
+                self.__count_frame_number( int.from_bytes( data[4:8], byteorder='little',  signed=True ) )
+
+    def __count_frame_number( self, frame_number ):
+        last_frame_number = self.last_frame_number
+        if last_frame_number is not None:
+            if frame_number > last_frame_number + 1:
+                self.frames_missing += frame_number - last_frame_number - 1
+            elif frame_number <= last_frame_number and frame_number > last_frame_number - FRAME_NUMBER_RESET:
+                # Late or duplicate, the frames it filled in are still counted missing
+                self.frames_out_of_order += 1
+                return
+        # A large step back is a restarted stream and starts the count over
+        self.last_frame_number = frame_number
+
+    def __decode_thread_function( self, stop, gprint_level):
+        """Decode thread: process packets from the receive ring in arrival order"""
+        ring = self.receive_ring
+        message_id_dict={}
+        while not stop():
+            slot = ring.get(0.1)
+            if slot is None:
+                continue
+            data = ring.get_packet(slot)
+            #peek ahead at message_id
+            message_id = get_message_id(data)
+            tmp_str="mi_%1.1d"%message_id
+            if tmp_str not in message_id_dict:
+                message_id_dict[tmp_str]=0
+            message_id_dict[tmp_str] += 1
+
+            print_level = gprint_level()
+            if message_id == self.NAT_FRAMEOFDATA:
+                if print_level > 0:
+                    if (message_id_dict[tmp_str] % print_level) == 0:
+                        print_level = 1
+                    else:
+                        print_level = 0
+            try:
+                message_id = self.__process_message( data , print_level, ring.get_receive_time(slot))
+            finally:
+                # The buffer is reused once released, nothing decoded may point into it
+                ring.release(slot)
+            self.count_decoded_packet()
         return 0
 
-    def __process_message( self, data : bytes, print_level=0):
+    def __process_message( self, data : bytes, print_level=0, receive_time=None):
         #return message ID
         major = self.get_major()
         minor = self.get_minor()
 
-        trace( "Begin Packet\n-----------------" )
+        if TRACE:
+            trace( "Begin Packet\n-----------------" )
         show_nat_net_version = False
         if show_nat_net_version:
-            trace("NatNetVersion " , str(self.__nat_net_requested_version[0]), " "\
-                , str(self.__nat_net_requested_version[1]), " "\
-                , str(self.__nat_net_requested_version[2]), " "\
-                , str(self.__nat_net_requested_version[3]))
+            if TRACE:
+                trace("NatNetVersion " , str(self.__nat_net_requested_version[0]), " "\
+                    , str(self.__nat_net_requested_version[1]), " "\
+                    , str(self.__nat_net_requested_version[2]), " "\
+                    , str(self.__nat_net_requested_version[3]))
 
         message_id = get_message_id(data)
+        with self.counter_lock:
+            message_counts = self.message_counts
+            message_counts[message_id] = message_counts.get(message_id, 0) + 1
 
         packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
 
         #skip the 4 bytes for message ID and packet_size
         offset = 4
         if message_id == self.NAT_FRAMEOFDATA :
-            trace( "Message ID  : %3.1d NAT_FRAMEOFDATA"% message_id )
-            trace( "Packet Size : ", packet_size )
-
-            offset_tmp, mocap_data = self.__unpack_mocap_data( data[offset:], packet_size, major, minor )
-            offset += offset_tmp
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_FRAMEOFDATA"% message_id )
+                trace( "Packet Size : ", packet_size )
+
+            decode_start_time = time.perf_counter()
+            if receive_time is None:
+                receive_time = decode_start_time
+            if self.frame_decoder is not None:
+                offset, mocap_data = self.frame_decoder.unpack_mocap_data( data, offset, packet_size, major, minor, self.rigid_body_listener )
+                decoded_time = time.perf_counter()
+                if self.use_array_decoder:
+                    frame_number = mocap_data.prefix_data.frame_number
+                    if self.rigid_body_array_listener is not None and mocap_data.rigid_body_data is not None:
+                        self.rigid_body_array_listener( frame_number, mocap_data.rigid_body_data.rigid_bodies )
+                    if self.labeled_marker_array_listener is not None and mocap_data.labeled_marker_data is not None:
+                        self.labeled_marker_array_listener( frame_number, mocap_data.labeled_marker_data.labeled_markers )
+                    if self.frame_batcher is not None:
+                        rigid_bodies = None
+                        if mocap_data.rigid_body_data is not None:
+                            rigid_bodies = mocap_data.rigid_body_data.rigid_bodies
+                        self.frame_batcher.add_frame( frame_number, mocap_data.suffix_data.timestamp, rigid_bodies )
+                if self.new_frame_listener is not None:
+                    self.new_frame_listener( NatNetDecoder.get_frame_dict(mocap_data) )
+            else:
+                offset_tmp, mocap_data = self.__unpack_mocap_data( data[offset:], packet_size, major, minor )
+                offset += offset_tmp
+                decoded_time = time.perf_counter()
+            if mocap_data.suffix_data.tracked_models_changed or self.data_descriptions_changed:
+                # Retried while the reply is missing
+                self.invalidate_data_descriptions()
+            if self.pose_board is not None:
+                self.pose_board.publish_frame( mocap_data )
+            if self.pose_history is not None:
+                self.pose_history.add_frame( mocap_data )
+            if self.frame_hub is not None:
+                self.frame_hub.publish( mocap_data )
+            if self.frame_pool is not None and self.frame_decoder is not None and self.frame_hub is None:
+                self.frame_pool.release( mocap_data )
+            done_time = time.perf_counter()
+            self.decode_times.add( decoded_time - decode_start_time )
+            self.listener_times.add( done_time - decoded_time )
+            latency_stats = self.latency_stats
+            if latency_stats is not None:
+                latency_stats.add_frame( mocap_data.suffix_data, receive_time, decoded_time, done_time,
+                                         self.high_resolution_clock_frequency )
 
         elif message_id == self.NAT_MODELDEF :
-            trace( "Message ID  : %3.1d NAT_MODELDEF"% message_id )
-            trace( "Packet Size : %d"% packet_size )
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_MODELDEF"% message_id )
+                trace( "Packet Size : %d"% packet_size )
             offset_tmp, data_descs = self.__unpack_data_descriptions( data[offset:], packet_size, major, minor)
             offset += offset_tmp
+            self.data_descriptions = data_descs
+            self.data_descriptions_changed = False
+            if self.rigid_body_name_subscriptions:
+                self.__update_rigid_body_filter()
             print("Data Descriptions:\n")
-            # get a string version of the data for output
-            data_descs_str=data_descs.get_as_string()
             if print_level>0:
+                # get a string version of the data for output
+                data_descs_str=data_descs.get_as_string()
                 print("%s\n"%(data_descs_str))
 
         elif message_id == self.NAT_SERVERINFO :
-            trace( "Message ID  : %3.1d NAT_SERVERINFO"% message_id )
-            trace( "Packet Size : ", packet_size )
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_SERVERINFO"% message_id )
+                trace( "Packet Size : ", packet_size )
             offset += self.__unpack_server_info( data[offset:], packet_size, major, minor)
 
         elif message_id == self.NAT_RESPONSE :
-            trace( "Message ID  : %3.1d NAT_RESPONSE"% message_id )
-            trace( "Packet Size : ", packet_size )
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_RESPONSE"% message_id )
+                trace( "Packet Size : ", packet_size )
             if packet_size == 4 :
                 command_response = int.from_bytes( data[offset:offset+4], byteorder='little',  signed=True )
-                trace( "Command response: %d - %d %d %d %d"% (command_response,
-                                                             data[offset],
-                                                             data[offset+1],
-                                                             data[offset+2],
-                                                             data[offset+3]))
+                if TRACE:
+                    trace( "Command response: %d - %d %d %d %d"% (command_response,
+                                                                 data[offset],
+                                                                 data[offset+1],
+                                                                 data[offset+2],
+                                                                 data[offset+3]))
                 offset += 4
             else:
                 show_remainder = False
@@ -1676,26 +2330,33 @@ class NatNetClient:
                 offset += len( message ) + 1
 
                 if(show_remainder):
-                    trace( "Command response:", message.decode( 'utf-8' ),\
-                        " separator:", separator, " remainder:",remainder )
+                    if TRACE:
+                        trace( "Command response:", message.decode( 'utf-8' ),\
+                            " separator:", separator, " remainder:",remainder )
                 else:
-                    trace( "Command response:", message.decode( 'utf-8' ))
+                    if TRACE:
+                        trace( "Command response:", message.decode( 'utf-8' ))
         elif message_id == self.NAT_UNRECOGNIZED_REQUEST :
-            trace( "Message ID  : %3.1d NAT_UNRECOGNIZED_REQUEST: "% message_id )
-            trace( "Packet Size : ", packet_size )
-            trace( "Received 'Unrecognized request' from server" )
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_UNRECOGNIZED_REQUEST: "% message_id )
+                trace( "Packet Size : ", packet_size )
+                trace( "Received 'Unrecognized request' from server" )
         elif message_id == self.NAT_MESSAGESTRING :
-            trace( "Message ID  : %3.1d NAT_MESSAGESTRING"% message_id)
-            trace( "Packet Size : ", packet_size )
+            if TRACE:
+                trace( "Message ID  : %3.1d NAT_MESSAGESTRING"% message_id)
+                trace( "Packet Size : ", packet_size )
             message, separator, remainder = bytes(data[offset:]).partition( b'\0' )
             offset += len( message ) + 1
-            trace( "Received message from server:", message.decode( 'utf-8' ) )
+            if TRACE:
+                trace( "Received message from server:", message.decode( 'utf-8' ) )
         else:
-            trace( "Message ID  : %3.1d UNKNOWN"% message_id )
-            trace( "Packet Size : ", packet_size )
-            trace( "ERROR: Unrecognized packet type" )
+            if TRACE:
+                trace( "Message ID  : %3.1d UNKNOWN"% message_id )
+                trace( "Packet Size : ", packet_size )
+                trace( "ERROR: Unrecognized packet type" )
 
-        trace( "End Packet\n-----------------" )
+        if TRACE:
+            trace( "End Packet\n-----------------" )
         return message_id
 
     def send_request( self, in_socket, command, command_str, address ):
@@ -1790,7 +2451,8 @@ class NatNetClient:
 
 
 
-    def run( self ):
+    def create_sockets( self ):
+        """Create the data and command sockets and lock the configuration"""
         # Create the data socket
         self.data_socket = self.__create_data_socket( self.data_port )
         if self.data_socket is None :
@@ -1803,8 +2465,33 @@ class NatNetClient:
             print( "Could not open command channel" )
             return False
         self.__is_locked = True
+        return True
+
+    def count_packet( self, data, data_size ):
+        """Update the data channel counters for a packet received outside the client threads"""
+        self.__count_packet( data, data_size )
+
+    def count_decoded_packet( self ):
+        """Count a data channel packet decoded outside the decode thread"""
+        with self.counter_lock:
+            self.packets_decoded += 1
+
+    def process_message( self, data, print_level=0 ):
+        """Handle one NatNet packet as if it had arrived on a socket, returns the message ID"""
+        return self.__process_message( data, print_level )
+
+    def run( self ):
+        if not self.create_sockets():
+            return False
 
         self.stop_threads = False
+        self.receive_ring = NatNetRing.PacketRing(self.receive_ring_size)
+        self.reset_stats()
+
+        # Create a separate thread for decoding data packets
+        self.decode_thread = Thread( target = self.__decode_thread_function, args = (lambda : self.stop_threads, lambda : self.print_level, ))
+        self.decode_thread.start()
+
         # Create a separate thread for receiving data packets
         self.data_thread = Thread( target = self.__data_thread_function, args = (self.data_socket, lambda : self.stop_threads, lambda : self.print_level, ))
         self.data_thread.start()
@@ -1817,6 +2504,9 @@ class NatNetClient:
         # Get NatNet and server versions
         self.send_request(self.command_socket, self.NAT_CONNECT, "",  (self.server_ip_address, self.command_port) )
 
+        # Rigid body names are resolved to IDs from the model definitions
+        if self.rigid_body_name_subscriptions:
+            self.send_request(self.command_socket, self.NAT_REQUEST_MODELDEF, "",  (self.server_ip_address, self.command_port) )
 
         ##Example Commands
         ## Get NatNet and server versions
@@ -1832,10 +2522,22 @@ class NatNetClient:
         # an exception and break the loop
         self.command_socket.close()
         print("Point 1")
+        # On Linux close does not wake a blocked receive, shutdown does.
+        # It still raises ENOTCONN on an unconnected UDP socket.
+        try:
+            self.data_socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
         self.data_socket.close()
         print("Point 2")
         # attempt to join the threads back.
         self.command_thread.join()
         print("Point 3")
         self.data_thread.join()
-        print("Point 4")
\ No newline at end of file
+        print("Point 4")
+        self.decode_thread.join()
+        self.stop_capture()
+        self.stop_pose_board()
+        self.stop_latency_dump()
+        if self.frame_batcher is not None:
+            self.frame_batcher.flush()
\ No newline at end of file
@@ -0,0 +1,994 @@
+# OptiTrack NatNet offset based frame decoder for Python 3.x
+#
+# Decodes NAT_FRAMEOFDATA packets into the same MoCapData object tree as
+# NatNetClient.__unpack_mocap_data, but walks a single memoryview with
+# struct.unpack_from and an absolute offset instead of re-slicing the
+# packet for every field, and appends decoded objects directly instead of
+# deep copying them into their containers.
+
+import struct
+from collections import deque
+from threading import Lock
+from . import MoCapData
+
+IntValue = struct.Struct( '<i' )
+Int64Value = struct.Struct( '<q' )
+ShortValue = struct.Struct( '<h' )
+FloatValue = struct.Struct( '<f' )
+DoubleValue = struct.Struct( '<d' )
+Vector3 = struct.Struct( '<fff' )
+Quaternion = struct.Struct( '<ffff' )
+
+unpack_int = IntValue.unpack_from
+unpack_int64 = Int64Value.unpack_from
+unpack_short = ShortValue.unpack_from
+unpack_float = FloatValue.unpack_from
+unpack_double = DoubleValue.unpack_from
+unpack_vector3 = Vector3.unpack_from
+unpack_quaternion = Quaternion.unpack_from
+
+
+# Frame sections between the prefix and suffix, in wire order
+SECTION_NAMES = ["marker_sets", "legacy_markers", "rigid_bodies", "skeletons",
+                 "assets", "labeled_markers", "force_plates", "devices"]
+NO_SECTIONS = frozenset()
+
+DEFAULT_POOL_FRAMES = 8
+
+
+def has_data_size(major, minor):
+    """NatNet 4.1 and later write a byte count ahead of each frame section"""
+    return ((major == 4) and (minor > 0)) or (major > 4)
+
+def unpack_string(buf, offset):
+    """Read a null terminated string, returns the new offset and the bytes"""
+    end = offset
+    buf_len = len(buf)
+    while end < buf_len and buf[end] != 0:
+        end += 1
+    return end + 1, bytes(buf[offset:end])
+
+def get_frame_dict(mocap_data):
+    """Build the dictionary passed to NatNetClient.new_frame_listener
+
+    Sections that were skipped are reported with a count of 0."""
+    # NatNetClient reports the legacy marker count as marker_set_count
+    marker_set_count = 0
+    if mocap_data.legacy_other_markers is not None:
+        marker_set_count = mocap_data.legacy_other_markers.get_marker_count()
+    unlabeled_markers_count = 0
+    if mocap_data.marker_set_data is not None:
+        unlabeled_markers_count = mocap_data.marker_set_data.get_unlabeled_marker_count()
+    rigid_body_count = 0
+    if mocap_data.rigid_body_data is not None:
+        rigid_body_count = mocap_data.rigid_body_data.get_rigid_body_count()
+    skeleton_count = 0
+    if mocap_data.skeleton_data is not None:
+        skeleton_count = mocap_data.skeleton_data.get_skeleton_count()
+    asset_count = 0
+    if mocap_data.asset_data is not None:
+        asset_count = mocap_data.asset_data.get_asset_count()
+    labeled_marker_count = 0
+    if mocap_data.labeled_marker_data is not None:
+        labeled_marker_count = mocap_data.labeled_marker_data.get_labeled_marker_count()
+    suffix_data = mocap_data.suffix_data
+    data_dict={}
+    data_dict["frame_number"]=mocap_data.prefix_data.frame_number
+    data_dict[ "marker_set_count"] = marker_set_count
+    data_dict[ "unlabeled_markers_count"] = unlabeled_markers_count
+    data_dict[ "rigid_body_count"] = rigid_body_count
+    data_dict[ "skeleton_count"] = skeleton_count
+    data_dict[ "asset_count"] = asset_count
+    data_dict[ "labeled_marker_count"] = labeled_marker_count
+    data_dict[ "timecode"] = suffix_data.timecode
+    data_dict[ "timecode_sub"] = suffix_data.timecode_sub
+    data_dict[ "timestamp"] = suffix_data.timestamp
+    data_dict[ "is_recording"] = suffix_data.is_recording
+    data_dict[ "tracked_models_changed"] = suffix_data.tracked_models_changed
+    return data_dict
+
+
+class DecodePlan:
+    """Wire layout of a frame for one NatNet version, worked out once.
+
+    Holds precompiled struct layouts and the list of sections present in the
+    stream, so decoding a frame runs no version checks per field.
+    """
+
+    def __init__(self, major, minor):
+        self.major = major
+        self.minor = minor
+        self.has_data_size = has_data_size(major, minor)
+
+        # Sections decoded for this version, in wire order.  Assets are only
+        # decoded from 4.1, the other sections are left empty when older
+        # versions do not send them.
+        self.section_names = ["marker_sets", "legacy_markers", "rigid_bodies", "skeletons"]
+        if self.has_data_size:
+            self.section_names.append("assets")
+        self.section_names += ["labeled_markers", "force_plates", "devices"]
+        self.absent_sections = set()
+        # Skeletons (Version 2.1 and later)
+        if major < 2 or ( major == 2 and minor == 0 ):
+            self.absent_sections.add("skeletons")
+        # Labeled markers (Version 2.4 and later)
+        if major < 2 or ( major == 2 and minor <= 3 ):
+            self.absent_sections.add("labeled_markers")
+        # Force Plate data (version 2.9 and later)
+        if major < 2 or ( major == 2 and minor < 9 ):
+            self.absent_sections.add("force_plates")
+        # Device data (version 2.11 and later)
+        if major < 2 or ( major == 2 and minor < 11 ):
+            self.absent_sections.add("devices")
+
+        # Rigid body: ID, position and orientation, then before 3.0 the
+        # marker data, then the mean marker error (2.0 and later) and
+        # params (2.6 and later)
+        self.rigid_body_markers = ( major < 3 and major != 0 )
+        self.rigid_body_marker_ids = self.rigid_body_markers and major >= 2
+        self.rigid_body_error = major >= 2
+        self.rigid_body_params = ( major == 2 and minor >= 6 ) or major > 2
+        tail_format = '<'
+        if self.rigid_body_error:
+            tail_format += 'f'
+        if self.rigid_body_params:
+            tail_format += 'h'
+        self.rigid_body_tail = struct.Struct(tail_format)
+        # Without markers every record has the same size and layout
+        self.rigid_body_record = None
+        self.rigid_body_size = None
+        if not self.rigid_body_markers:
+            self.rigid_body_record = struct.Struct('<i3f4f' + tail_format[1:])
+            self.rigid_body_size = self.rigid_body_record.size
+
+        # Labeled marker: ID, position, size, params (2.6 and later) and
+        # residual (3.0 and later)
+        self.labeled_marker_params = ( major == 2 and minor >= 6 ) or major > 2
+        self.labeled_marker_residual = major >= 3
+        labeled_marker_format = '<i3ff'
+        if self.labeled_marker_params:
+            labeled_marker_format += 'h'
+        if self.labeled_marker_residual:
+            labeled_marker_format += 'f'
+        self.labeled_marker_record = struct.Struct(labeled_marker_format)
+
+        # Suffix after the timecode: timestamp (double from 2.7), hires
+        # stamps (3.0 and later), precision timestamp (4.0 and later), params
+        self.suffix_double_timestamp = ( major == 2 and minor >= 7 ) or major > 2
+        self.suffix_stamps = major >= 3
+        self.suffix_precision_timestamp = major >= 4
+        suffix_format = '<'
+        if self.suffix_double_timestamp:
+            suffix_format += 'd'
+        else:
+            suffix_format += 'f'
+        if self.suffix_stamps:
+            suffix_format += 'qqq'
+        if self.suffix_precision_timestamp:
+            suffix_format += 'ii'
+        suffix_format += 'h'
+        self.suffix_record = struct.Struct(suffix_format)
+
+    def get_version(self):
+        return (self.major, self.minor)
+
+
+class FramePool:
+    """Decoded frames handed back for a FrameDecoder to reuse.
+
+    Call release( mocap_data ) once nothing holds on to the frame or any
+    object in it.  The decoder then decodes into its MoCapData, prefix,
+    rigid body and labeled marker objects instead of allocating new ones.
+    release can be called from any thread.
+    """
+    def __init__(self, max_frames=DEFAULT_POOL_FRAMES):
+        self.max_frames = max(max_frames, 1)
+        self.frames = deque()
+        self.lock = Lock()
+        self.released = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def release(self, mocap_data):
+        with self.lock:
+            if len(self.frames) >= self.max_frames:
+                self.discarded += 1
+                return
+            self.frames.append(mocap_data)
+            self.released += 1
+
+    def acquire(self):
+        """Oldest released frame, None if there is none"""
+        with self.lock:
+            if not self.frames:
+                return None
+            self.reused += 1
+            return self.frames.popleft()
+
+    def get_counters(self):
+        """released: frames handed back
+        reused: frames decoded into again
+        discarded: frames released while the pool was full"""
+        with self.lock:
+            return { "released"  : self.released,
+                     "reused"    : self.reused,
+                     "discarded" : self.discarded }
+
+
+class FrameDecoder:
+    """Offset based decoder for NAT_FRAMEOFDATA packets"""
+
+    # Section name to ( decode method name, MoCapData setter name, section class )
+    SECTION_HANDLERS = {
+        "marker_sets"     : ("unpack_marker_set_data",      "set_marker_set_data",      MoCapData.MarkerSetData),
+        "legacy_markers"  : ("unpack_legacy_other_markers", "set_legacy_other_markers", MoCapData.LegacyMarkerData),
+        "rigid_bodies"    : ("unpack_rigid_body_data",      "set_rigid_body_data",      MoCapData.RigidBodyData),
+        "skeletons"       : ("unpack_skeleton_data",        "set_skeleton_data",        MoCapData.SkeletonData),
+        "assets"          : ("unpack_asset_data",           "set_asset_data",           MoCapData.AssetData),
+        "labeled_markers" : ("unpack_labeled_marker_data",  "set_labeled_marker_data",  MoCapData.LabeledMarkerData),
+        "force_plates"    : ("unpack_force_plate_data",     "set_force_plate_data",     MoCapData.ForcePlateData),
+        "devices"         : ("unpack_device_data",          "set_device_data",          MoCapData.DeviceData),
+    }
+
+    def __init__(self, sections=None):
+        self.skip_sections = NO_SECTIONS
+        self.rigid_body_filter = None
+        # ( DecodePlan, section handlers ) of the last version seen, replaced
+        # as one tuple so a receive thread never sees a mismatched pair
+        self.prepared = None
+        self.plans = {}
+        # MoCapData or MoCapData.compact_classes, see set_compact
+        self.frame_classes = MoCapData
+        self.frame_pool = None
+        # Rigid bodies and labeled markers of pooled frames waiting to be
+        # reused, only touched by the decoding thread
+        self.spare_rigid_bodies = []
+        self.spare_labeled_markers = []
+        self.set_sections(sections)
+
+    def set_compact(self, compact=True):
+        """Build frames from the __slots__ classes in MoCapData.compact_classes"""
+        if compact:
+            self.frame_classes = MoCapData.compact_classes
+        else:
+            self.frame_classes = MoCapData
+        self.spare_rigid_bodies = []
+        self.spare_labeled_markers = []
+
+    def set_frame_pool(self, frame_pool=None):
+        """Decode into frames released to a FramePool, None always allocates new frames"""
+        self.frame_pool = frame_pool
+        self.spare_rigid_bodies = []
+        self.spare_labeled_markers = []
+
+    def set_rigid_body_filter(self, rigid_body_filter=None):
+        """Dictionary of rigid body ID to listener, None keeps every rigid body.
+
+        Rigid bodies whose ID is not in the dictionary are stepped over without
+        building objects or calling listeners.  Each kept rigid body is passed to
+        its own listener, if it is not None, as ( id, position, rotation ).
+        Skeleton bones are not filtered.
+        """
+        self.rigid_body_filter = rigid_body_filter
+
+    def set_sections(self, sections=None):
+        """Only decode the listed SECTION_NAMES, None decodes everything.
+
+        The frame prefix and suffix are always decoded.  Skipping needs the
+        per section byte counts sent by NatNet 4.1 and later, older streams
+        are always fully decoded.
+        """
+        if sections is None:
+            skip_sections = NO_SECTIONS
+        else:
+            for section in sections:
+                if section not in SECTION_NAMES:
+                    print("ERROR: Unknown frame section %s, valid sections are %s"%(section, ", ".join(SECTION_NAMES)))
+                    return
+            skip_sections = frozenset(SECTION_NAMES) - frozenset(sections)
+        self.skip_sections = skip_sections
+        # Section handlers depend on the skipped sections, rebuild them
+        if self.prepared is not None:
+            self.prepare(*self.prepared[0].get_version())
+
+    def prepare(self, major, minor):
+        """Build the decode plan and section handlers for a stream version.
+
+        NatNetClient calls this when the version is negotiated, frames of
+        any other version prepare their plan on first use.  Returns
+        ( plan, section handlers )."""
+        plan = self.plans.get((major, minor))
+        if plan is None:
+            plan = DecodePlan(major, minor)
+            self.plans[(major, minor)] = plan
+        section_handlers = []
+        for section_name in plan.section_names:
+            method_name, setter_name, section_class = self.SECTION_HANDLERS[section_name]
+            set_section = getattr(MoCapData.MoCapData, setter_name)
+            # Sections can only be jumped over when NatNet 4.1+ sends their byte counts
+            if plan.has_data_size and section_name in self.skip_sections:
+                section_handlers.append((self.skip_section, None))
+            elif section_name in plan.absent_sections:
+                section_handlers.append((self.absent_section(section_name), set_section))
+            else:
+                section_handlers.append((getattr(self, method_name), set_section))
+        self.prepared = (plan, section_handlers)
+        return self.prepared
+
+    def empty_section(self, section_name):
+        """Section data with no items"""
+        return getattr(self.frame_classes, self.SECTION_HANDLERS[section_name][2].__name__)()
+
+    def absent_section(self, section_name):
+        """Handler for a section older versions do not send, leaves it empty"""
+        def unpack_absent_section(buf, offset, plan, rigid_body_listener=None):
+            return offset, self.empty_section(section_name)
+        return unpack_absent_section
+
+    def skip_section(self, buf, offset, plan, rigid_body_listener=None):
+        """Jump over a section using the byte count written after its item count"""
+        size_in_bytes, = unpack_int(buf, offset + 4)
+        return offset + 8 + size_in_bytes, None
+
+    def unpack_count(self, buf, offset, plan):
+        """Section item count and, from NatNet 4.1 on, the section byte count"""
+        count, = unpack_int(buf, offset)
+        offset += 4
+        if plan.has_data_size:
+            offset += 4
+        return offset, count
+
+    def unpack_marker_set_data(self, buf, offset, plan, rigid_body_listener=None):
+        marker_set_data = self.frame_classes.MarkerSetData()
+        marker_data_list = marker_set_data.marker_data_list
+        buf_len = len(buf)
+        # Markerset count (4 bytes)
+        offset, marker_set_count = self.unpack_count(buf, offset, plan)
+
+        for _ in range(marker_set_count):
+            marker_data = self.frame_classes.MarkerData()
+            # Model name
+            offset, marker_data.model_name = unpack_string(buf, offset)
+            # Marker count (4 bytes)
+            marker_count, = unpack_int(buf, offset)
+            offset += 4
+            if(marker_count < 0):
+                print("WARNING: Early return.  Invalid marker count")
+                return buf_len, marker_set_data
+            elif(marker_count > 10000):
+                print("WARNING: Early return.  Marker count too high")
+                return buf_len, marker_set_data
+            if buf_len < (offset + 12*marker_count):
+                print("WARNING: Early return.  Out of data at marker ",(buf_len - offset)//12," of ", marker_count)
+                return buf_len, marker_set_data
+            marker_pos_list = marker_data.marker_pos_list
+            for _ in range(marker_count):
+                marker_pos_list.append(unpack_vector3(buf, offset))
+                offset += 12
+            marker_data_list.append(marker_data)
+        return offset, marker_set_data
+
+    def unpack_legacy_other_markers(self, buf, offset, plan, rigid_body_listener=None):
+        other_marker_data = self.frame_classes.LegacyMarkerData()
+        marker_pos_list = other_marker_data.marker_pos_list
+        offset, other_marker_count = self.unpack_count(buf, offset, plan)
+        for _ in range(other_marker_count):
+            marker_pos_list.append(unpack_vector3(buf, offset))
+            offset += 12
+        return offset, other_marker_data
+
+    def unpack_rigid_body(self, buf, offset, plan, rigid_body_listener):
+        rigid_body_record = plan.rigid_body_record
+        if rigid_body_record is not None:
+            # Fixed size record, one unpack for every field
+            fields = rigid_body_record.unpack_from(buf, offset)
+            new_id = fields[0]
+            pos = fields[1:4]
+            rot = fields[4:8]
+            spare_rigid_bodies = self.spare_rigid_bodies
+            if spare_rigid_bodies:
+                # Reused from a pooled frame, reset as the constructor would
+                rigid_body = spare_rigid_bodies.pop()
+                rigid_body.id_num = new_id
+                rigid_body.pos = pos
+                rigid_body.rot = rot
+                rigid_body.tracking_valid = False
+                rigid_body.error = 0.0
+                rigid_body.marker_num = -1
+                if rigid_body.rb_marker_list:
+                    rigid_body.rb_marker_list = []
+            else:
+                rigid_body = self.frame_classes.RigidBody(new_id, pos, rot)
+            if plan.rigid_body_error:
+                rigid_body.error = fields[8]
+            if plan.rigid_body_params:
+                rigid_body.tracking_valid = ( fields[9] & 0x01 ) != 0
+            if rigid_body_listener is not None:
+                rigid_body_listener( new_id, pos, rot )
+            return offset + plan.rigid_body_size, rigid_body
+
+        # ID (4 bytes)
+        new_id, = unpack_int(buf, offset)
+        # Position and orientation
+        pos = unpack_vector3(buf, offset + 4)
+        rot = unpack_quaternion(buf, offset + 16)
+        offset += 32
+
+        rigid_body = self.frame_classes.RigidBody(new_id, pos, rot)
+
+        # Send information to any listener.
+        if rigid_body_listener is not None:
+            rigid_body_listener( new_id, pos, rot )
+
+        # RB Marker Data ( Before version 3.0.  After Version 3.0 Marker data is in description )
+        marker_count, = unpack_int(buf, offset)
+        offset += 4
+        rb_marker_list = rigid_body.rb_marker_list
+        for _ in range(marker_count):
+            rb_marker = self.frame_classes.RigidBodyMarker()
+            rb_marker.pos = unpack_vector3(buf, offset)
+            offset += 12
+            rb_marker_list.append(rb_marker)
+        if plan.rigid_body_marker_ids:
+            # Marker ID's
+            for rb_marker in rb_marker_list:
+                rb_marker.id, = unpack_int(buf, offset)
+                offset += 4
+            # Marker sizes
+            for rb_marker in rb_marker_list:
+                rb_marker.size = unpack_float(buf, offset)
+                offset += 4
+
+        # Mean marker error and params
+        tail = plan.rigid_body_tail.unpack_from(buf, offset)
+        offset += plan.rigid_body_tail.size
+        if plan.rigid_body_error:
+            rigid_body.error = tail[0]
+        if plan.rigid_body_params:
+            rigid_body.tracking_valid = ( tail[1] & 0x01 ) != 0
+
+        return offset, rigid_body
+
+    def unpack_rigid_body_data(self, buf, offset, plan, rigid_body_listener):
+        rigid_body_data = self.frame_classes.RigidBodyData()
+        rigid_body_list = rigid_body_data.rigid_body_list
+        # Rigid body count (4 bytes)
+        offset, rigid_body_count = self.unpack_count(buf, offset, plan)
+        unpack_rigid_body = self.unpack_rigid_body
+        rigid_body_filter = self.rigid_body_filter
+        if rigid_body_filter is None:
+            for _ in range(rigid_body_count):
+                offset, rigid_body = unpack_rigid_body(buf, offset, plan, rigid_body_listener)
+                rigid_body_list.append(rigid_body)
+            return offset, rigid_body_data
+
+        for _ in range(rigid_body_count):
+            new_id, = unpack_int(buf, offset)
+            if new_id not in rigid_body_filter:
+                offset += self.rigid_body_size(buf, offset, plan)
+                continue
+            offset, rigid_body = unpack_rigid_body(buf, offset, plan, rigid_body_listener)
+            rigid_body_list.append(rigid_body)
+            listener = rigid_body_filter[new_id]
+            if listener is not None:
+                listener( new_id, rigid_body.pos, rigid_body.rot )
+        return offset, rigid_body_data
+
+    def rigid_body_size(self, buf, offset, plan):
+        """Size in bytes of the rigid body record at offset"""
+        if plan.rigid_body_size is not None:
+            return plan.rigid_body_size
+        # ID, position and orientation, then the RB Marker Data ( Before version 3.0 )
+        marker_count, = unpack_int(buf, offset + 32)
+        size = 36 + 12*marker_count
+        if plan.rigid_body_marker_ids:
+            # Marker ID's and sizes
+            size += 8*marker_count
+        return size + plan.rigid_body_tail.size
+
+    def unpack_skeleton_data(self, buf, offset, plan, rigid_body_listener):
+        skeleton_data = self.frame_classes.SkeletonData()
+        offset, skeleton_count = self.unpack_count(buf, offset, plan)
+        for _ in range(skeleton_count):
+            new_id, rigid_body_count = struct.unpack_from('<ii', buf, offset)
+            offset += 8
+            skeleton = self.frame_classes.Skeleton(new_id)
+            for _ in range(rigid_body_count):
+                offset, rigid_body = self.unpack_rigid_body(buf, offset, plan, rigid_body_listener)
+                skeleton.rigid_body_list.append(rigid_body)
+            skeleton_data.skeleton_list.append(skeleton)
+        return offset, skeleton_data
+
+    def unpack_asset_data(self, buf, offset, plan, rigid_body_listener=None):
+        asset_data = self.frame_classes.AssetData()
+        # Asset Count
+        offset, asset_count = self.unpack_count(buf, offset, plan)
+        for _ in range(asset_count):
+            asset = self.frame_classes.Asset()
+            asset.asset_id, num_rbs = struct.unpack_from('<ii', buf, offset)
+            offset += 8
+            for rb_num in range(num_rbs):
+                rb_id, = unpack_int(buf, offset)
+                pos = unpack_vector3(buf, offset + 4)
+                rot = unpack_quaternion(buf, offset + 16)
+                mean_error, = unpack_float(buf, offset + 32)
+                marker_params, = unpack_short(buf, offset + 36)
+                offset += 38
+                rigid_body = self.frame_classes.AssetRigidBodyData(rb_id, pos, rot, mean_error, marker_params)
+                rigid_body.rb_num = rb_num
+                asset.rigid_body_list.append(rigid_body)
+            num_markers, = unpack_int(buf, offset)
+            offset += 4
+            for marker_num in range(num_markers):
+                marker_id, = unpack_int(buf, offset)
+                pos = unpack_vector3(buf, offset + 4)
+                marker_size, = unpack_float(buf, offset + 16)
+                marker_params, = unpack_short(buf, offset + 20)
+                residual, = unpack_float(buf, offset + 22)
+                offset += 26
+                marker = self.frame_classes.AssetMarkerData(marker_id, pos, marker_size, marker_params, residual)
+                marker.marker_num = marker_num
+                asset.marker_list.append(marker)
+            asset_data.asset_list.append(asset)
+        return offset, asset_data
+
+    def unpack_labeled_marker_data(self, buf, offset, plan, rigid_body_listener=None):
+        labeled_marker_data = self.frame_classes.LabeledMarkerData()
+        labeled_marker_list = labeled_marker_data.labeled_marker_list
+        offset, labeled_marker_count = self.unpack_count(buf, offset, plan)
+        labeled_marker_record = plan.labeled_marker_record
+        record_size = labeled_marker_record.size
+        has_param = plan.labeled_marker_params
+        has_residual = plan.labeled_marker_residual
+        LabeledMarker = self.frame_classes.LabeledMarker
+        spare_labeled_markers = self.spare_labeled_markers
+        for fields in labeled_marker_record.iter_unpack(buf[offset:offset + labeled_marker_count*record_size]):
+            # Size is kept as the 1-tuple NatNetClient stores
+            param = fields[5] if has_param else 0
+            # Residual is sent in meters (3.0 and later) and stored in mm
+            residual = fields[-1] * 1000.0 if has_residual else 0.0
+            if spare_labeled_markers:
+                # Reused from a pooled frame, the constructor unwraps the size
+                labeled_marker = spare_labeled_markers.pop()
+                labeled_marker.id_num = fields[0]
+                labeled_marker.pos = fields[1:4]
+                labeled_marker.size = fields[4]
+                labeled_marker.param = param
+                labeled_marker.residual = residual
+                labeled_marker.marker_num = -1
+                labeled_marker_list.append(labeled_marker)
+            else:
+                labeled_marker_list.append(LabeledMarker(fields[0], fields[1:4], fields[4:5], param, residual))
+        return offset + labeled_marker_count*record_size, labeled_marker_data
+
+    def unpack_channel_data(self, buf, offset, channel_data):
+        frame_count, = unpack_int(buf, offset)
+        offset += 4
+        frame_list = channel_data.frame_list
+        for _ in range(frame_count):
+            frame_list.append(unpack_float(buf, offset))
+            offset += 4
+        return offset
+
+    def unpack_force_plate_data(self, buf, offset, plan, rigid_body_listener=None):
+        force_plate_data = self.frame_classes.ForcePlateData()
+        offset, force_plate_count = self.unpack_count(buf, offset, plan)
+        for _ in range(force_plate_count):
+            force_plate_id, channel_count = struct.unpack_from('<ii', buf, offset)
+            offset += 8
+            force_plate = self.frame_classes.ForcePlate(force_plate_id)
+            for _ in range(channel_count):
+                channel_data = self.frame_classes.ForcePlateChannelData()
+                offset = self.unpack_channel_data(buf, offset, channel_data)
+                force_plate.channel_data_list.append(channel_data)
+            force_plate_data.force_plate_list.append(force_plate)
+        return offset, force_plate_data
+
+    def unpack_device_data(self, buf, offset, plan, rigid_body_listener=None):
+        device_data = self.frame_classes.DeviceData()
+        offset, device_count = self.unpack_count(buf, offset, plan)
+        for _ in range(device_count):
+            device_id, channel_count = struct.unpack_from('<ii', buf, offset)
+            offset += 8
+            device = self.frame_classes.Device(device_id)
+            for _ in range(channel_count):
+                channel_data = self.frame_classes.DeviceChannelData()
+                offset = self.unpack_channel_data(buf, offset, channel_data)
+                device.channel_data_list.append(channel_data)
+            device_data.device_list.append(device)
+        return offset, device_data
+
+    def unpack_frame_suffix_data(self, buf, offset, packet_end, plan):
+        frame_suffix_data = self.frame_classes.FrameSuffixData()
+
+        # Timecode
+        frame_suffix_data.timecode, frame_suffix_data.timecode_sub = struct.unpack_from('<ii', buf, offset)
+        offset += 8
+
+        param = 0
+        #check to see if there is enough data
+        if offset >= packet_end:
+            print("ERROR: Early End of Data Frame Suffix Data")
+            print("\tNo time stamp info available")
+        else:
+            fields = plan.suffix_record.unpack_from(buf, offset)
+            offset += plan.suffix_record.size
+            frame_suffix_data.timestamp = fields[0]
+            # Hires Timestamp (Version 3.0 and later)
+            if plan.suffix_stamps:
+                frame_suffix_data.stamp_camera_mid_exposure, \
+                frame_suffix_data.stamp_data_received, \
+                frame_suffix_data.stamp_transmit = fields[1:4]
+            # Precision Timestamp (Version 4.1 and later) (defaults as 0 if N/A)
+            if plan.suffix_precision_timestamp:
+                frame_suffix_data.prec_timestamp_secs, \
+                frame_suffix_data.prec_timestamp_frac_secs = fields[4:6]
+            # Frame parameters
+            param = fields[-1]
+        frame_suffix_data.param = param
+        frame_suffix_data.is_recording = ( param & 0x01 ) != 0
+        frame_suffix_data.tracked_models_changed = ( param & 0x02 ) != 0
+
+        return offset, frame_suffix_data
+
+    def recycle_frame(self, mocap_data):
+        """Empty a pooled frame, keeping its rigid bodies and labeled markers as spares"""
+        rigid_body_list = getattr(mocap_data.rigid_body_data, "rigid_body_list", None)
+        if rigid_body_list:
+            self.spare_rigid_bodies += rigid_body_list
+        labeled_marker_list = getattr(mocap_data.labeled_marker_data, "labeled_marker_list", None)
+        if labeled_marker_list:
+            self.spare_labeled_markers += labeled_marker_list
+        prefix_data = mocap_data.prefix_data
+        for name in MoCapData.FRAME_CLASS_SLOTS["MoCapData"]:
+            setattr(mocap_data, name, None)
+        if prefix_data is None:
+            prefix_data = self.frame_classes.FramePrefixData(0)
+        mocap_data.prefix_data = prefix_data
+
+    def truncate_frame(self, mocap_data, plan, section_handlers):
+        """Fill in a frame that ran out of data as NatNetClient does.
+
+        The sections left are empty and the suffix has a zero timecode and
+        no timestamp or flags, so listeners still get a complete frame."""
+        for section_name, (unpack_section, set_section) in zip(plan.section_names[-len(section_handlers):], section_handlers):
+            if set_section is not None:
+                set_section(mocap_data, self.empty_section(section_name))
+        frame_suffix_data = self.frame_classes.FrameSuffixData()
+        frame_suffix_data.timecode = 0
+        frame_suffix_data.timecode_sub = 0
+        frame_suffix_data.tracked_models_changed = False
+        mocap_data.set_suffix_data(frame_suffix_data)
+
+    def unpack_mocap_data(self, data, offset, packet_size, major, minor, rigid_body_listener=None):
+        """Decode the frame that starts at offset in data.
+
+        packet_size is the size from the packet header, counted from offset.
+        Returns the offset just past the frame and the decoded MoCapData.
+        Sections skipped with set_sections are left as None.
+        """
+        prepared = self.prepared
+        if prepared is None or prepared[0].major != major or prepared[0].minor != minor:
+            prepared = self.prepare(major, minor)
+        plan, section_handlers = prepared
+        buf = memoryview(data)
+        packet_end = offset + packet_size
+
+        # Frame Prefix Data
+        frame_number, = unpack_int(buf, offset)
+        offset += 4
+        mocap_data = None
+        if self.frame_pool is not None:
+            mocap_data = self.frame_pool.acquire()
+        if mocap_data is None:
+            mocap_data = self.frame_classes.MoCapData()
+            mocap_data.set_prefix_data(self.frame_classes.FramePrefixData(frame_number))
+        else:
+            self.recycle_frame(mocap_data)
+            mocap_data.prefix_data.frame_number = frame_number
+
+        buf_len = len(buf)
+        for section_num, (unpack_section, set_section) in enumerate(section_handlers):
+            offset, section_data = unpack_section(buf, offset, plan, rigid_body_listener)
+            if set_section is not None:
+                set_section(mocap_data, section_data)
+            # A truncated marker set section ends the frame
+            if offset >= buf_len:
+                self.truncate_frame(mocap_data, plan, section_handlers[section_num + 1:])
+                return offset, mocap_data
+
+        # Frame Suffix Data
+        offset, frame_suffix_data = self.unpack_frame_suffix_data(buf, offset, packet_end, plan)
+        mocap_data.set_suffix_data(frame_suffix_data)
+
+        return offset, mocap_data
+
+
+# test program
+
+def get_class_name(obj):
+    """Class name with compact frame classes named as the regular ones"""
+    class_name = type(obj).__name__
+    if hasattr(type(obj), "__slots__") and class_name.startswith("Compact"):
+        return class_name[len("Compact"):]
+    return class_name
+
+def compare_objects(obj_a, obj_b, path="frame"):
+    """Return a list of the paths where two decoded object trees differ"""
+    if get_class_name(obj_a) != get_class_name(obj_b):
+        return ["%s: type %s != %s"%(path, type(obj_a).__name__, type(obj_b).__name__)]
+    if type(obj_a) in (list, tuple):
+        if len(obj_a) != len(obj_b):
+            return ["%s: length %d != %d"%(path, len(obj_a), len(obj_b))]
+        diffs = []
+        for i in range(len(obj_a)):
+            diffs += compare_objects(obj_a[i], obj_b[i], "%s[%d]"%(path, i))
+        return diffs
+    if type(obj_a) == dict:
+        if obj_a.keys() != obj_b.keys():
+            return ["%s: keys %s != %s"%(path, sorted(obj_a.keys()), sorted(obj_b.keys()))]
+        diffs = []
+        for key in obj_a:
+            diffs += compare_objects(obj_a[key], obj_b[key], "%s.%s"%(path, key))
+        return diffs
+    if hasattr(obj_a, "__dict__") or hasattr(type(obj_a), "__slots__"):
+        return compare_objects(get_fields(obj_a), get_fields(obj_b), path)
+    if obj_a != obj_b:
+        return ["%s: %s != %s"%(path, obj_a, obj_b)]
+    return []
+
+def get_fields(obj):
+    """Attributes of a regular or compact frame object"""
+    if hasattr(obj, "__dict__"):
+        return vars(obj)
+    return { name : getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name) }
+
+# NatNet versions covering every version branch in the decoders
+TEST_VERSIONS = [[2,0],[2,5],[2,6],[2,7],[2,9],[2,11],[3,0],[3,1],[4,0],[4,1]]
+
+def generate_test_frame(frame_num=0):
+    """generate_mocap_data plus the sections it leaves unset"""
+    mocap_data = MoCapData.generate_mocap_data(frame_num)
+    mocap_data.set_legacy_other_markers(MoCapData.generate_legacy_marker_data(frame_num))
+    mocap_data.set_asset_data(MoCapData.generate_asset_data(frame_num))
+    return mocap_data
+
+def decode_reference(client, packet, major, minor, rigid_body_listener=None):
+    """Decode a packet with NatNetClient.__unpack_mocap_data"""
+    client.rigid_body_listener = rigid_body_listener
+    packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+    return client._NatNetClient__unpack_mocap_data(packet[4:], packet_size, major, minor)
+
+def decode_fast(decoder, packet, major, minor, rigid_body_listener=None):
+    packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+    offset, mocap_data = decoder.unpack_mocap_data(packet, 4, packet_size, major, minor, rigid_body_listener)
+    return offset - 4, mocap_data
+
+def test_decoder(frame_num, major, minor):
+    """Differential test of FrameDecoder against NatNetClient"""
+    from . import NatNetClient
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    decoder = FrameDecoder()
+    packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+
+    ref_calls = []
+    fast_calls = []
+    ref_offset, ref_data = decode_reference(client, packet, major, minor,
+        lambda *args: ref_calls.append(args))
+    fast_offset, fast_data = decode_fast(decoder, packet, major, minor,
+        lambda *args: fast_calls.append(args))
+
+    diffs = compare_objects(ref_data, fast_data)
+    diffs += compare_objects(ref_calls, fast_calls, "rigid_body_listener")
+    if ref_offset != fast_offset:
+        diffs.append("offset: %d != %d"%(ref_offset, fast_offset))
+    return diffs
+
+def test_rigid_body_filter(frame_num, major, minor):
+    """Only the subscribed rigid body is decoded and passed to its listener"""
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+    full_offset, full_data = decode_fast(FrameDecoder(), packet, major, minor)
+    calls = []
+    decoder = FrameDecoder()
+    decoder.set_rigid_body_filter({1: lambda *args: calls.append(args), 99: None})
+    offset, mocap_data = decode_fast(decoder, packet, major, minor)
+
+    rigid_body = full_data.rigid_body_data.rigid_body_list[1]
+    diffs = []
+    if full_offset != offset:
+        diffs.append("offset: %d != %d"%(full_offset, offset))
+    diffs += compare_objects([rigid_body], mocap_data.rigid_body_data.rigid_body_list, "rigid_body_list")
+    diffs += compare_objects([(1, rigid_body.pos, rigid_body.rot)], calls, "listener")
+    diffs += compare_objects(full_data.suffix_data, mocap_data.suffix_data, "suffix_data")
+    return diffs
+
+def test_selective_decoder(frame_num, major, minor):
+    """Rigid body only decode against a full decode of the same packet"""
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+    full_offset, full_data = decode_fast(FrameDecoder(), packet, major, minor)
+    offset, mocap_data = decode_fast(FrameDecoder(["rigid_bodies"]), packet, major, minor)
+
+    diffs = []
+    if full_offset != offset:
+        diffs.append("offset: %d != %d"%(full_offset, offset))
+    if not has_data_size(major, minor):
+        # No byte counts to skip with, everything is decoded
+        return diffs + compare_objects(full_data, mocap_data)
+    diffs += compare_objects(full_data.prefix_data, mocap_data.prefix_data, "prefix_data")
+    diffs += compare_objects(full_data.rigid_body_data, mocap_data.rigid_body_data, "rigid_body_data")
+    diffs += compare_objects(full_data.suffix_data, mocap_data.suffix_data, "suffix_data")
+    for name in ["marker_set_data", "legacy_other_markers", "skeleton_data", "asset_data",
+                 "labeled_marker_data", "force_plate_data", "device_data"]:
+        if getattr(mocap_data, name) is not None:
+            diffs.append("%s was not skipped"%name)
+    return diffs
+
+def test_decode_plan_switch(frame_num):
+    """One decoder across version changes against a fresh decoder per version"""
+    from . import NatNetPacker
+    decoder = FrameDecoder(["rigid_bodies", "labeled_markers"])
+    decoder.prepare(4, 1)
+    diffs = []
+    for major, minor in [[4,1],[2,5],[3,1],[4,1]]:
+        packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+        ref_offset, ref_data = decode_fast(FrameDecoder(["rigid_bodies", "labeled_markers"]), packet, major, minor)
+        offset, mocap_data = decode_fast(decoder, packet, major, minor)
+        if ref_offset != offset:
+            diffs.append("%d.%d offset: %d != %d"%(major, minor, ref_offset, offset))
+        diffs += compare_objects(ref_data, mocap_data, "frame %d.%d"%(major, minor))
+    if len(decoder.plans) != 3:
+        diffs.append("%d plans built != 3"%len(decoder.plans))
+    return diffs
+
+def test_compact_decoder(frame_num, major, minor):
+    """Compact frames hold the same values as regular ones, without a __dict__"""
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+    ref_offset, ref_data = decode_fast(FrameDecoder(), packet, major, minor)
+    decoder = FrameDecoder()
+    decoder.set_compact(True)
+    offset, mocap_data = decode_fast(decoder, packet, major, minor)
+    diffs = compare_objects(ref_data, mocap_data)
+    if ref_offset != offset:
+        diffs.append("offset: %d != %d"%(ref_offset, offset))
+    for obj in [mocap_data, mocap_data.suffix_data] + mocap_data.rigid_body_data.rigid_body_list:
+        if hasattr(obj, "__dict__"):
+            diffs.append("%s has a __dict__"%type(obj).__name__)
+    return diffs
+
+def test_frame_pool(major, minor):
+    """Frames decoded into released ones match freshly decoded frames"""
+    from . import NatNetPacker
+    frame_pool = FramePool(2)
+    decoder = FrameDecoder()
+    decoder.set_compact(True)
+    decoder.set_frame_pool(frame_pool)
+    diffs = []
+    previous_frames = set()
+    # The filter changes the rigid body count between frames
+    for frame_num, rigid_body_filter in [(0, None), (1, {1: None}), (2, None), (3, None), (4, {0: None, 1: None})]:
+        packet = NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor)
+        reference = FrameDecoder()
+        reference.set_rigid_body_filter(rigid_body_filter)
+        ref_offset, ref_data = decode_fast(reference, packet, major, minor)
+        decoder.set_rigid_body_filter(rigid_body_filter)
+        offset, mocap_data = decode_fast(decoder, packet, major, minor)
+        diffs += compare_objects(ref_data, mocap_data, "frame %d"%frame_num)
+        if frame_num > 0 and id(mocap_data) not in previous_frames:
+            diffs.append("frame %d was not reused"%frame_num)
+        previous_frames.add(id(mocap_data))
+        frame_pool.release(mocap_data)
+    counters = frame_pool.get_counters()
+    if counters["reused"] != 4:
+        diffs.append("counters %s"%str(counters))
+    return diffs
+
+def test_client_frame_pool(major, minor):
+    """NatNetClient returns frames to the pool unless a frame hub holds them"""
+    from . import NatNetClient
+    from . import NatNetHub
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    client.set_use_fast_decoder(True)
+    client.set_use_compact_frames(True)
+    client.set_use_frame_pool(True)
+    client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+    packets = [NatNetPacker.pack_mocap_data(generate_test_frame(frame_num), major, minor) for frame_num in range(3)]
+    for packet in packets:
+        client.process_message(packet)
+    diffs = []
+    if client.frame_pool.get_counters()["reused"] != 2:
+        diffs.append("counters %s"%str(client.frame_pool.get_counters()))
+    hub = NatNetHub.FrameHub()
+    subscription = hub.subscribe("test")
+    client.set_frame_hub(hub)
+    for packet in packets:
+        client.process_message(packet)
+    frames = [subscription.get(0) for _ in range(3)]
+    if len(set(id(frame) for frame in frames)) != 3:
+        diffs.append("hub frames were reused")
+    hub.close()
+    return diffs
+
+def pack_truncated_frame(mocap_data, major, minor):
+    """Pack mocap_data and cut the packet short inside its first marker set"""
+    from . import NatNetPacker
+    packet = NatNetPacker.pack_mocap_data(mocap_data, major, minor)
+    # Header, frame number, marker set count, first model name and marker count, then part of a marker
+    model_name = mocap_data.marker_set_data.marker_data_list[0].model_name
+    length = 4 + 4 + 4 + len(model_name) + 1 + 4 + 6
+    if has_data_size(major, minor):
+        length += 4
+    # The header counts the bytes that were sent
+    return packet[:2] + (length - 4).to_bytes(2, byteorder='little') + packet[4:length]
+
+def test_truncated_frame(major, minor):
+    """A frame cut short inside the marker sets decodes as NatNetClient decodes it"""
+    import contextlib
+    import io
+    from . import NatNetClient
+    packet = pack_truncated_frame(generate_test_frame(11), major, minor)
+    client = NatNetClient.NatNetClient()
+    frames = []
+    client.new_frame_listener = frames.append
+    with contextlib.redirect_stdout(io.StringIO()):
+        ref_offset, ref_data = decode_reference(client, packet, major, minor)
+        fast_offset, fast_data = decode_fast(FrameDecoder(), packet, major, minor)
+        # The client fast path builds the listener dictionary from the frame
+        client.set_use_fast_decoder(True)
+        client.set_nat_net_version(major, minor)
+        frames.clear()
+        client.process_message(packet)
+    diffs = compare_objects(ref_data, fast_data)
+    if len(frames) != 1 or frames[0]["timestamp"] != -1:
+        diffs.append("frame listener got %s"%str(frames))
+    return diffs
+
+def run_test_case(test_name, test_function, run_test, totals):
+    if not run_test:
+        print("[SKIP]:%s"%test_name)
+        return MoCapData.add_lists(totals, MoCapData.K_SKIP)
+    diffs = test_function()
+    if len(diffs) == 0:
+        print("[PASS]:%s"%test_name)
+        return MoCapData.add_lists(totals, MoCapData.K_PASS)
+    print("[FAIL]:%s"%test_name)
+    for diff in diffs:
+        print("       %s"%diff)
+    return MoCapData.add_lists(totals, MoCapData.K_FAIL)
+
+def test_all(run_test=True):
+    totals=[0,0,0]
+    for major, minor in TEST_VERSIONS:
+        for frame_num in [0, 1, 317]:
+            test_name = "Test Fast Decoder %d.%d Frame %d"%(major, minor, frame_num)
+            totals = run_test_case(test_name, lambda: test_decoder(frame_num, major, minor), run_test, totals)
+    for major, minor in TEST_VERSIONS:
+        test_name = "Test Selective Decoder %d.%d"%(major, minor)
+        totals = run_test_case(test_name, lambda: test_selective_decoder(5, major, minor), run_test, totals)
+    for major, minor in TEST_VERSIONS:
+        test_name = "Test Rigid Body Filter %d.%d"%(major, minor)
+        totals = run_test_case(test_name, lambda: test_rigid_body_filter(9, major, minor), run_test, totals)
+    totals = run_test_case("Test Decode Plan Version Switch", lambda: test_decode_plan_switch(3), run_test, totals)
+    for major, minor in [[3,1],[4,1]]:
+        test_name = "Test Truncated Frame %d.%d"%(major, minor)
+        totals = run_test_case(test_name, lambda: test_truncated_frame(major, minor), run_test, totals)
+    for major, minor in [[2,5],[3,1],[4,1]]:
+        test_name = "Test Compact Decoder %d.%d"%(major, minor)
+        totals = run_test_case(test_name, lambda: test_compact_decoder(7, major, minor), run_test, totals)
+        test_name = "Test Frame Pool %d.%d"%(major, minor)
+        totals = run_test_case(test_name, lambda: test_frame_pool(major, minor), run_test, totals)
+    totals = run_test_case("Test Client Frame Pool 4.1", lambda: test_client_frame_pool(4, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,288 @@
+# OptiTrack NatNet frame fan-out for Python 3.x
+#
+# FrameHub hands every decoded frame published by NatNetClient to any
+# number of subscribers, each with its own bounded queue and drop policy.
+# A recorder, a live visualizer and a metrics exporter can then consume
+# frames at their own pace without stalling the decode thread or each
+# other.  Only BLOCK subscribers can hold up the publisher, and only while
+# their own queue is full.
+
+from collections import deque
+from threading import Condition, Lock, Thread
+
+# Drop policies, applied when a subscriber queue is full
+# DROP_OLDEST discards the oldest queued frame to make room
+DROP_OLDEST = "drop_oldest"
+# BLOCK makes the publisher wait for room, up to block_timeout seconds
+BLOCK = "block"
+# EVERY_NTH only queues every Nth published frame, then drops the oldest
+EVERY_NTH = "every_nth"
+DROP_POLICIES = [DROP_OLDEST, BLOCK, EVERY_NTH]
+
+DEFAULT_QUEUE_SIZE = 64
+
+
+class Subscription:
+    """Bounded frame queue of one FrameHub subscriber.
+
+    Frames are taken with get or by iterating, which ends once the
+    subscription is closed and the queue is drained.
+    """
+    def __init__(self, name, max_size=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST, every_n=1, block_timeout=None):
+        if policy not in DROP_POLICIES:
+            raise ValueError("Unknown drop policy %s, valid policies are %s"%(policy, ", ".join(DROP_POLICIES)))
+        self.name = name
+        self.max_size = max(max_size, 1)
+        self.policy = policy
+        self.every_n = max(every_n, 1)
+        self.block_timeout = block_timeout
+        self.queue = deque()
+        self.condition = Condition()
+        self.closed = False
+        self.listener_thread = None
+        # Counters, see get_counters
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def offer(self, frame):
+        """Queue a frame following the drop policy, called on the publisher thread"""
+        with self.condition:
+            if self.closed:
+                return
+            self.published += 1
+            if self.policy == EVERY_NTH and (self.published - 1) % self.every_n != 0:
+                self.skipped += 1
+                return
+            if len(self.queue) >= self.max_size:
+                if self.policy == BLOCK:
+                    self.condition.wait_for(lambda: self.closed or len(self.queue) < self.max_size, self.block_timeout)
+                    if self.closed:
+                        return
+                    if len(self.queue) >= self.max_size:
+                        # Timed out, the new frame is the one lost
+                        self.dropped += 1
+                        return
+                else:
+                    self.queue.popleft()
+                    self.dropped += 1
+            self.queue.append(frame)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Oldest queued frame, None if nothing arrived within timeout or the subscription is closed"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue or self.closed, timeout):
+                return None
+            if not self.queue:
+                return None
+            frame = self.queue.popleft()
+            self.delivered += 1
+            # Wake a publisher blocked on a full queue
+            self.condition.notify_all()
+            return frame
+
+    def __iter__(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    return
+                frame = self.queue.popleft()
+                self.delivered += 1
+                self.condition.notify_all()
+            yield frame
+
+    def get_pending(self):
+        """Number of frames waiting for the subscriber"""
+        with self.condition:
+            return len(self.queue)
+
+    def get_counters(self):
+        """published: frames offered by the hub
+        delivered: frames taken by the subscriber
+        dropped: frames lost to a full queue
+        skipped: frames left out by EVERY_NTH
+        pending: frames still queued"""
+        with self.condition:
+            return { "published" : self.published,
+                     "delivered" : self.delivered,
+                     "dropped"   : self.dropped,
+                     "skipped"   : self.skipped,
+                     "pending"   : len(self.queue) }
+
+    def close(self):
+        """Stop accepting frames, the queued ones can still be taken"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FrameHub:
+    """Publishes each frame to every subscription.
+
+    Attach it with NatNetClient.set_frame_hub to receive the decoded
+    MoCapData of every frame.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.subscriptions = []
+
+    def subscribe(self, name, max_size=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST, every_n=1, block_timeout=None, listener=None):
+        """Add a subscriber queue and return its Subscription.
+
+        With a listener, a thread named after the subscriber calls
+        listener( frame ) for every queued frame until the subscription
+        is closed."""
+        subscription = Subscription(name, max_size, policy, every_n, block_timeout)
+        if listener is not None:
+            subscription.listener_thread = Thread( target = self.__listener_thread_function,
+                                                   args = (subscription, listener),
+                                                   name = "FrameHub %s"%name, daemon = True )
+            subscription.listener_thread.start()
+        with self.lock:
+            # Copy on write, publish iterates without the lock
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+        subscription.close()
+        if subscription.listener_thread is not None:
+            subscription.listener_thread.join()
+
+    def publish(self, frame):
+        for subscription in self.subscriptions:
+            subscription.offer(frame)
+
+    def get_counters(self):
+        """Dictionary of subscriber name to Subscription.get_counters"""
+        return { subscription.name : subscription.get_counters() for subscription in self.subscriptions }
+
+    def close(self):
+        """Close every subscription and wait for the listener threads to finish"""
+        with self.lock:
+            subscriptions = self.subscriptions
+            self.subscriptions = []
+        for subscription in subscriptions:
+            subscription.close()
+        for subscription in subscriptions:
+            if subscription.listener_thread is not None:
+                subscription.listener_thread.join()
+
+    def __listener_thread_function(self, subscription, listener):
+        for frame in subscription:
+            listener(frame)
+
+
+# test program
+
+def test_drop_oldest():
+    hub = FrameHub()
+    subscription = hub.subscribe("visualizer", max_size=3)
+    for frame_num in range(5):
+        hub.publish(frame_num)
+    hub.close()
+    diffs = []
+    received = list(subscription)
+    if received != [2, 3, 4]:
+        diffs.append("received %s != [2, 3, 4]"%str(received))
+    counters = subscription.get_counters()
+    if counters["dropped"] != 2 or counters["delivered"] != 3:
+        diffs.append("counters %s"%str(counters))
+    return diffs
+
+def test_every_nth():
+    hub = FrameHub()
+    subscription = hub.subscribe("metrics", max_size=2, policy=EVERY_NTH, every_n=3)
+    for frame_num in range(10):
+        hub.publish(frame_num)
+    hub.close()
+    diffs = []
+    received = list(subscription)
+    # 0, 3, 6 and 9 are sampled, the queue keeps the newest two
+    if received != [6, 9]:
+        diffs.append("received %s != [6, 9]"%str(received))
+    counters = subscription.get_counters()
+    if counters["skipped"] != 6 or counters["dropped"] != 2:
+        diffs.append("counters %s"%str(counters))
+    return diffs
+
+def test_block():
+    """A blocking subscriber loses nothing, a slow drop oldest one does not hold it up"""
+    import time
+    hub = FrameHub()
+    recorded = []
+    def slow_recorder(frame):
+        time.sleep(0.001)
+        recorded.append(frame)
+    recorder = hub.subscribe("recorder", max_size=4, policy=BLOCK, listener=slow_recorder)
+    stalled = hub.subscribe("stalled", max_size=4)
+    num_frames = 50
+    for frame_num in range(num_frames):
+        hub.publish(frame_num)
+    # Let the recorder drain before closing
+    while recorder.get_pending() > 0:
+        time.sleep(0.001)
+    hub.close()
+    diffs = []
+    if recorded != list(range(num_frames)):
+        diffs.append("recorded %d frames, %d dropped"%(len(recorded), recorder.get_counters()["dropped"]))
+    if stalled.get_counters()["dropped"] != num_frames - 4:
+        diffs.append("stalled counters %s"%str(stalled.get_counters()))
+    return diffs
+
+def test_block_timeout():
+    hub = FrameHub()
+    subscription = hub.subscribe("recorder", max_size=1, policy=BLOCK, block_timeout=0.01)
+    hub.publish(0)
+    hub.publish(1)
+    diffs = []
+    if subscription.get(0) != 0 or subscription.get(0) is not None:
+        diffs.append("timed out frame was queued")
+    if subscription.get_counters()["dropped"] != 1:
+        diffs.append("counters %s"%str(subscription.get_counters()))
+    hub.close()
+    return diffs
+
+def test_client_publish(major, minor):
+    """NatNetClient publishes the decoded MoCapData of each frame"""
+    from . import NatNetClient
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    hub = FrameHub()
+    subscription = hub.subscribe("test")
+    diffs = []
+    for use_fast_decoder in [False, True]:
+        client = NatNetClient.NatNetClient()
+        client.set_use_fast_decoder(use_fast_decoder)
+        client.set_frame_hub(hub)
+        client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+        for frame_num in range(3):
+            client.process_message(NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor))
+        frame_numbers = [subscription.get(0).prefix_data.frame_number for _ in range(3)]
+        if frame_numbers != [0, 1, 2]:
+            diffs.append("fast decoder %s frames %s"%(use_fast_decoder, str(frame_numbers)))
+    hub.close()
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Hub Drop Oldest", test_drop_oldest, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Hub Every Nth", test_every_nth, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Hub Block", test_block, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Hub Block Timeout", test_block_timeout, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Hub Client Publish 4.1", lambda: test_client_publish(4, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,308 @@
+# OptiTrack NatNet end to end latency metrics for Python 3.x
+#
+# Splits the latency of each frame into stages from the frame suffix
+# stamps (NatNet 3.0 and later) and host clock readings taken by
+# NatNetClient:
+#   exposure_to_transmit      camera mid exposure to Motive transmit
+#   transmit_to_receive       Motive transmit to the data socket read
+#   receive_to_decoded        data socket read to the end of decoding
+#   decoded_to_listener_done  end of decoding to the last listener returning
+# The suffix stamps are in Motive high resolution clock ticks, converted
+# with the clock frequency from the server info.  Motive and host clocks
+# are not synchronized, so transmit_to_receive is measured above the
+# smallest clock offset seen recently: it shows network and queueing delay
+# on top of the fastest delivery, not the absolute one way delay.
+
+import json
+import time
+from threading import Event, Lock, Thread
+
+LATENCY_STAGES = ["exposure_to_transmit", "transmit_to_receive", "receive_to_decoded", "decoded_to_listener_done"]
+
+# Samples kept per stage for percentiles and histograms
+DEFAULT_WINDOW = 1024
+
+# Upper bucket edges in ms, the last bucket counts everything above
+HISTOGRAM_EDGES_MS = [0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0]
+
+# Frames per clock offset epoch, the offset is the minimum over the
+# current and the previous epoch so clock drift is followed
+CLOCK_OFFSET_EPOCH = 1000
+
+
+class LatencyHistogram:
+    """Rolling window of latency samples in seconds"""
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = max(window, 1)
+        self.samples = []
+        self.next_index = 0
+        self.count = 0
+
+    def add(self, seconds):
+        if len(self.samples) < self.window:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.next_index] = seconds
+            self.next_index = (self.next_index + 1) % self.window
+        self.count += 1
+
+    def get_stats(self):
+        """count is every sample added, the rest is over the window, times in ms"""
+        samples = sorted(self.samples)
+        stats = { "count" : self.count }
+        if not samples:
+            return stats
+        n = len(samples)
+        def percentile(fraction):
+            return samples[min(int(fraction * n), n - 1)] * 1000.0
+        stats["mean_ms"] = sum(samples) / n * 1000.0
+        stats["p50_ms"] = percentile(0.50)
+        stats["p90_ms"] = percentile(0.90)
+        stats["p99_ms"] = percentile(0.99)
+        stats["max_ms"] = samples[-1] * 1000.0
+        counts = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        bucket = 0
+        for sample in samples:
+            while bucket < len(HISTOGRAM_EDGES_MS) and sample * 1000.0 > HISTOGRAM_EDGES_MS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        stats["histogram"] = { "edges_ms" : HISTOGRAM_EDGES_MS, "counts" : counts }
+        return stats
+
+
+class ClockOffsetEstimator:
+    """Host clock minus Motive clock, from the smallest difference seen recently"""
+    def __init__(self, epoch=CLOCK_OFFSET_EPOCH):
+        self.epoch = epoch
+        self.previous_minimum = None
+        self.minimum = None
+        self.epoch_count = 0
+
+    def add(self, offset):
+        """Add one receive time minus transmit time, returns the current offset"""
+        if self.minimum is None or offset < self.minimum:
+            self.minimum = offset
+        self.epoch_count += 1
+        if self.epoch_count >= self.epoch:
+            self.previous_minimum = self.minimum
+            self.minimum = None
+            self.epoch_count = 0
+        return self.get_offset()
+
+    def get_offset(self):
+        if self.previous_minimum is None:
+            return self.minimum
+        if self.minimum is None:
+            return self.previous_minimum
+        return min(self.minimum, self.previous_minimum)
+
+
+class LatencyStats:
+    """Latency histograms of every stage, fed by NatNetClient for each frame"""
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.lock = Lock()
+        self.histograms = { stage : LatencyHistogram(window) for stage in LATENCY_STAGES }
+        self.clock_offset = ClockOffsetEstimator()
+        self.frames = 0
+
+    def add_frame(self, suffix_data, receive_time, decoded_time, done_time, clock_frequency=0):
+        """Record one frame.
+
+        Host times are time.perf_counter() seconds.  The Motive stages are
+        only recorded when the stream has the 3.0 stamps and the server
+        sent its clock frequency."""
+        with self.lock:
+            self.frames += 1
+            histograms = self.histograms
+            if clock_frequency > 0 and suffix_data is not None and suffix_data.stamp_transmit != 0:
+                transmit = suffix_data.stamp_transmit / clock_frequency
+                if suffix_data.stamp_camera_mid_exposure != 0:
+                    histograms["exposure_to_transmit"].add(transmit - suffix_data.stamp_camera_mid_exposure / clock_frequency)
+                offset = self.clock_offset.add(receive_time - transmit)
+                histograms["transmit_to_receive"].add(receive_time - transmit - offset)
+            histograms["receive_to_decoded"].add(decoded_time - receive_time)
+            histograms["decoded_to_listener_done"].add(done_time - decoded_time)
+
+    def get_stats(self):
+        """Dictionary of stage to LatencyHistogram.get_stats, plus the frame count and clock offset"""
+        with self.lock:
+            stats = { stage : self.histograms[stage].get_stats() for stage in LATENCY_STAGES }
+            stats["frames"] = self.frames
+            stats["clock_offset_s"] = self.clock_offset.get_offset()
+        return stats
+
+    def get_as_json(self):
+        return json.dumps(self.get_stats())
+
+
+class LatencyDump:
+    """Appends a JSON line with the latency stats to a file every interval seconds"""
+    def __init__(self, latency_stats, file_name, interval=1.0):
+        self.latency_stats = latency_stats
+        self.file_name = file_name
+        self.interval = interval
+        self.stop_event = Event()
+        self.thread = Thread( target = self.__dump_thread_function, name = "LatencyDump", daemon = True )
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread after one last line"""
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, dump_file):
+        stats = self.latency_stats.get_stats()
+        stats["time"] = time.time()
+        dump_file.write(json.dumps(stats) + "\n")
+        dump_file.flush()
+
+    def __dump_thread_function(self):
+        with open(self.file_name, 'a') as dump_file:
+            while not self.stop_event.wait(self.interval):
+                self.write(dump_file)
+            self.write(dump_file)
+
+
+# test program
+
+def test_histogram():
+    histogram = LatencyHistogram(100)
+    # Only the last 100 of 200 samples, 1 to 100 ms, are in the window
+    for i in range(200):
+        histogram.add(((i % 100) + 1) / 1000.0)
+    stats = histogram.get_stats()
+    diffs = []
+    if stats["count"] != 200:
+        diffs.append("count %d"%stats["count"])
+    for name, expected in [("p50_ms", 51.0), ("p90_ms", 91.0), ("p99_ms", 100.0), ("max_ms", 100.0), ("mean_ms", 50.5)]:
+        if abs(stats[name] - expected) > 1e-6:
+            diffs.append("%s %f != %f"%(name, stats[name], expected))
+    if sum(stats["histogram"]["counts"]) != 100:
+        diffs.append("histogram counts %s"%str(stats["histogram"]["counts"]))
+    # 1 ms is in the 1.0 bucket, 2 to 5 ms in the 5.0 one
+    if stats["histogram"]["counts"][4] != 1 or stats["histogram"]["counts"][6] != 3:
+        diffs.append("histogram counts %s"%str(stats["histogram"]["counts"]))
+    return diffs
+
+def test_stages():
+    """Motive stages from the suffix stamps, host stages from the receive times"""
+    from . import MoCapData
+    stats = LatencyStats()
+    clock_frequency = 10000000
+    # Motive clock 100 s behind the host, network delay 1 ms plus 0 to 4 ms of queueing
+    for frame_num in range(5):
+        suffix_data = MoCapData.FrameSuffixData()
+        exposure = 10.0 + frame_num / 100.0
+        suffix_data.stamp_camera_mid_exposure = int(exposure * clock_frequency)
+        suffix_data.stamp_transmit = int((exposure + 0.004) * clock_frequency)
+        receive_time = exposure + 0.004 + 100.0 + 0.001 + frame_num / 1000.0
+        stats.add_frame(suffix_data, receive_time, receive_time + 0.0002, receive_time + 0.0005, clock_frequency)
+    result = stats.get_stats()
+    diffs = []
+    for stage, expected in [("exposure_to_transmit", 4.0), ("transmit_to_receive", 4.0),
+                            ("receive_to_decoded", 0.2), ("decoded_to_listener_done", 0.3)]:
+        if abs(result[stage]["max_ms"] - expected) > 1e-3:
+            diffs.append("%s max %f != %f"%(stage, result[stage]["max_ms"], expected))
+    if abs(result["clock_offset_s"] - 100.001) > 1e-6:
+        diffs.append("clock offset %f"%result["clock_offset_s"])
+    json.loads(stats.get_as_json())
+    return diffs
+
+def test_client_latency(major, minor):
+    """NatNetClient records every frame, the Motive stages once the clock frequency is known"""
+    import os
+    import tempfile
+    from . import NatNetClient
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    client.set_use_fast_decoder(True)
+    client.enable_latency_stats()
+    client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0], 1000000000))
+    handle, file_name = tempfile.mkstemp(suffix='.jsonl')
+    os.close(handle)
+    diffs = []
+    try:
+        client.start_latency_dump(file_name, 0.01)
+        for frame_num in range(4):
+            frame = NatNetDecoder.generate_test_frame(frame_num)
+            now_ns = time.perf_counter_ns()
+            frame.suffix_data.stamp_camera_mid_exposure = now_ns - 2000000
+            frame.suffix_data.stamp_data_received = now_ns - 1000000
+            frame.suffix_data.stamp_transmit = now_ns
+            client.process_message(NatNetPacker.pack_mocap_data(frame, major, minor))
+        client.stop_latency_dump()
+        stats = client.get_latency_stats()
+        if stats["frames"] != 4:
+            diffs.append("frames %d"%stats["frames"])
+        for stage in LATENCY_STAGES:
+            if stats[stage]["count"] != 4:
+                diffs.append("%s count %d"%(stage, stats[stage]["count"]))
+        if abs(stats["exposure_to_transmit"]["max_ms"] - 2.0) > 1e-6:
+            diffs.append("exposure to transmit %f"%stats["exposure_to_transmit"]["max_ms"])
+        with open(file_name) as dump_file:
+            lines = [json.loads(line) for line in dump_file]
+        if not lines or lines[-1]["frames"] != 4:
+            diffs.append("dump %s"%str(lines[-1:]))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_client_stats(major, minor):
+    """NatNetClient.stats counts gaps, late frames, messages and decode times"""
+    from . import NatNetClient
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    client.set_use_fast_decoder(True)
+    client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+    # 3 and 4 are lost, 1 arrives late and twice
+    frame_numbers = [0, 2, 1, 5, 6, 1]
+    num_bytes = 0
+    for frame_num in frame_numbers:
+        packet = NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(frame_num), major, minor)
+        num_bytes += len(packet)
+        client.count_packet(packet, len(packet))
+        client.process_message(packet)
+    stats = client.stats()
+    diffs = []
+    for name, expected in [("frames_received", 6), ("frames_missing", 3), ("frames_out_of_order", 2), ("bytes_received", num_bytes)]:
+        if stats[name] != expected:
+            diffs.append("%s %d != %d"%(name, stats[name], expected))
+    if stats["messages"] != { "NAT_SERVERINFO" : 1, "NAT_FRAMEOFDATA" : 6 }:
+        diffs.append("messages %s"%str(stats["messages"]))
+    if stats["decode_ms"]["count"] != 6 or stats["listener_ms"]["count"] != 6:
+        diffs.append("decode %d listener %d"%(stats["decode_ms"]["count"], stats["listener_ms"]["count"]))
+    if stats["bytes_per_second"] <= 0:
+        diffs.append("bytes per second %f"%stats["bytes_per_second"])
+    # A restarted stream is not out of order
+    packet = NatNetPacker.pack_mocap_data(NatNetDecoder.generate_test_frame(0), major, minor)
+    client.reset_stats()
+    client.count_packet(packet, len(packet))
+    frame = NatNetDecoder.generate_test_frame(0)
+    frame.prefix_data.frame_number = 5000
+    packet = NatNetPacker.pack_mocap_data(frame, major, minor)
+    client.count_packet(packet, len(packet))
+    client.count_packet(packet[:4] + (0).to_bytes(4, 'little') + packet[8:], len(packet))
+    if client.stats()["frames_out_of_order"] != 0:
+        diffs.append("restart counted out of order")
+    json.dumps(client.stats())
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Latency Histogram", test_histogram, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Latency Stages", test_stages, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Latency Client 4.1", lambda: test_client_latency(4, 1), run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Client Stats 4.1", lambda: test_client_stats(4, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,319 @@
+# OptiTrack NatNet packetization helpers for Python 3.x
+#
+# Serializes MoCapData objects into the NatNet wire format read by
+# NatNetClient.  Each pack_* function mirrors the matching __unpack_*
+# method in NatNetClient.py, including its version checks, so frames built
+# with the generate_* factories can be fed back through the decoders.
+
+import struct
+
+# Client/server message ids
+NAT_SERVERINFO            = 1
+NAT_RESPONSE              = 3
+NAT_MODELDEF              = 5
+NAT_FRAMEOFDATA           = 7
+NAT_UNRECOGNIZED_REQUEST  = 100
+
+IntValue = struct.Struct( '<i' )
+Int64Value = struct.Struct( '<q' )
+Uint64Value = struct.Struct( '<Q' )
+ShortValue = struct.Struct( '<h' )
+FloatValue = struct.Struct( '<f' )
+DoubleValue = struct.Struct( '<d' )
+Vector3 = struct.Struct( '<fff' )
+Quaternion = struct.Struct( '<ffff' )
+
+
+def has_data_size(major, minor):
+    """NatNet 4.1 and later write a byte count ahead of each frame section"""
+    return ((major == 4) and (minor > 0)) or (major > 4)
+
+def pack_string(in_str):
+    if type(in_str) == str:
+        in_str = in_str.encode('utf-8')
+    return bytes(in_str) + b'\0'
+
+def pack_first(value):
+    # Some decoded values are kept as the 1-tuples returned by struct.unpack
+    if type(value) == tuple:
+        value = value[0]
+    return value
+
+def pack_section(count, items, major, minor):
+    """Count, optional data size and the section payload"""
+    out_data = IntValue.pack(count)
+    if has_data_size(major, minor):
+        out_data += IntValue.pack(len(items))
+    out_data += items
+    return out_data
+
+def pack_frame_prefix_data(prefix_data):
+    return IntValue.pack(prefix_data.frame_number)
+
+def pack_marker_set_data(marker_set_data, major, minor):
+    items = bytearray()
+    for marker_data in marker_set_data.marker_data_list:
+        items += pack_string(marker_data.model_name)
+        items += IntValue.pack(len(marker_data.marker_pos_list))
+        for pos in marker_data.marker_pos_list:
+            items += Vector3.pack(*pos)
+    return pack_section(len(marker_set_data.marker_data_list), items, major, minor)
+
+def pack_legacy_other_markers(legacy_marker_data, major, minor):
+    items = bytearray()
+    marker_pos_list = []
+    if legacy_marker_data is not None:
+        marker_pos_list = legacy_marker_data.marker_pos_list
+    for pos in marker_pos_list:
+        items += Vector3.pack(*pos)
+    return pack_section(len(marker_pos_list), items, major, minor)
+
+def pack_rigid_body(rigid_body, major, minor):
+    out_data = bytearray()
+    out_data += IntValue.pack(rigid_body.id_num)
+    out_data += Vector3.pack(*rigid_body.pos)
+    out_data += Quaternion.pack(*rigid_body.rot)
+
+    # RB Marker Data ( Before version 3.0.  After Version 3.0 Marker data is in description )
+    if( major < 3  and major != 0) :
+        out_data += IntValue.pack(len(rigid_body.rb_marker_list))
+        for rb_marker in rigid_body.rb_marker_list:
+            out_data += Vector3.pack(*rb_marker.pos)
+        if major >= 2:
+            for rb_marker in rigid_body.rb_marker_list:
+                out_data += IntValue.pack(getattr(rb_marker, 'id', rb_marker.id_num))
+            for rb_marker in rigid_body.rb_marker_list:
+                out_data += FloatValue.pack(pack_first(rb_marker.size))
+
+    if major >= 2 :
+        out_data += FloatValue.pack(rigid_body.error)
+
+    # Version 2.6 and later
+    if ( ( major == 2 ) and ( minor >= 6 ) ) or major > 2 :
+        param = 0
+        if rigid_body.tracking_valid:
+            param = 0x01
+        out_data += ShortValue.pack(param)
+    return out_data
+
+def pack_rigid_body_data(rigid_body_data, major, minor):
+    items = bytearray()
+    for rigid_body in rigid_body_data.rigid_body_list:
+        items += pack_rigid_body(rigid_body, major, minor)
+    return pack_section(len(rigid_body_data.rigid_body_list), items, major, minor)
+
+def pack_skeleton_data(skeleton_data, major, minor):
+    out_data = bytearray()
+    # Version 2.1 and later
+    if( ( major == 2 and minor > 0 ) or major > 2 ):
+        items = bytearray()
+        for skeleton in skeleton_data.skeleton_list:
+            items += IntValue.pack(skeleton.id_num)
+            items += IntValue.pack(len(skeleton.rigid_body_list))
+            for rigid_body in skeleton.rigid_body_list:
+                items += pack_rigid_body(rigid_body, major, minor)
+        out_data += pack_section(len(skeleton_data.skeleton_list), items, major, minor)
+    return out_data
+
+def pack_asset_data(asset_data, major, minor):
+    items = bytearray()
+    asset_list = []
+    if asset_data is not None:
+        asset_list = asset_data.asset_list
+    for asset in asset_list:
+        items += IntValue.pack(asset.asset_id)
+        items += IntValue.pack(len(asset.rigid_body_list))
+        for rigid_body in asset.rigid_body_list:
+            items += IntValue.pack(rigid_body.id_num)
+            items += Vector3.pack(*rigid_body.pos)
+            items += Quaternion.pack(*rigid_body.rot)
+            items += FloatValue.pack(rigid_body.mean_error)
+            items += ShortValue.pack(rigid_body.param)
+        items += IntValue.pack(len(asset.marker_list))
+        for marker in asset.marker_list:
+            items += IntValue.pack(marker.marker_id)
+            items += Vector3.pack(*marker.pos)
+            items += FloatValue.pack(marker.marker_size)
+            items += ShortValue.pack(marker.marker_params)
+            items += FloatValue.pack(marker.residual)
+    return pack_section(len(asset_list), items, major, minor)
+
+def pack_labeled_marker_data(labeled_marker_data, major, minor):
+    out_data = bytearray()
+    # Labeled markers (Version 2.3 and later)
+    if( ( major == 2 and minor > 3 ) or major > 2 ):
+        items = bytearray()
+        for labeled_marker in labeled_marker_data.labeled_marker_list:
+            items += IntValue.pack(labeled_marker.id_num)
+            items += Vector3.pack(*labeled_marker.pos)
+            items += FloatValue.pack(pack_first(labeled_marker.size))
+            # Version 2.6 and later
+            if( ( major == 2 and minor >= 6 ) or major > 2):
+                items += ShortValue.pack(labeled_marker.param)
+            # Version 3.0 and later, residual is sent in meters and shown in mm
+            if major >= 3 :
+                items += FloatValue.pack(labeled_marker.residual / 1000.0)
+        out_data += pack_section(len(labeled_marker_data.labeled_marker_list), items, major, minor)
+    return out_data
+
+def pack_channel_list(channel_data_list):
+    out_data = bytearray()
+    out_data += IntValue.pack(len(channel_data_list))
+    for channel_data in channel_data_list:
+        out_data += IntValue.pack(len(channel_data.frame_list))
+        for frame_entry in channel_data.frame_list:
+            out_data += FloatValue.pack(pack_first(frame_entry))
+    return out_data
+
+def pack_force_plate_data(force_plate_data, major, minor):
+    out_data = bytearray()
+    # Force Plate data (version 2.9 and later)
+    if( ( major == 2 and minor >= 9 ) or major > 2 ):
+        items = bytearray()
+        for force_plate in force_plate_data.force_plate_list:
+            items += IntValue.pack(force_plate.id_num)
+            items += pack_channel_list(force_plate.channel_data_list)
+        out_data += pack_section(len(force_plate_data.force_plate_list), items, major, minor)
+    return out_data
+
+def pack_device_data(device_data, major, minor):
+    out_data = bytearray()
+    # Device data (version 2.11 and later)
+    if ( major == 2 and minor >= 11 ) or (major > 2) :
+        items = bytearray()
+        for device in device_data.device_list:
+            items += IntValue.pack(device.id_num)
+            items += pack_channel_list(device.channel_data_list)
+        out_data += pack_section(len(device_data.device_list), items, major, minor)
+    return out_data
+
+def pack_frame_suffix_data(suffix_data, major, minor):
+    out_data = bytearray()
+    out_data += IntValue.pack(suffix_data.timecode)
+    out_data += IntValue.pack(suffix_data.timecode_sub)
+
+    # Timestamp (increased to double precision in 2.7 and later)
+    if ( major == 2 and minor >= 7 ) or (major > 2 ):
+        out_data += DoubleValue.pack(suffix_data.timestamp)
+    else:
+        out_data += FloatValue.pack(suffix_data.timestamp)
+
+    # Hires Timestamp (Version 3.0 and later)
+    if major >= 3 :
+        out_data += Int64Value.pack(suffix_data.stamp_camera_mid_exposure)
+        out_data += Int64Value.pack(suffix_data.stamp_data_received)
+        out_data += Int64Value.pack(suffix_data.stamp_transmit)
+
+    # Precision Timestamp (Version 4.1 and later)
+    if major >= 4:
+        out_data += IntValue.pack(suffix_data.prec_timestamp_secs)
+        out_data += IntValue.pack(suffix_data.prec_timestamp_frac_secs)
+
+    # Frame parameters
+    out_data += ShortValue.pack(suffix_data.param)
+    return out_data
+
+def pack_message(message_id, payload):
+    """Prepend the message id and packet size header"""
+    packet_size = len(payload) & 0xffff
+    out_data = message_id.to_bytes( 2, byteorder='little',  signed=True )
+    out_data += packet_size.to_bytes( 2, byteorder='little',  signed=False )
+    return out_data + bytes(payload)
+
+def pack_marker_set_description(ms_desc, major, minor):
+    out_data = bytearray()
+    out_data += pack_string(ms_desc.marker_set_name)
+    out_data += IntValue.pack(len(ms_desc.marker_names_list))
+    for marker_name in ms_desc.marker_names_list:
+        out_data += pack_string(marker_name)
+    return out_data
+
+def pack_rigid_body_description(rb_desc, major, minor):
+    out_data = bytearray()
+    # Version 2.0 or higher
+    if (major >= 2) or (major == 0):
+        out_data += pack_string(rb_desc.sz_name)
+    out_data += IntValue.pack(rb_desc.id_num)
+    out_data += IntValue.pack(rb_desc.parent_id)
+    out_data += Vector3.pack(*rb_desc.pos)
+
+    # Version 3.0 and higher, rigid body marker information contained in description
+    if (major >= 3) or (major == 0) :
+        out_data += IntValue.pack(len(rb_desc.rb_marker_list))
+        for rb_marker in rb_desc.rb_marker_list:
+            out_data += Vector3.pack(*rb_marker.pos)
+        for rb_marker in rb_desc.rb_marker_list:
+            out_data += IntValue.pack(rb_marker.active_label)
+        if (major >= 4) or (major == 0):
+            for rb_marker in rb_desc.rb_marker_list:
+                out_data += pack_string(rb_marker.marker_name)
+    return out_data
+
+def pack_skeleton_description(skeleton_desc, major, minor):
+    out_data = bytearray()
+    out_data += pack_string(skeleton_desc.name)
+    out_data += IntValue.pack(skeleton_desc.id_num)
+    out_data += IntValue.pack(len(skeleton_desc.rigid_body_description_list))
+    for rb_desc in skeleton_desc.rigid_body_description_list:
+        out_data += pack_rigid_body_description(rb_desc, major, minor)
+    return out_data
+
+# Data description type numbers and packers, other types are not written
+DESCRIPTION_PACKERS = {
+    "marker_set_list" : (0, pack_marker_set_description),
+    "rigid_body_list" : (1, pack_rigid_body_description),
+    "skeleton_list"   : (2, pack_skeleton_description),
+}
+
+def pack_data_descriptions(data_descs, major, minor):
+    """NAT_MODELDEF packet with the marker set, rigid body and skeleton descriptions"""
+    items = bytearray()
+    dataset_count = 0
+    for list_name, pos_num in data_descs.data_order_dict.values():
+        if list_name not in DESCRIPTION_PACKERS:
+            continue
+        data_type, pack_description = DESCRIPTION_PACKERS[list_name]
+        description = pack_description(data_descs.get_object_from_list(list_name, pos_num), major, minor)
+        items += IntValue.pack(data_type)
+        if has_data_size(major, minor):
+            items += IntValue.pack(len(description))
+        items += description
+        dataset_count += 1
+    return pack_message(NAT_MODELDEF, IntValue.pack(dataset_count) + items)
+
+def pack_server_info(application_name, server_version, nat_net_version, high_resolution_clock_frequency=None):
+    """NAT_SERVERINFO packet, the reply to NAT_CONNECT
+
+    high_resolution_clock_frequency is the tick rate of the frame suffix
+    stamps, left out of the packet when None."""
+    payload = bytearray(256)
+    name = pack_string(application_name)[:255]
+    payload[:len(name)] = name
+    payload += bytes(server_version[:4])
+    payload += bytes(nat_net_version[:4])
+    if high_resolution_clock_frequency is not None:
+        payload += Uint64Value.pack(high_resolution_clock_frequency)
+    return pack_message(NAT_SERVERINFO, payload)
+
+def pack_response(response):
+    """NAT_RESPONSE packet, an int result code or a reply string"""
+    if type(response) == int:
+        return pack_message(NAT_RESPONSE, IntValue.pack(response))
+    return pack_message(NAT_RESPONSE, pack_string(response))
+
+def pack_mocap_data(mocap_data, major, minor):
+    """Serialize a MoCapData frame into a complete NAT_FRAMEOFDATA packet"""
+    payload = bytearray()
+    payload += pack_frame_prefix_data(mocap_data.prefix_data)
+    payload += pack_marker_set_data(mocap_data.marker_set_data, major, minor)
+    payload += pack_legacy_other_markers(mocap_data.legacy_other_markers, major, minor)
+    payload += pack_rigid_body_data(mocap_data.rigid_body_data, major, minor)
+    payload += pack_skeleton_data(mocap_data.skeleton_data, major, minor)
+    # Assets ( Motive 3.1/NatNet 4.1 and greater)
+    if has_data_size(major, minor):
+        payload += pack_asset_data(mocap_data.asset_data, major, minor)
+    payload += pack_labeled_marker_data(mocap_data.labeled_marker_data, major, minor)
+    payload += pack_force_plate_data(mocap_data.force_plate_data, major, minor)
+    payload += pack_device_data(mocap_data.device_data, major, minor)
+    payload += pack_frame_suffix_data(mocap_data.suffix_data, major, minor)
+    return pack_message(NAT_FRAMEOFDATA, payload)
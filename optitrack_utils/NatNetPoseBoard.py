@@ -0,0 +1,316 @@
+# OptiTrack NatNet shared memory pose board for Python 3.x
+#
+# NatNetClient can publish the latest pose of every rigid body into a
+# multiprocessing.shared_memory block, so other processes read poses
+# without opening their own NatNet socket and decoding the stream again.
+#
+# Layout, little endian:
+#   header: magic, layout version, slot count, slots in use (24 bytes)
+#   slot:   sequence, rigid body ID, tracking valid, frame number,
+#           timestamp, position xyz, orientation qx qy qz qw (88 bytes)
+# Each slot is guarded by a seqlock.  The single writer makes the sequence
+# odd, writes the pose and makes it even again.  Readers copy the slot and
+# retry if the sequence was odd or changed meanwhile, so they never take a
+# lock or make a system call.  Sequence numbers are 8-byte aligned and
+# written with one store.
+
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+POSE_BOARD_MAGIC = b'NNPOSE\0\0'
+POSE_BOARD_LAYOUT_VERSION = 1
+DEFAULT_MAX_RIGID_BODIES = 64
+
+# Readers give up on a slot that keeps changing after this many attempts
+MAX_READ_RETRIES = 1000
+
+BoardHeader = struct.Struct( '<8sIIII' )
+SlotSequence = struct.Struct( '<Q' )
+SlotPose = struct.Struct( '<iiqd3d4d' )
+SLOT_SIZE = SlotSequence.size + SlotPose.size
+# Byte offset of the slots in use count in the header
+USED_SLOTS_OFFSET = 16
+
+# Names of the blocks created by writers in this process
+local_board_names = set()
+
+
+class PoseBoardWriter:
+    """Creates the shared memory block and writes poses into it.
+
+    Only one thread may write.  The block is removed by close."""
+    def __init__(self, name=None, max_rigid_bodies=DEFAULT_MAX_RIGID_BODIES):
+        size = BoardHeader.size + max_rigid_bodies * SLOT_SIZE
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shared_memory.buf
+        self.max_rigid_bodies = max_rigid_bodies
+        # Rigid body ID to slot number, slot sequence numbers
+        self.slots = {}
+        self.sequences = []
+        self.dropped_rigid_bodies = set()
+        local_board_names.add(self.shared_memory.name)
+        BoardHeader.pack_into(self.buf, 0, POSE_BOARD_MAGIC, POSE_BOARD_LAYOUT_VERSION, max_rigid_bodies, 0, 0)
+
+    def get_name(self):
+        """Name readers attach with"""
+        return self.shared_memory.name
+
+    def update(self, rigid_body_id, frame_number, timestamp, pos, rot, tracking_valid=True):
+        """Publish the pose of one rigid body"""
+        slot = self.slots.get(rigid_body_id)
+        if slot is None:
+            slot = len(self.sequences)
+            if slot >= self.max_rigid_bodies:
+                if rigid_body_id not in self.dropped_rigid_bodies:
+                    print("WARNING: pose board full, rigid body %d is not published"%rigid_body_id)
+                    self.dropped_rigid_bodies.add(rigid_body_id)
+                return
+            self.slots[rigid_body_id] = slot
+            self.sequences.append(0)
+            self.__write_slot(slot, rigid_body_id, frame_number, timestamp, pos, rot, tracking_valid)
+            # Readers only look at slots below the count, publish it after the slot
+            struct.pack_into('<I', self.buf, USED_SLOTS_OFFSET, slot + 1)
+            return
+        self.__write_slot(slot, rigid_body_id, frame_number, timestamp, pos, rot, tracking_valid)
+
+    def publish_frame(self, mocap_data):
+        """Publish every rigid body of a decoded frame, MoCapData or array based"""
+        rigid_body_data = mocap_data.rigid_body_data
+        if rigid_body_data is None:
+            return
+        frame_number = mocap_data.prefix_data.frame_number
+        timestamp = mocap_data.suffix_data.timestamp
+        rigid_body_list = getattr(rigid_body_data, "rigid_body_list", None)
+        if rigid_body_list is not None:
+            for rigid_body in rigid_body_list:
+                self.update(rigid_body.id_num, frame_number, timestamp, rigid_body.pos, rigid_body.rot, rigid_body.tracking_valid)
+        else:
+            # NatNetArrays.RigidBodyArrayData
+            for rigid_body in rigid_body_data.rigid_bodies:
+                self.update(int(rigid_body['id']), frame_number, timestamp, rigid_body['pos'].tolist(),
+                            rigid_body['rot'].tolist(), ( rigid_body['params'] & 0x01 ) != 0)
+
+    def close(self):
+        """Release and remove the shared memory block"""
+        if self.shared_memory is None:
+            return
+        self.buf = None
+        local_board_names.discard(self.shared_memory.name)
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+        self.shared_memory = None
+
+    def __write_slot(self, slot, rigid_body_id, frame_number, timestamp, pos, rot, tracking_valid):
+        offset = BoardHeader.size + slot * SLOT_SIZE
+        sequence = self.sequences[slot] + 1
+        SlotSequence.pack_into(self.buf, offset, sequence)
+        SlotPose.pack_into(self.buf, offset + SlotSequence.size, rigid_body_id, int(tracking_valid),
+                           frame_number, timestamp, pos[0], pos[1], pos[2], rot[0], rot[1], rot[2], rot[3])
+        sequence += 1
+        SlotSequence.pack_into(self.buf, offset, sequence)
+        self.sequences[slot] = sequence
+
+
+class PoseBoardReader:
+    """Attaches to a pose board by name and reads poses without locking"""
+    def __init__(self, name):
+        self.shared_memory = shared_memory.SharedMemory(name=name)
+        # Python 3.11 registers attached blocks too and would remove the
+        # block when this process exits, the writer owns it
+        if self.shared_memory.name not in local_board_names:
+            resource_tracker.unregister(self.shared_memory._name, "shared_memory")
+        self.buf = self.shared_memory.buf
+        magic, layout_version, self.max_rigid_bodies, used_slots, _ = BoardHeader.unpack_from(self.buf, 0)
+        if magic != POSE_BOARD_MAGIC or layout_version != POSE_BOARD_LAYOUT_VERSION:
+            self.close()
+            raise ValueError("%s: not a NatNet pose board"%name)
+        # Rigid body ID to slot number, for the slots seen so far
+        self.slots = {}
+        self.known_slots = 0
+
+    def get_pose(self, rigid_body_id):
+        """Latest ( frame_number, timestamp, pos, rot, tracking_valid ) of a rigid body, None if never published"""
+        slot = self.slots.get(rigid_body_id)
+        if slot is None:
+            self.__update_slots()
+            slot = self.slots.get(rigid_body_id)
+            if slot is None:
+                return None
+        pose = self.__read_slot(slot)
+        if pose is None:
+            return None
+        return pose[1:]
+
+    def get_poses(self):
+        """Dictionary of rigid body ID to ( frame_number, timestamp, pos, rot, tracking_valid )"""
+        self.__update_slots()
+        poses = {}
+        for rigid_body_id, slot in self.slots.items():
+            pose = self.__read_slot(slot)
+            if pose is not None:
+                poses[rigid_body_id] = pose[1:]
+        return poses
+
+    def get_rigid_body_ids(self):
+        self.__update_slots()
+        return list(self.slots)
+
+    def close(self):
+        if self.shared_memory is None:
+            return
+        self.buf = None
+        self.shared_memory.close()
+        self.shared_memory = None
+
+    def __update_slots(self):
+        # A slot ID is written once, before the slot is counted as in use
+        used_slots, = struct.unpack_from('<I', self.buf, USED_SLOTS_OFFSET)
+        for slot in range(self.known_slots, used_slots):
+            rigid_body_id, = struct.unpack_from('<i', self.buf, BoardHeader.size + slot * SLOT_SIZE + SlotSequence.size)
+            self.slots[rigid_body_id] = slot
+        self.known_slots = used_slots
+
+    def __read_slot(self, slot):
+        offset = BoardHeader.size + slot * SLOT_SIZE
+        buf = self.buf
+        for _ in range(MAX_READ_RETRIES):
+            sequence, = SlotSequence.unpack_from(buf, offset)
+            if sequence & 1:
+                continue
+            fields = SlotPose.unpack_from(buf, offset + SlotSequence.size)
+            if SlotSequence.unpack_from(buf, offset)[0] == sequence:
+                rigid_body_id, tracking_valid, frame_number, timestamp = fields[:4]
+                return rigid_body_id, frame_number, timestamp, fields[4:7], fields[7:11], tracking_valid != 0
+        return None
+
+
+# test program
+
+def read_poses_process(name, rigid_body_ids, result_queue):
+    reader = PoseBoardReader(name)
+    result_queue.put([reader.get_pose(rigid_body_id) for rigid_body_id in rigid_body_ids])
+    reader.close()
+
+def test_other_process():
+    """A second process reads the poses published here"""
+    import multiprocessing
+    writer = PoseBoardWriter(max_rigid_bodies=4)
+    diffs = []
+    try:
+        writer.update(7, 100, 1.5, (1.0, 2.0, 3.0), (0.0, 0.0, 0.0, 1.0), True)
+        writer.update(3, 100, 1.5, (4.0, 5.0, 6.0), (0.0, 1.0, 0.0, 0.0), False)
+        writer.update(7, 101, 1.6, (1.5, 2.5, 3.5), (0.0, 0.0, 0.0, 1.0), True)
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=read_poses_process, args=(writer.get_name(), [7, 3, 9], result_queue))
+        process.start()
+        poses = result_queue.get(timeout=10)
+        process.join()
+        expected = [(101, 1.6, (1.5, 2.5, 3.5), (0.0, 0.0, 0.0, 1.0), True),
+                    (100, 1.5, (4.0, 5.0, 6.0), (0.0, 1.0, 0.0, 0.0), False),
+                    None]
+        if poses != expected:
+            diffs.append("poses %s"%str(poses))
+    finally:
+        writer.close()
+    return diffs
+
+def test_torn_reads():
+    """Readers only ever see whole poses while the writer keeps updating"""
+    import time
+    from threading import Thread
+    writer = PoseBoardWriter(max_rigid_bodies=2)
+    reader = PoseBoardReader(writer.get_name())
+    stop = []
+    def write_poses():
+        k = 0
+        while not stop:
+            k += 1
+            writer.update(1, k, float(k), (k, k, k), (k, k, k, k))
+            if k % 16 == 0:
+                time.sleep(0)
+    thread = Thread(target=write_poses)
+    thread.start()
+    diffs = []
+    reads = 0
+    try:
+        end_time = time.monotonic() + 1.0
+        while time.monotonic() < end_time and len(diffs) < 5:
+            pose = reader.get_pose(1)
+            if pose is None:
+                continue
+            reads += 1
+            frame_number, timestamp, pos, rot, tracking_valid = pose
+            if any(value != frame_number for value in (timestamp,) + pos + rot):
+                diffs.append("torn pose %s"%str(pose))
+    finally:
+        stop.append(True)
+        thread.join()
+        reader.close()
+        writer.close()
+    if reads == 0:
+        diffs.append("no pose read")
+    return diffs
+
+def test_write_in_progress():
+    """A slot with an odd sequence is not returned"""
+    writer = PoseBoardWriter(max_rigid_bodies=1)
+    reader = PoseBoardReader(writer.get_name())
+    diffs = []
+    try:
+        writer.update(4, 1, 0.1, (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0))
+        offset = BoardHeader.size
+        SlotSequence.pack_into(writer.buf, offset, writer.sequences[0] + 1)
+        if reader.get_pose(4) is not None:
+            diffs.append("pose returned during a write")
+        SlotSequence.pack_into(writer.buf, offset, writer.sequences[0])
+        if reader.get_pose(4) is None:
+            diffs.append("no pose after the write")
+    finally:
+        reader.close()
+        writer.close()
+    return diffs
+
+def test_client_publish(major, minor):
+    """NatNetClient publishes each decoded frame with both decoders"""
+    from . import NatNetClient
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    # The client writer lives in the package module, not in __main__
+    from . import NatNetPoseBoard
+    diffs = []
+    for use_fast_decoder in [False, True]:
+        client = NatNetClient.NatNetClient()
+        client.set_use_fast_decoder(use_fast_decoder)
+        name = client.start_pose_board()
+        try:
+            reader = NatNetPoseBoard.PoseBoardReader(name)
+            client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+            frame = NatNetDecoder.generate_test_frame(5)
+            client.process_message(NatNetPacker.pack_mocap_data(frame, major, minor))
+            for rigid_body in frame.rigid_body_data.rigid_body_list:
+                pose = reader.get_pose(rigid_body.id_num)
+                if pose is None or pose[0] != 5 or \
+                   any(abs(a - b) > 1e-3 for a, b in zip(pose[2], rigid_body.pos)):
+                    diffs.append("fast decoder %s rigid body %d: %s"%(use_fast_decoder, rigid_body.id_num, str(pose)))
+            reader.close()
+        finally:
+            client.stop_pose_board()
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Pose Board Other Process", test_other_process, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose Board Torn Reads", test_torn_reads, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose Board Write In Progress", test_write_in_progress, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose Board Client Publish 3.1", lambda: test_client_publish(3, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
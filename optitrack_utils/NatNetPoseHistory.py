@@ -0,0 +1,353 @@
+# OptiTrack NatNet time indexed pose history for Python 3.x
+#
+# Keeps the recent poses of each rigid body in fixed size NumPy rings so a
+# camera frame or a localization query can look up the ground truth pose
+# at its own capture time.  Lookups are binary searches over the ring,
+# positions are interpolated linearly and orientations with SLERP.
+# Orientations are NatNet quaternions ( qx, qy, qz, qw ).
+
+import time
+from threading import Lock
+import numpy as np
+
+DEFAULT_CAPACITY = 4096
+
+# Time a PoseHistory indexes poses by
+# CLOCK_HOST is time.monotonic() when the frame was decoded
+CLOCK_HOST = "host"
+# CLOCK_NATNET is the frame suffix timestamp, seconds since Motive started
+CLOCK_NATNET = "natnet"
+
+
+def slerp(rot_a, rot_b, fraction):
+    """Spherical linear interpolation between two unit quaternions"""
+    dot = np.dot(rot_a, rot_b)
+    # q and -q are the same rotation, take the short way round
+    if dot < 0.0:
+        rot_b = -rot_b
+        dot = -dot
+    if dot > 0.9995:
+        # Nearly parallel, normalized linear interpolation is accurate enough
+        rot = rot_a + fraction * (rot_b - rot_a)
+        return rot / np.linalg.norm(rot)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    return (np.sin((1.0 - fraction) * theta) * rot_a + np.sin(fraction * theta) * rot_b) / sin_theta
+
+
+class PoseRing:
+    """Fixed capacity ring of ( time, frame number, position, orientation ) of one rigid body.
+
+    Samples must be added in increasing time, the oldest is overwritten
+    once the ring is full.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = max(capacity, 2)
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.frame_numbers = np.zeros(self.capacity, dtype=np.int64)
+        self.pos = np.zeros((self.capacity, 3), dtype=np.float64)
+        self.rot = np.zeros((self.capacity, 4), dtype=np.float64)
+        # Physical index of the oldest sample and number of samples
+        self.start = 0
+        self.count = 0
+
+    def get_count(self):
+        return self.count
+
+    def add(self, sample_time, frame_number, pos, rot):
+        if self.count > 0 and sample_time < self.times[self.__index(self.count - 1)]:
+            # Out of order sample, the ring must stay sorted
+            return False
+        if self.count < self.capacity:
+            index = self.__index(self.count)
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[index] = sample_time
+        self.frame_numbers[index] = frame_number
+        self.pos[index] = pos
+        self.rot[index] = rot
+        return True
+
+    def add_many(self, sample_times, frame_numbers, pos, rot):
+        """Add samples in increasing time in one go, returns the number added.
+
+        Samples older than the newest one stored are left out."""
+        sample_times = np.asarray(sample_times, dtype=np.float64)
+        frame_numbers = np.asarray(frame_numbers)
+        pos = np.asarray(pos)
+        rot = np.asarray(rot)
+        if self.count > 0:
+            keep = sample_times >= self.times[self.__index(self.count - 1)]
+            sample_times, frame_numbers, pos, rot = sample_times[keep], frame_numbers[keep], pos[keep], rot[keep]
+        # Only the newest capacity samples can be kept
+        sample_times, frame_numbers = sample_times[-self.capacity:], frame_numbers[-self.capacity:]
+        pos, rot = pos[-self.capacity:], rot[-self.capacity:]
+        num_samples = len(sample_times)
+        indexes = (self.start + self.count + np.arange(num_samples)) % self.capacity
+        self.times[indexes] = sample_times
+        self.frame_numbers[indexes] = frame_numbers
+        self.pos[indexes] = pos
+        self.rot[indexes] = rot
+        overwritten = max(self.count + num_samples - self.capacity, 0)
+        self.start = (self.start + overwritten) % self.capacity
+        self.count = min(self.count + num_samples, self.capacity)
+        return num_samples
+
+    def get_time_range(self):
+        """( oldest, newest ) sample time, None if empty"""
+        if self.count == 0:
+            return None
+        return self.times[self.start], self.times[self.__index(self.count - 1)]
+
+    def pose_at(self, sample_time, max_gap=None):
+        """Interpolated ( pos, rot ) at sample_time.
+
+        None if sample_time is outside the stored range or, with max_gap,
+        if the samples around it are more than max_gap apart."""
+        return self.__interpolate(self.times, sample_time, max_gap)
+
+    def pose_at_frame(self, frame_number):
+        """( pos, rot ) recorded for frame_number, interpolated if that frame is missing"""
+        return self.__interpolate(self.frame_numbers, frame_number, None)
+
+    def __index(self, logical_index):
+        return (self.start + logical_index) % self.capacity
+
+    def __search(self, keys, key):
+        """Logical index of the first sample with a key above key"""
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if keys[self.__index(middle)] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __interpolate(self, keys, key, max_gap):
+        if self.count == 0:
+            return None
+        after = self.__search(keys, key)
+        if after == 0:
+            return None
+        index_before = self.__index(after - 1)
+        if keys[index_before] == key:
+            return self.pos[index_before].copy(), self.rot[index_before].copy()
+        if after == self.count:
+            return None
+        index_after = self.__index(after)
+        gap = keys[index_after] - keys[index_before]
+        if max_gap is not None and gap > max_gap:
+            return None
+        fraction = (key - keys[index_before]) / gap
+        pos = self.pos[index_before] + fraction * (self.pos[index_after] - self.pos[index_before])
+        rot = slerp(self.rot[index_before], self.rot[index_after], fraction)
+        return pos, rot
+
+
+class PoseHistory:
+    """PoseRing per rigid body, filled from decoded frames.
+
+    Attach it with NatNetClient.set_pose_history.  Rigid bodies that are
+    not tracked in a frame are not added, so queries interpolate across
+    short tracking losses unless a max_gap is given.  Safe to query from
+    other threads while the decode thread adds frames.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, clock=CLOCK_HOST):
+        if clock not in (CLOCK_HOST, CLOCK_NATNET):
+            raise ValueError("Unknown clock %s, valid clocks are %s, %s"%(clock, CLOCK_HOST, CLOCK_NATNET))
+        self.capacity = capacity
+        self.clock = clock
+        self.rings = {}
+        self.lock = Lock()
+
+    def add(self, rigid_body_id, sample_time, frame_number, pos, rot):
+        with self.lock:
+            ring = self.rings.get(rigid_body_id)
+            if ring is None:
+                ring = PoseRing(self.capacity)
+                self.rings[rigid_body_id] = ring
+            return ring.add(sample_time, frame_number, pos, rot)
+
+    def add_frame(self, mocap_data, host_time=None):
+        """Add the tracked rigid bodies of a decoded frame, MoCapData or array based"""
+        rigid_body_data = mocap_data.rigid_body_data
+        if rigid_body_data is None:
+            return
+        frame_number = mocap_data.prefix_data.frame_number
+        if self.clock == CLOCK_NATNET:
+            sample_time = mocap_data.suffix_data.timestamp
+        elif host_time is not None:
+            sample_time = host_time
+        else:
+            sample_time = time.monotonic()
+        rigid_body_list = getattr(rigid_body_data, "rigid_body_list", None)
+        if rigid_body_list is not None:
+            for rigid_body in rigid_body_list:
+                if rigid_body.tracking_valid:
+                    self.add(rigid_body.id_num, sample_time, frame_number, rigid_body.pos, rigid_body.rot)
+        else:
+            # NatNetArrays.RigidBodyArrayData
+            for rigid_body in rigid_body_data.rigid_bodies:
+                if rigid_body['params'] & 0x01:
+                    self.add(int(rigid_body['id']), sample_time, frame_number, rigid_body['pos'], rigid_body['rot'])
+
+    def add_take_rows(self, rows):
+        """Add the tracked poses of a NatNetTake TAKE_DTYPE array, NatNet clock only"""
+        if self.clock != CLOCK_NATNET:
+            raise ValueError("Take rows are on the %s clock, not %s"%(CLOCK_NATNET, self.clock))
+        rows = rows[(rows['params'] & 0x01) != 0]
+        for rigid_body_id in np.unique(rows['id']):
+            rigid_body_rows = rows[rows['id'] == rigid_body_id]
+            with self.lock:
+                ring = self.rings.get(int(rigid_body_id))
+                if ring is None:
+                    ring = PoseRing(self.capacity)
+                    self.rings[int(rigid_body_id)] = ring
+                ring.add_many(rigid_body_rows['timestamp'], rigid_body_rows['frame_number'],
+                              rigid_body_rows['pos'], rigid_body_rows['rot'])
+
+    def get_rigid_body_ids(self):
+        with self.lock:
+            return list(self.rings)
+
+    def pose_at(self, rigid_body_id, sample_time, max_gap=None):
+        """Interpolated ( pos, rot ) of a rigid body at sample_time on the history clock, None if unknown"""
+        with self.lock:
+            ring = self.rings.get(rigid_body_id)
+            if ring is None:
+                return None
+            return ring.pose_at(sample_time, max_gap)
+
+    def pose_at_frame(self, rigid_body_id, frame_number):
+        with self.lock:
+            ring = self.rings.get(rigid_body_id)
+            if ring is None:
+                return None
+            return ring.pose_at_frame(frame_number)
+
+
+# test program
+
+def quaternion_about_z(angle):
+    return np.array([0.0, 0.0, np.sin(angle / 2.0), np.cos(angle / 2.0)])
+
+def test_interpolation():
+    ring = PoseRing(8)
+    ring.add(1.0, 10, (0.0, 0.0, 0.0), quaternion_about_z(0.0))
+    ring.add(2.0, 20, (2.0, 4.0, 6.0), quaternion_about_z(np.pi / 2.0))
+    diffs = []
+    pos, rot = ring.pose_at(1.25)
+    if not np.allclose(pos, (0.5, 1.0, 1.5)):
+        diffs.append("pos %s"%str(pos))
+    if not np.allclose(rot, quaternion_about_z(np.pi / 8.0)):
+        diffs.append("rot %s"%str(rot))
+    pos, rot = ring.pose_at_frame(20)
+    if not np.allclose(pos, (2.0, 4.0, 6.0)):
+        diffs.append("frame 20 pos %s"%str(pos))
+    pos, rot = ring.pose_at_frame(15)
+    if not np.allclose(pos, (1.0, 2.0, 3.0)):
+        diffs.append("frame 15 pos %s"%str(pos))
+    for sample_time in [0.5, 2.5]:
+        if ring.pose_at(sample_time) is not None:
+            diffs.append("pose outside the range at %.1f"%sample_time)
+    if ring.pose_at(1.5, max_gap=0.5) is not None:
+        diffs.append("pose across a gap")
+    return diffs
+
+def test_slerp_short_way():
+    """q and -q describe the same rotation, SLERP takes the shorter arc"""
+    rot = slerp(quaternion_about_z(0.1), -quaternion_about_z(0.3), 0.5)
+    if not np.allclose(np.abs(np.dot(rot, quaternion_about_z(0.2))), 1.0):
+        return ["rot %s"%str(rot)]
+    return []
+
+def test_wrap_around():
+    """Lookups stay correct once the oldest samples are overwritten"""
+    ring = PoseRing(16)
+    for i in range(100):
+        ring.add(i * 0.01, i, (i, 0.0, 0.0), quaternion_about_z(0.0))
+    diffs = []
+    if ring.get_count() != 16:
+        diffs.append("count %d"%ring.get_count())
+    oldest, newest = ring.get_time_range()
+    if not (np.isclose(oldest, 0.84) and np.isclose(newest, 0.99)):
+        diffs.append("range %f %f"%(oldest, newest))
+    if ring.pose_at(0.5) is not None:
+        diffs.append("overwritten sample returned")
+    for i in range(84, 99):
+        pos, rot = ring.pose_at(i * 0.01 + 0.005)
+        if not np.isclose(pos[0], i + 0.5):
+            diffs.append("pose at %d.5: %s"%(i, str(pos)))
+    if ring.add(0.5, 50, (0.0, 0.0, 0.0), quaternion_about_z(0.0)):
+        diffs.append("out of order sample added")
+    return diffs
+
+def test_add_many():
+    """Bulk adds match one by one adds, wrap around included"""
+    ring = PoseRing(16)
+    ring_ref = PoseRing(16)
+    diffs = []
+    for first in [0, 10, 30]:
+        count = 10 if first < 30 else 40
+        sample_times = np.arange(first, first + count) * 0.01
+        pos = np.stack([np.arange(first, first + count)] * 3, axis=1).astype(np.float64)
+        rot = np.tile(quaternion_about_z(0.0), (count, 1))
+        ring.add_many(sample_times, np.arange(first, first + count), pos, rot)
+        for i in range(count):
+            ring_ref.add(sample_times[i], first + i, pos[i], rot[i])
+    if ring.get_count() != ring_ref.get_count() or ring.get_time_range() != ring_ref.get_time_range():
+        diffs.append("range %s != %s"%(str(ring.get_time_range()), str(ring_ref.get_time_range())))
+    for frame_number in range(54, 70):
+        pose = ring.pose_at_frame(frame_number)
+        if pose is None or not np.isclose(pose[0][0], frame_number):
+            diffs.append("frame %d: %s"%(frame_number, str(pose)))
+    if ring.add_many([0.0], [0], [(0.0, 0.0, 0.0)], [quaternion_about_z(0.0)]) != 0:
+        diffs.append("out of order sample added")
+    return diffs
+
+def test_client_history(major, minor):
+    """NatNetClient adds each decoded frame on the NatNet clock"""
+    from . import NatNetClient
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    client = NatNetClient.NatNetClient()
+    client.set_use_fast_decoder(True)
+    history = PoseHistory(clock=CLOCK_NATNET)
+    client.set_pose_history(history)
+    client.process_message(NatNetPacker.pack_server_info("Test Server", [0,0,0,0], [major,minor,0,0]))
+    frames = [NatNetDecoder.generate_test_frame(frame_num) for frame_num in range(3)]
+    for frame_num, frame in enumerate(frames):
+        frame.suffix_data.timestamp = 10.0 + frame_num
+        for rigid_body in frame.rigid_body_data.rigid_body_list:
+            rigid_body.tracking_valid = True
+        client.process_message(NatNetPacker.pack_mocap_data(frame, major, minor))
+    diffs = []
+    for rigid_body_a, rigid_body_b in zip(frames[1].rigid_body_data.rigid_body_list, frames[2].rigid_body_data.rigid_body_list):
+        pose = history.pose_at(rigid_body_a.id_num, 11.5)
+        expected = (np.array(rigid_body_a.pos) + np.array(rigid_body_b.pos)) / 2.0
+        if pose is None or not np.allclose(pose[0], expected, atol=1e-3):
+            diffs.append("rigid body %d: %s"%(rigid_body_a.id_num, str(pose)))
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Pose History Interpolation", test_interpolation, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose History SLERP", test_slerp_short_way, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose History Wrap Around", test_wrap_around, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose History Add Many", test_add_many, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose History Client 4.1", lambda: test_client_history(4, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
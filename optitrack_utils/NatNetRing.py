@@ -0,0 +1,208 @@
+# OptiTrack NatNet receive ring for Python 3.x
+#
+# Fixed pool of preallocated packet buffers shared by the NatNetClient
+# receive thread, which fills them with recv_into, and the decode thread,
+# which consumes them in arrival order.  The receive thread always owns a
+# spare slot to receive into and swaps it for a free one once a packet is
+# in hand.  When the decode thread falls behind the oldest waiting packet
+# is dropped and counted at that point, so the socket is always drained
+# and the kernel buffer does not overflow.
+
+from collections import deque
+from threading import Condition
+
+# 64k buffer size, the largest UDP payload
+DEFAULT_SLOT_SIZE = 64*1024
+DEFAULT_NUM_SLOTS = 64
+
+# Slots besides the queue: the receive thread spare, the packet being
+# decoded and a packet being copied in by a second producer
+HELD_SLOTS = 3
+
+
+class PacketRing:
+    """Bounded ring of preallocated packet buffers.
+
+    Up to num_slots packets wait for the consumer.  The receiving producer
+    calls acquire once, fills get_view(slot) and calls exchange, which
+    queues the packet and returns the slot to receive into next.  A
+    producer copying packets received elsewhere calls acquire and publish
+    for each one.  The consumer calls get, reads get_packet(slot) and calls
+    release once it no longer needs the data.  A slot handed out by get is
+    never reused before it is released.
+    """
+    def __init__(self, num_slots=DEFAULT_NUM_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        self.capacity = max(num_slots, 1)
+        num_buffers = self.capacity + HELD_SLOTS
+        self.buffers = [bytearray(slot_size) for _ in range(num_buffers)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.sizes = [0]*num_buffers
+        self.receive_times = [0.0]*num_buffers
+        self.free_slots = deque(range(num_buffers))
+        self.ready_slots = deque()
+        self.condition = Condition()
+        self.dropped = 0
+
+    def get_num_slots(self):
+        """Packets that can wait for the consumer"""
+        return self.capacity
+
+    def get_view(self, slot):
+        """Writable view of the whole slot buffer"""
+        return self.views[slot]
+
+    def get_packet(self, slot):
+        """View of the packet stored in slot"""
+        return self.views[slot][:self.sizes[slot]]
+
+    def acquire(self):
+        """Free slot to fill, None if every slot is taken"""
+        with self.condition:
+            if self.free_slots:
+                return self.free_slots.popleft()
+            return None
+
+    def get_receive_time(self, slot):
+        """Receive time given to publish for the packet in slot"""
+        return self.receive_times[slot]
+
+    def publish(self, slot, size, receive_time=0.0):
+        """Queue size bytes received into slot for the consumer.
+
+        If num_slots packets are already waiting the oldest is dropped."""
+        with self.condition:
+            self.__queue(slot, size, receive_time)
+
+    def exchange(self, slot, size, receive_time=0.0):
+        """publish, then return a free slot to receive the next packet into"""
+        with self.condition:
+            self.__queue(slot, size, receive_time)
+            # At most capacity slots wait and HELD_SLOTS - 1 are held elsewhere
+            return self.free_slots.popleft()
+
+    def get(self, timeout=None):
+        """Oldest waiting slot, None if nothing arrived within timeout"""
+        with self.condition:
+            if not self.ready_slots:
+                self.condition.wait(timeout)
+                if not self.ready_slots:
+                    return None
+            return self.ready_slots.popleft()
+
+    def release(self, slot):
+        """Return a slot from acquire, exchange or get to the free pool"""
+        with self.condition:
+            self.free_slots.append(slot)
+
+    def drop(self):
+        """Count a packet that could not be queued"""
+        with self.condition:
+            self.dropped += 1
+
+    def get_pending(self):
+        """Number of packets waiting for the consumer"""
+        with self.condition:
+            return len(self.ready_slots)
+
+    def __queue(self, slot, size, receive_time):
+        if len(self.ready_slots) >= self.capacity:
+            self.free_slots.append(self.ready_slots.popleft())
+            self.dropped += 1
+        self.sizes[slot] = size
+        self.receive_times[slot] = receive_time
+        self.ready_slots.append(slot)
+        self.condition.notify()
+
+
+# test program
+
+def test_ring_order():
+    ring = PacketRing(4, 16)
+    diffs = []
+    slot = ring.acquire()
+    for i in range(3):
+        ring.get_view(slot)[0] = i
+        slot = ring.exchange(slot, 1)
+    ring.release(slot)
+    for i in range(3):
+        slot = ring.get(0)
+        if ring.get_packet(slot).tobytes() != bytes([i]):
+            diffs.append("packet %d: %s"%(i, ring.get_packet(slot).tobytes()))
+        ring.release(slot)
+    if ring.get(0) is not None:
+        diffs.append("ring not empty")
+    if ring.dropped != 0:
+        diffs.append("dropped %d != 0"%ring.dropped)
+    return diffs
+
+def test_ring_drop_oldest():
+    ring = PacketRing(4, 16)
+    diffs = []
+    # Consumer holds one slot while the producer keeps receiving
+    slot = ring.acquire()
+    slot = ring.exchange(slot, 1)
+    held_slot = ring.get(0)
+    for i in range(4):
+        ring.get_view(slot)[0] = i
+        slot = ring.exchange(slot, 1)
+        if slot == held_slot:
+            diffs.append("held slot reused")
+    # A full ring waiting for the next packet has dropped nothing yet
+    if ring.dropped != 0 or ring.get_pending() != 4:
+        diffs.append("full ring: dropped %d, %d pending"%(ring.dropped, ring.get_pending()))
+    for i in range(4, 6):
+        ring.get_view(slot)[0] = i
+        slot = ring.exchange(slot, 1)
+        if slot == held_slot:
+            diffs.append("held slot reused")
+    # A second producer copying a packet in
+    copy_slot = ring.acquire()
+    ring.get_view(copy_slot)[0] = 6
+    ring.publish(copy_slot, 1)
+    ring.release(held_slot)
+    ring.release(slot)
+    if ring.dropped != 3:
+        diffs.append("dropped %d != 3"%ring.dropped)
+    received = []
+    slot = ring.get(0)
+    while slot is not None:
+        received.append(ring.get_packet(slot)[0])
+        ring.release(slot)
+        slot = ring.get(0)
+    if received != [3, 4, 5, 6]:
+        diffs.append("received %s != [3, 4, 5, 6]"%str(received))
+    return diffs
+
+def test_ring_small():
+    """A one packet ring with every other slot held still queues and drops"""
+    ring = PacketRing(1, 16)
+    diffs = []
+    slot = ring.acquire()
+    slot = ring.exchange(slot, 1)
+    held_slot = ring.get(0)
+    copy_slot = ring.acquire()
+    ring.publish(copy_slot, 1)
+    copy_slot = ring.acquire()
+    ring.publish(copy_slot, 1)
+    slot = ring.exchange(slot, 1)
+    if ring.get_num_slots() != 1 or ring.get_pending() != 1 or ring.dropped != 2 or slot is None:
+        diffs.append("%d pending, dropped %d"%(ring.get_pending(), ring.dropped))
+    ring.release(held_slot)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Ring Order", test_ring_order, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Ring Drop Oldest", test_ring_drop_oldest, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Ring Small", test_ring_small, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,431 @@
+# OptiTrack NatNet server simulator for Python 3.x
+#
+# Local UDP server that answers the NatNet connect, model definition and
+# command handshake and streams synthetic frames built with the MoCapData
+# and DataDescriptions generate_* factories, packed by NatNetPacker, at a
+# fixed rate.  Used to load test NatNetClient and the recorder on one box:
+#   python -m optitrack_utils.NatNetSimulator -f 1000 -b 20 -m 100
+# or to step through rates and report where the client starts dropping:
+#   python -m optitrack_utils.NatNetSimulator --load-test 240 480 1000 2000
+# The self tests run with --test.
+
+import argparse
+import socket
+import struct
+import time
+from threading import Thread, Lock
+from . import DataDescriptions
+from . import MoCapData
+from . import NatNetDecoder
+from . import NatNetPacker
+
+# Client/server message ids
+NAT_CONNECT               = 0
+NAT_REQUEST               = 2
+NAT_REQUEST_MODELDEF      = 4
+NAT_REQUEST_FRAMEOFDATA   = 6
+NAT_DISCONNECT            = 9
+NAT_KEEPALIVE             = 10
+
+# Distinct frames generated up front, streamed in a loop with new frame numbers
+DEFAULT_CYCLE_FRAMES = 240
+
+# The suffix stamps are time.perf_counter_ns() readings
+HIGH_RESOLUTION_CLOCK_FREQUENCY = 1000000000
+
+Int64Triple = struct.Struct( '<qqq' )
+
+
+def generate_scene_frame(frame_num=0, num_rigid_bodies=20, num_labeled_markers=100):
+    """Frame sized like a busy stage: many rigid bodies and labeled markers"""
+    mocap_data = NatNetDecoder.generate_test_frame(frame_num)
+    rigid_body_data = MoCapData.RigidBodyData()
+    for body_num in range(num_rigid_bodies):
+        rigid_body = MoCapData.generate_rigid_body(body_num, frame_num)
+        rigid_body.tracking_valid = True
+        rigid_body_data.add_rigid_body(rigid_body)
+    mocap_data.set_rigid_body_data(rigid_body_data)
+    labeled_marker_data = MoCapData.LabeledMarkerData()
+    for marker_num in range(num_labeled_markers):
+        labeled_marker_data.add_labeled_marker(MoCapData.generate_labeled_marker(frame_num, marker_num))
+    mocap_data.set_labeled_marker_data(labeled_marker_data)
+    return mocap_data
+
+def generate_scene_descriptions(num_rigid_bodies=20):
+    """Data descriptions naming the rigid bodies of generate_scene_frame RigidBody_000, ..."""
+    data_descs = DataDescriptions.DataDescriptions()
+    data_descs.add_marker_set(DataDescriptions.generate_marker_set_description(0))
+    for body_num in range(num_rigid_bodies):
+        rb_desc = DataDescriptions.generate_rigid_body_description(body_num)
+        rb_desc.set_name("RigidBody_%3.3d"%body_num)
+        rb_desc.set_id(body_num)
+        rb_desc.set_parent_id(-1)
+        data_descs.add_rigid_body(rb_desc)
+    return data_descs
+
+
+class NatNetSimulator:
+    """NatNet server streaming generate_scene_frame frames at frame_rate Hz.
+
+    In multicast mode frames go to the multicast group data port, otherwise
+    to every client that sent NAT_CONNECT, as Motive does in unicast.
+    Commands are acknowledged with a 0 result, "Bitstream,<major>.<minor>"
+    switches the stream version.
+    """
+    def __init__(self, num_rigid_bodies=20, num_labeled_markers=100, frame_rate=240.0,
+                 nat_net_version=(4,1,0,0), use_multicast=False):
+        self.local_ip_address = "127.0.0.1"
+        self.multicast_address = "239.255.42.99"
+        self.command_port = 1510
+        self.data_port = 1511
+        self.use_multicast = use_multicast
+
+        self.application_name = "NatNetSimulator"
+        self.server_version = [3,1,0,0]
+        self.nat_net_version = list(nat_net_version)
+        self.num_rigid_bodies = num_rigid_bodies
+        self.num_labeled_markers = num_labeled_markers
+        self.frame_rate = frame_rate
+        self.cycle_frames = DEFAULT_CYCLE_FRAMES
+
+        self.clients = []
+        self.lock = Lock()
+        self.frame_packets = []
+        self.timestamp_offset = 0
+        self.timestamp_value = NatNetPacker.DoubleValue
+        self.stamp_offset = None
+
+        self.frames_sent = 0
+        self.frames_late = 0
+
+        self.command_socket = None
+        self.data_socket = None
+        self.command_thread = None
+        self.stream_thread = None
+        self.stop_threads = False
+
+    def build_frames(self):
+        """Pack the frame cycle for the current stream version"""
+        major, minor = self.nat_net_version[0], self.nat_net_version[1]
+        frame_packets = []
+        for frame_num in range(self.cycle_frames):
+            mocap_data = generate_scene_frame(frame_num, self.num_rigid_bodies, self.num_labeled_markers)
+            frame_packets.append(NatNetPacker.pack_mocap_data(mocap_data, major, minor))
+        suffix_size = len(NatNetPacker.pack_frame_suffix_data(mocap_data.suffix_data, major, minor))
+        # Timestamp follows timecode and timecode_sub, the 3.0 hires stamps follow the timestamp
+        stamp_offset = None
+        if major >= 3:
+            stamp_offset = -suffix_size + 16
+        # Timestamp is a float before 2.7
+        timestamp_value = NatNetPacker.FloatValue
+        if ( major == 2 and minor >= 7 ) or (major > 2 ):
+            timestamp_value = NatNetPacker.DoubleValue
+        with self.lock:
+            self.frame_packets = frame_packets
+            self.timestamp_offset = -suffix_size + 8
+            self.timestamp_value = timestamp_value
+            self.stamp_offset = stamp_offset
+
+    def get_data_descriptions(self):
+        return generate_scene_descriptions(self.num_rigid_bodies)
+
+    def run(self):
+        self.build_frames()
+        self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.command_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.command_socket.bind((self.local_ip_address, self.command_port))
+        except socket.error as msg:
+            print("ERROR: command socket error occurred:\n%s" %msg)
+            return False
+        # Wake up regularly to check for shutdown
+        self.command_socket.settimeout(0.2)
+        self.command_port = self.command_socket.getsockname()[1]
+
+        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if self.use_multicast:
+            self.data_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.local_ip_address))
+            self.data_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        self.stop_threads = False
+        self.command_thread = Thread(target=self.__command_thread_function)
+        self.command_thread.start()
+        self.stream_thread = Thread(target=self.__stream_thread_function)
+        self.stream_thread.start()
+        return True
+
+    def shutdown(self):
+        self.stop_threads = True
+        if self.command_thread is not None:
+            self.command_thread.join()
+        if self.stream_thread is not None:
+            self.stream_thread.join()
+        self.command_socket.close()
+        self.data_socket.close()
+
+    def __command_thread_function(self):
+        while not self.stop_threads:
+            try:
+                data, addr = self.command_socket.recvfrom(64*1024)
+            except socket.timeout:
+                continue
+            except socket.error as msg:
+                if not self.stop_threads:
+                    print("ERROR: command socket access error occurred:\n  %s" %msg)
+                return 1
+            if len(data) < 4:
+                continue
+            reply = self.__handle_request(data, addr)
+            if reply is not None:
+                self.command_socket.sendto(reply, addr)
+            # Stream to a new client only once it has the server info and stream version
+            if int.from_bytes( data[0:2], byteorder='little',  signed=True ) == NAT_CONNECT:
+                with self.lock:
+                    if addr not in self.clients:
+                        self.clients.append(addr)
+        return 0
+
+    def __handle_request(self, data, addr):
+        message_id = int.from_bytes( data[0:2], byteorder='little',  signed=True )
+        if message_id == NAT_CONNECT:
+            return NatNetPacker.pack_server_info(self.application_name, self.server_version, self.nat_net_version,
+                                                 HIGH_RESOLUTION_CLOCK_FREQUENCY)
+        elif message_id == NAT_REQUEST_MODELDEF:
+            return NatNetPacker.pack_data_descriptions(self.get_data_descriptions(),
+                                                       self.nat_net_version[0], self.nat_net_version[1])
+        elif message_id == NAT_REQUEST_FRAMEOFDATA:
+            with self.lock:
+                return bytes(self.frame_packets[self.frames_sent % len(self.frame_packets)])
+        elif message_id == NAT_REQUEST:
+            command_str = bytes(data[4:]).partition(b'\0')[0].decode('utf-8')
+            if command_str.startswith("Bitstream,"):
+                version = command_str.split(',')[1].split('.')
+                self.nat_net_version = [int(version[0]), int(version[1]), 0, 0]
+                self.build_frames()
+            return NatNetPacker.pack_response(0)
+        elif message_id == NAT_DISCONNECT:
+            with self.lock:
+                if addr in self.clients:
+                    self.clients.remove(addr)
+            return None
+        elif message_id == NAT_KEEPALIVE:
+            return None
+        return NatNetPacker.pack_message(NatNetPacker.NAT_UNRECOGNIZED_REQUEST, b'')
+
+    def __stream_thread_function(self):
+        period = 1.0 / self.frame_rate
+        start = time.perf_counter()
+        start_ns = time.perf_counter_ns()
+        frame_num = 0
+        while not self.stop_threads:
+            frame_time = start + frame_num * period
+            delay = frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                self.frames_late += 1
+
+            with self.lock:
+                packet = bytearray(self.frame_packets[frame_num % len(self.frame_packets)])
+                timestamp_offset = self.timestamp_offset
+                timestamp_value = self.timestamp_value
+                stamp_offset = self.stamp_offset
+                clients = list(self.clients)
+            packet[4:8] = NatNetPacker.IntValue.pack(frame_num)
+            timestamp_value.pack_into(packet, len(packet) + timestamp_offset, frame_num * period)
+            if stamp_offset is not None:
+                # Scheduled frame time stands in for exposure and arrival, transmit is now
+                frame_time_ns = start_ns + int(frame_num * period * 1e9)
+                Int64Triple.pack_into(packet, len(packet) + stamp_offset,
+                                      frame_time_ns, frame_time_ns, time.perf_counter_ns())
+
+            if self.use_multicast:
+                self.data_socket.sendto(packet, (self.multicast_address, self.data_port))
+                self.frames_sent += 1
+            elif clients:
+                for addr in clients:
+                    self.data_socket.sendto(packet, addr)
+                self.frames_sent += 1
+            frame_num += 1
+        return 0
+
+
+# Load test
+
+def run_simulator_process(frame_rate, num_rigid_bodies, num_labeled_markers, command_port, use_multicast, ready, stop,
+                          frames_sent):
+    simulator = NatNetSimulator(num_rigid_bodies, num_labeled_markers, frame_rate, use_multicast=use_multicast)
+    simulator.command_port = command_port
+    if not simulator.run():
+        ready.set()
+        return
+    ready.set()
+    stop.wait()
+    simulator.shutdown()
+    frames_sent.value = simulator.frames_sent
+
+def load_test(frame_rates, num_rigid_bodies, num_labeled_markers, duration, use_multicast, use_fast_decoder, command_port=1510):
+    """Stream at each rate from a separate process and report the client counters"""
+    import multiprocessing
+    from . import NatNetClient
+    print("%8s %10s %10s %10s %10s %10s"%("rate", "sent", "received", "decoded", "dropped", "missing"))
+    for frame_rate in frame_rates:
+        ready = multiprocessing.Event()
+        stop = multiprocessing.Event()
+        frames_sent = multiprocessing.Value('q', 0)
+        process = multiprocessing.Process(target=run_simulator_process,
+            args=(frame_rate, num_rigid_bodies, num_labeled_markers, command_port, use_multicast, ready, stop,
+                  frames_sent))
+        process.start()
+        ready.wait()
+
+        client = NatNetClient.NatNetClient()
+        client.set_print_level(0)
+        client.set_use_multicast(use_multicast)
+        client.command_port = command_port
+        if not use_multicast:
+            # Unicast without joining a multicast group
+            client.multicast_address = "255.255.255.255"
+        client.set_use_fast_decoder(use_fast_decoder)
+        is_running = client.run()
+        if is_running:
+            time.sleep(duration)
+        # Stop streaming first so every frame sent has had its chance to arrive
+        stop.set()
+        process.join()
+        if is_running:
+            time.sleep(0.1)
+            client.shutdown()
+        counters = client.get_receive_counters()
+        print("%8.1f %10d %10d %10d %10d %10d"%(frame_rate, frames_sent.value, counters["received"],
+              counters["decoded"], counters["dropped"], counters["missing"]))
+
+
+# test program
+
+def test_data_descriptions(major, minor):
+    """Pack the scene descriptions and unpack them with NatNetClient"""
+    from . import NatNetClient
+    data_descs = generate_scene_descriptions(5)
+    packet = NatNetPacker.pack_data_descriptions(data_descs, major, minor)
+    packet_size = int.from_bytes( packet[2:4], byteorder='little',  signed=True )
+    client = NatNetClient.NatNetClient()
+    offset, client_descs = client._NatNetClient__unpack_data_descriptions(packet[4:], packet_size, major, minor)
+    diffs = []
+    if offset != packet_size:
+        diffs.append("offset %d != %d"%(offset, packet_size))
+    # Rigid body marker offsets are sent from 3.0 on and their names from 4.0 on
+    if major >= 4 and data_descs.get_as_string() != client_descs.get_as_string():
+        diffs.append("data descriptions differ")
+    for rb_desc, client_rb_desc in zip(data_descs.rigid_body_list, client_descs.rigid_body_list):
+        if DataDescriptions.get_as_string(rb_desc.sz_name) != DataDescriptions.get_as_string(client_rb_desc.sz_name) or \
+           rb_desc.id_num != client_rb_desc.id_num:
+            diffs.append("rigid body %d differs"%rb_desc.id_num)
+    if client_descs.get_rigid_body_id("RigidBody_003") != 3:
+        diffs.append("RigidBody_003 not found")
+    return diffs
+
+def test_timestamp_value(major, minor):
+    """Streamed timestamps overwrite the packed suffix timestamp in place"""
+    simulator = NatNetSimulator(2, 4, 120.0, (major, minor, 0, 0))
+    simulator.build_frames()
+    packet = bytearray(simulator.frame_packets[0])
+    simulator.timestamp_value.pack_into(packet, len(packet) + simulator.timestamp_offset, 1.5)
+    mocap_data = generate_scene_frame(0, 2, 4)
+    mocap_data.suffix_data.timestamp = 1.5
+    expected = NatNetPacker.pack_mocap_data(mocap_data, major, minor)
+    if packet != expected:
+        return ["timestamp packed as %d bytes"%simulator.timestamp_value.size]
+    return []
+
+def test_simulator_stream(frame_rate, duration):
+    """NatNetClient connects to a simulator and resolves a rigid body name"""
+    from . import NatNetClient
+    simulator = NatNetSimulator(5, 10, frame_rate)
+    simulator.command_port = 0
+    if not simulator.run():
+        return ["simulator did not start"]
+    client = NatNetClient.NatNetClient()
+    client.set_print_level(0)
+    client.set_use_multicast(False)
+    client.multicast_address = "255.255.255.255"
+    client.command_port = simulator.command_port
+    poses = []
+    client.subscribe_rigid_body_name("RigidBody_003", lambda new_id, pos, rot: poses.append(new_id))
+    diffs = []
+    try:
+        if not client.run():
+            return ["client did not start"]
+        time.sleep(duration)
+        client.shutdown()
+    finally:
+        simulator.shutdown()
+    counters = client.get_receive_counters()
+    expected_frames = frame_rate * duration
+    if counters["received"] < expected_frames / 2:
+        diffs.append("received %d of about %d frames"%(counters["received"], expected_frames))
+    if not poses or set(poses) != {3}:
+        diffs.append("subscribed poses %s"%str(poses[:10]))
+    if (client.get_major(), client.get_minor()) != (4, 1):
+        diffs.append("version %d.%d"%(client.get_major(), client.get_minor()))
+    stats = client.stats()
+    if stats["decode_ms"]["count"] != counters["decoded"] or stats["bytes_per_second"] <= 0:
+        diffs.append("stats %s"%str({ name : stats[name] for name in ["packets_decoded", "bytes_per_second"] }))
+    return diffs
+
+def test_all(run_test=True):
+    totals=[0,0,0]
+    for major, minor in [[2,9],[3,1],[4,0],[4,1]]:
+        test_name = "Test Data Descriptions %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_data_descriptions(major, minor), run_test, totals)
+    for major, minor in [[2,5],[2,9],[3,1],[4,1]]:
+        test_name = "Test Timestamp Value %d.%d"%(major, minor)
+        totals = NatNetDecoder.run_test_case(test_name, lambda: test_timestamp_value(major, minor), run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Simulator Stream", lambda: test_simulator_stream(240, 1.0), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description='''\
+                                    Streams synthetic NatNet frames for load testing NatNetClient.''')
+    parser.add_argument('-f', type=float, metavar='RATE', default=240.0, help='Frames per second. Default 240')
+    parser.add_argument('-b', type=int, metavar='RIGID BODIES', default=20, help='Rigid bodies per frame. Default 20')
+    parser.add_argument('-m', type=int, metavar='MARKERS', default=100, help='Labeled markers per frame. Default 100')
+    parser.add_argument('-v', type=str, metavar='VERSION', default="4.1", help='NatNet stream version. Default 4.1')
+    parser.add_argument('-p', type=int, metavar='PORT', default=1510, help='Command port. Default 1510')
+    parser.add_argument('--multicast', action='store_true', help='Stream to the multicast group instead of connected clients')
+    parser.add_argument('--load-test', type=float, nargs='+', metavar='RATE', default=None,
+                        help='Run a client against each rate in turn and report its packet counters')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per load test rate. Default 5')
+    parser.add_argument('--slow-decoder', action='store_true', help='Load test the original NatNetClient decoder')
+    parser.add_argument('--test', action='store_true', help='Run the self tests')
+    args = parser.parse_args()
+
+    if args.test:
+        test_all(True)
+        return
+
+    if args.load_test is not None:
+        load_test(args.load_test, args.b, args.m, args.duration, args.multicast, not args.slow_decoder, args.p)
+        return
+
+    version = [int(part) for part in args.v.split('.')]
+    simulator = NatNetSimulator(args.b, args.m, args.f, (version[0], version[1], 0, 0), args.multicast)
+    simulator.command_port = args.p
+    if not simulator.run():
+        return
+    print("Streaming NatNet %d.%d at %3.1f Hz on port %d, Ctrl-C to stop"%(version[0], version[1], args.f, simulator.command_port))
+    try:
+        while True:
+            time.sleep(1.0)
+            print("frames sent %d, late %d, clients %d"%(simulator.frames_sent, simulator.frames_late, len(simulator.clients)))
+    except KeyboardInterrupt:
+        simulator.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,486 @@
+# OptiTrack NatNet compact take files for Python 3.x
+#
+# A take file stores rigid body poses frame by frame in a fraction of the
+# space of text or raw packets.  Values are quantized to fixed steps, then
+# each rigid body is stored as deltas from its previous frame, which at
+# 240 Hz are mostly a few steps.  The deltas are zigzag encoded, split into
+# byte planes and zlib compressed in blocks of frames.
+#   header: magic, format version, NatNet stream version (4 bytes),
+#           time, position and rotation quantum, frames per block
+#   block:  block header, compressed deltas
+#   index:  one entry per block, then a trailer pointing at the index
+# Every block starts from absolute values, so any block decodes on its own
+# and the index gives random access by frame number.  A take that was not
+# closed has no index, the reader then scans the block headers instead.
+
+import bisect
+import os
+import struct
+import zlib
+from threading import Lock
+import numpy as np
+
+TAKE_MAGIC = b'NNTAKE'
+TAKE_FORMAT_VERSION = 1
+BLOCK_MAGIC = b'NNTB'
+INDEX_MAGIC = b'NNTI'
+
+# Default quantization steps
+# seconds
+TIME_QUANTUM = 1e-6
+# meters, 0.01 mm
+POSITION_QUANTUM = 1e-5
+# unit quaternion components
+ROTATION_QUANTUM = 1e-6
+
+DEFAULT_BLOCK_FRAMES = 1024
+COMPRESSION_LEVEL = 6
+
+TakeHeader = struct.Struct( '<6sBBBBBdddI' )
+# magic, rows, frames, first frame, last frame, first timestamp, last timestamp, compressed size
+BlockHeader = struct.Struct( '<4sIIiiddI' )
+# file offset, rows, frames, first frame, last frame, first timestamp, last timestamp
+IndexEntry = struct.Struct( '<qIIiidd' )
+# index offset, block count, magic
+IndexTrailer = struct.Struct( '<qI4s' )
+
+# One row per rigid body per frame, sorted by frame number then rigid body ID
+TAKE_DTYPE = np.dtype([
+    ('frame_number', '<i4'),
+    ('timestamp', '<f8'),
+    ('id', '<i4'),
+    ('params', '<i2'),
+    ('pos', '<f8', (3,)),
+    ('rot', '<f8', (4,)),
+])
+
+# Quantized columns: frame number, timestamp, params, pos x, y, z, rot x, y, z, w
+NUM_COLUMNS = 10
+
+
+def quantize(rows, quanta):
+    """( rows, NUM_COLUMNS ) int64 values of a TAKE_DTYPE array"""
+    time_quantum, position_quantum, rotation_quantum = quanta
+    values = np.empty((len(rows), NUM_COLUMNS), dtype=np.int64)
+    values[:, 0] = rows['frame_number']
+    values[:, 1] = np.round(rows['timestamp'] / time_quantum)
+    values[:, 2] = rows['params']
+    values[:, 3:6] = np.round(rows['pos'] / position_quantum)
+    values[:, 6:10] = np.round(rows['rot'] / rotation_quantum)
+    return values
+
+def dequantize(values, rigid_body_ids, quanta):
+    time_quantum, position_quantum, rotation_quantum = quanta
+    rows = np.empty(len(values), dtype=TAKE_DTYPE)
+    rows['frame_number'] = values[:, 0]
+    rows['timestamp'] = values[:, 1] * time_quantum
+    rows['id'] = rigid_body_ids
+    rows['params'] = values[:, 2]
+    rows['pos'] = values[:, 3:6] * position_quantum
+    rows['rot'] = values[:, 6:10] * rotation_quantum
+    return rows
+
+def encode_block(rows, quanta, level=COMPRESSION_LEVEL):
+    """Compressed bytes of a TAKE_DTYPE array.
+
+    Rows are grouped by rigid body, the first row of each group is stored
+    as is and the others as the difference to the row before."""
+    rows = rows[np.lexsort((rows['frame_number'], rows['id']))]
+    rigid_body_ids, counts = np.unique(rows['id'], return_counts=True)
+    values = quantize(rows, quanta)
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+    starts = np.cumsum(counts) - counts
+    deltas[starts] = values[starts]
+    # Zigzag, small negative deltas become small positive numbers
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).view(np.uint64)
+    # Byte planes per column, the high bytes are nearly all zero
+    planes = zigzag.T.copy().view(np.uint8).reshape(NUM_COLUMNS, len(rows), 8).transpose(0, 2, 1)
+    payload = struct.pack('<I', len(rigid_body_ids)) + rigid_body_ids.astype('<i4').tobytes() + \
+              counts.astype('<i4').tobytes() + planes.tobytes()
+    return zlib.compress(payload, level)
+
+def decode_block(data, num_rows, quanta):
+    """TAKE_DTYPE array of a block written by encode_block"""
+    payload = zlib.decompress(data)
+    num_groups, = struct.unpack_from('<I', payload, 0)
+    offset = 4
+    rigid_body_ids = np.frombuffer(payload, dtype='<i4', count=num_groups, offset=offset)
+    offset += 4 * num_groups
+    counts = np.frombuffer(payload, dtype='<i4', count=num_groups, offset=offset).astype(np.int64)
+    offset += 4 * num_groups
+    planes = np.frombuffer(payload, dtype=np.uint8, count=NUM_COLUMNS*8*num_rows, offset=offset)
+    zigzag = planes.reshape(NUM_COLUMNS, 8, num_rows).transpose(0, 2, 1).copy().view('<u8')
+    zigzag = zigzag.reshape(NUM_COLUMNS, num_rows).T
+    deltas = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    # Running sum per rigid body, each group starts from its absolute value
+    sums = np.cumsum(deltas, axis=0)
+    bases = np.zeros((num_groups, NUM_COLUMNS), dtype=np.int64)
+    ends = np.cumsum(counts)
+    bases[1:] = sums[ends[:-1] - 1]
+    values = sums - np.repeat(bases, counts, axis=0)
+    rows = dequantize(values, np.repeat(rigid_body_ids, counts), quanta)
+    return rows[np.lexsort((rows['id'], rows['frame_number']))]
+
+
+class TakeWriter:
+    """Streams rigid body poses to a take file, safe to share between threads.
+
+    Rows of one frame are added one after the other; a block is written
+    once it holds block_frames frames, so memory use stays constant for
+    takes of any length.  close writes the last block and the index."""
+    def __init__(self, file_name, nat_net_version=(0,0,0,0), block_frames=DEFAULT_BLOCK_FRAMES,
+                 time_quantum=TIME_QUANTUM, position_quantum=POSITION_QUANTUM, rotation_quantum=ROTATION_QUANTUM):
+        self.file = open(file_name, 'wb')
+        self.lock = Lock()
+        self.block_frames = max(block_frames, 1)
+        self.quanta = (time_quantum, position_quantum, rotation_quantum)
+        self.rows = []
+        self.frame_count = 0
+        self.last_frame_number = None
+        self.index = []
+        self.file.write(TakeHeader.pack(TAKE_MAGIC, TAKE_FORMAT_VERSION, *nat_net_version[:4],
+                                        time_quantum, position_quantum, rotation_quantum, self.block_frames))
+
+    def add(self, frame_number, timestamp, rigid_body_id, pos, rot, params=0x01):
+        """Add the pose of one rigid body, params bit 0x01 is tracking valid"""
+        with self.lock:
+            if self.file is None:
+                return
+            if frame_number != self.last_frame_number:
+                if self.frame_count >= self.block_frames:
+                    self.__write_block()
+                self.frame_count += 1
+                self.last_frame_number = frame_number
+            self.rows.append((frame_number, timestamp, rigid_body_id, params, pos, rot))
+
+    def add_frame(self, mocap_data):
+        """Add every rigid body of a decoded frame, MoCapData or array based"""
+        rigid_body_data = mocap_data.rigid_body_data
+        if rigid_body_data is None:
+            return
+        frame_number = mocap_data.prefix_data.frame_number
+        timestamp = mocap_data.suffix_data.timestamp
+        rigid_body_list = getattr(rigid_body_data, "rigid_body_list", None)
+        if rigid_body_list is not None:
+            for rigid_body in rigid_body_list:
+                self.add(frame_number, timestamp, rigid_body.id_num, rigid_body.pos, rigid_body.rot,
+                         int(rigid_body.tracking_valid))
+        else:
+            # NatNetArrays.RigidBodyArrayData
+            for rigid_body in rigid_body_data.rigid_bodies:
+                self.add(frame_number, timestamp, int(rigid_body['id']), rigid_body['pos'], rigid_body['rot'],
+                         int(rigid_body['params']))
+
+    def flush(self, sync=False):
+        """Write the frames added so far as a block, with sync also make sure it is on disk"""
+        with self.lock:
+            if self.file is not None:
+                self.__write_block()
+                self.file.flush()
+                if sync:
+                    os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.__write_block()
+            index_offset = self.file.tell()
+            for entry in self.index:
+                self.file.write(IndexEntry.pack(*entry))
+            self.file.write(IndexTrailer.pack(index_offset, len(self.index), INDEX_MAGIC))
+            self.file.close()
+            self.file = None
+
+    def __write_block(self):
+        if not self.rows:
+            return
+        rows = np.array(self.rows, dtype=TAKE_DTYPE)
+        data = encode_block(rows, self.quanta)
+        frame_numbers = rows['frame_number']
+        timestamps = rows['timestamp']
+        block_info = (len(rows), self.frame_count, int(frame_numbers.min()), int(frame_numbers.max()),
+                      float(timestamps.min()), float(timestamps.max()))
+        self.index.append((self.file.tell(),) + block_info)
+        self.file.write(BlockHeader.pack(BLOCK_MAGIC, *block_info, len(data)))
+        self.file.write(data)
+        self.rows = []
+        self.frame_count = 0
+
+
+class TakeReader:
+    """Random access to a take file written by TakeWriter"""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as take_file:
+            header = take_file.read(TakeHeader.size)
+            if len(header) < TakeHeader.size:
+                raise ValueError("%s: not a NatNet take file"%file_name)
+            magic, format_version, *fields = TakeHeader.unpack(header)
+            if magic != TAKE_MAGIC:
+                raise ValueError("%s: not a NatNet take file"%file_name)
+            if format_version != TAKE_FORMAT_VERSION:
+                raise ValueError("%s: unsupported take format version %d"%(file_name, format_version))
+            self.nat_net_version = fields[0:4]
+            self.quanta = tuple(fields[4:7])
+            self.block_frames = fields[7]
+            self.index = self.__read_index(take_file)
+            if self.index is None:
+                self.index = self.__scan_blocks(take_file)
+        # Blocks are in frame order, searched by their last frame number
+        self.last_frames = [entry[4] for entry in self.index]
+
+    def get_major(self):
+        return self.nat_net_version[0]
+
+    def get_minor(self):
+        return self.nat_net_version[1]
+
+    def get_block_count(self):
+        return len(self.index)
+
+    def get_block_info(self, block_num):
+        """rows, frames, first / last frame number and first / last timestamp of a block"""
+        offset, rows, frames, first_frame, last_frame, first_timestamp, last_timestamp = self.index[block_num]
+        return { "rows"            : rows,
+                 "frames"          : frames,
+                 "first_frame"     : first_frame,
+                 "last_frame"      : last_frame,
+                 "first_timestamp" : first_timestamp,
+                 "last_timestamp"  : last_timestamp }
+
+    def get_frame_count(self):
+        return sum(entry[2] for entry in self.index)
+
+    def read_block(self, block_num):
+        """TAKE_DTYPE array of one block"""
+        with open(self.file_name, 'rb') as take_file:
+            return self.__read_block(take_file, block_num)
+
+    def blocks(self):
+        """Iterate over the blocks as TAKE_DTYPE arrays, one decoded at a time"""
+        with open(self.file_name, 'rb') as take_file:
+            for block_num in range(len(self.index)):
+                yield self.__read_block(take_file, block_num)
+
+    def find_block(self, frame_number):
+        """Number of the block holding frame_number, None if it is past the end"""
+        block_num = bisect.bisect_left(self.last_frames, frame_number)
+        if block_num >= len(self.index):
+            return None
+        return block_num
+
+    def read_frames(self, first_frame, last_frame=None):
+        """TAKE_DTYPE array of the frames from first_frame to last_frame, only the blocks needed are read"""
+        if last_frame is None:
+            last_frame = first_frame
+        block_num = self.find_block(first_frame)
+        if block_num is None:
+            return np.zeros(0, dtype=TAKE_DTYPE)
+        parts = []
+        with open(self.file_name, 'rb') as take_file:
+            while block_num < len(self.index) and self.index[block_num][3] <= last_frame:
+                rows = self.__read_block(take_file, block_num)
+                frame_numbers = rows['frame_number']
+                parts.append(rows[(frame_numbers >= first_frame) & (frame_numbers <= last_frame)])
+                block_num += 1
+        if not parts:
+            return np.zeros(0, dtype=TAKE_DTYPE)
+        return np.concatenate(parts)
+
+    def read_all(self):
+        parts = list(self.blocks())
+        if not parts:
+            return np.zeros(0, dtype=TAKE_DTYPE)
+        return np.concatenate(parts)
+
+    def __read_block(self, take_file, block_num):
+        offset, rows = self.index[block_num][0:2]
+        take_file.seek(offset)
+        header = BlockHeader.unpack(take_file.read(BlockHeader.size))
+        data = take_file.read(header[-1])
+        return decode_block(data, rows, self.quanta)
+
+    def __read_index(self, take_file):
+        """Index entries from the end of the file, None if the take was not closed"""
+        take_file.seek(0, 2)
+        file_size = take_file.tell()
+        if file_size < TakeHeader.size + IndexTrailer.size:
+            return None
+        take_file.seek(file_size - IndexTrailer.size)
+        index_offset, block_count, magic = IndexTrailer.unpack(take_file.read(IndexTrailer.size))
+        if magic != INDEX_MAGIC or index_offset + block_count * IndexEntry.size + IndexTrailer.size != file_size:
+            return None
+        take_file.seek(index_offset)
+        data = take_file.read(block_count * IndexEntry.size)
+        return [IndexEntry.unpack_from(data, i * IndexEntry.size) for i in range(block_count)]
+
+    def __scan_blocks(self, take_file):
+        """Rebuild the index from the block headers, stops at a truncated block"""
+        index = []
+        offset = TakeHeader.size
+        take_file.seek(0, 2)
+        file_size = take_file.tell()
+        while offset + BlockHeader.size <= file_size:
+            take_file.seek(offset)
+            magic, *block_info, data_size = BlockHeader.unpack(take_file.read(BlockHeader.size))
+            if magic != BLOCK_MAGIC or offset + BlockHeader.size + data_size > file_size:
+                break
+            index.append((offset,) + tuple(block_info))
+            offset += BlockHeader.size + data_size
+        return index
+
+
+def convert_capture(capture_file_name, take_file_name, block_frames=DEFAULT_BLOCK_FRAMES):
+    """Write the rigid bodies of a NatNetCapture file to a take file, returns the number of frames"""
+    from . import NatNetCapture
+    from . import NatNetDecoder
+    reader = NatNetCapture.PacketCaptureReader(capture_file_name)
+    decoder = NatNetDecoder.FrameDecoder()
+    decoder.set_sections(['rigid_bodies'])
+    writer = TakeWriter(take_file_name, reader.nat_net_version, block_frames)
+    frame_count = 0
+    try:
+        for data in reader.frame_packets():
+            packet_size = int.from_bytes( data[2:4], byteorder='little',  signed=True )
+            offset, mocap_data = decoder.unpack_mocap_data(data, 4, packet_size, reader.get_major(), reader.get_minor())
+            writer.add_frame(mocap_data)
+            frame_count += 1
+    finally:
+        writer.close()
+    return frame_count
+
+
+# test program
+
+def generate_take_rows(num_frames, num_rigid_bodies, frame_rate=240.0):
+    """Smooth random walk of a few rigid bodies, TAKE_DTYPE"""
+    random = np.random.default_rng(1)
+    rows = np.zeros(num_frames * num_rigid_bodies, dtype=TAKE_DTYPE)
+    frame_numbers = np.arange(num_frames)
+    rows['frame_number'] = np.repeat(frame_numbers, num_rigid_bodies)
+    rows['timestamp'] = np.repeat(100.0 + frame_numbers / frame_rate, num_rigid_bodies)
+    rows['id'] = np.tile(np.arange(1, num_rigid_bodies + 1), num_frames)
+    rows['params'] = 0x01
+    steps = random.normal(0.0, 2e-4, (num_frames, num_rigid_bodies, 3))
+    rows['pos'] = np.cumsum(steps, axis=0).reshape(-1, 3)
+    angles = np.cumsum(random.normal(0.0, 1e-3, (num_frames, num_rigid_bodies)), axis=0).reshape(-1)
+    rows['rot'][:, 2] = np.sin(angles / 2.0)
+    rows['rot'][:, 3] = np.cos(angles / 2.0)
+    return rows
+
+def write_take(file_name, rows, block_frames):
+    writer = TakeWriter(file_name, (4,1,0,0), block_frames)
+    for row in rows:
+        writer.add(int(row['frame_number']), float(row['timestamp']), int(row['id']), row['pos'], row['rot'], int(row['params']))
+    return writer
+
+def compare_rows(ref_rows, rows, quanta=(TIME_QUANTUM, POSITION_QUANTUM, ROTATION_QUANTUM)):
+    diffs = []
+    if len(ref_rows) != len(rows):
+        return ["%d rows != %d"%(len(rows), len(ref_rows))]
+    for name in ['frame_number', 'id', 'params']:
+        if not np.array_equal(ref_rows[name], rows[name]):
+            diffs.append("%s differs"%name)
+    for name, quantum in zip(['timestamp', 'pos', 'rot'], quanta):
+        error = np.max(np.abs(ref_rows[name] - rows[name]))
+        if error > quantum / 2.0 + 1e-12:
+            diffs.append("%s error %g > %g"%(name, error, quantum / 2.0))
+    return diffs
+
+def test_round_trip():
+    """Values come back within half a quantum step, blocks are random access"""
+    import os
+    import tempfile
+    rows = generate_take_rows(2000, 3)
+    handle, file_name = tempfile.mkstemp(suffix='.nntake')
+    os.close(handle)
+    diffs = []
+    try:
+        write_take(file_name, rows, 256).close()
+        reader = TakeReader(file_name)
+        diffs += compare_rows(rows, reader.read_all())
+        if reader.get_block_count() != 8 or reader.get_frame_count() != 2000:
+            diffs.append("%d blocks, %d frames"%(reader.get_block_count(), reader.get_frame_count()))
+        part = reader.read_frames(500, 520)
+        diffs += compare_rows(rows[(rows['frame_number'] >= 500) & (rows['frame_number'] <= 520)], part)
+        if reader.find_block(700) != 2 or reader.find_block(5000) is not None:
+            diffs.append("find block %s %s"%(reader.find_block(700), reader.find_block(5000)))
+        # Text as bm_record writes it, for scale
+        text_size = sum(len(' '.join(map(str, [row['frame_number']] + list(row['pos']) + list(row['rot'])))) + 1
+                        for row in rows)
+        if os.path.getsize(file_name) * 4 > text_size:
+            diffs.append("take %d bytes, text %d bytes"%(os.path.getsize(file_name), text_size))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_unclosed_take():
+    """A take that was never closed is read back up to its last full block"""
+    import os
+    import tempfile
+    rows = generate_take_rows(300, 2)
+    handle, file_name = tempfile.mkstemp(suffix='.nntake')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = write_take(file_name, rows, 100)
+        writer.file.flush()
+        reader = TakeReader(file_name)
+        # The last block is still buffered in the writer
+        diffs += compare_rows(rows[rows['frame_number'] < 200], reader.read_all())
+        writer.close()
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_convert_capture(major, minor):
+    """A NatNet capture converts to a take with the same rigid body poses"""
+    import os
+    import tempfile
+    from . import NatNetCapture
+    from . import NatNetDecoder
+    from . import NatNetPacker
+    frames = [NatNetDecoder.generate_test_frame(frame_num) for frame_num in range(5)]
+    handles = [tempfile.mkstemp(suffix=suffix) for suffix in ['.nncap', '.nntake']]
+    capture_file_name, take_file_name = [file_name for handle, file_name in handles]
+    for handle, file_name in handles:
+        os.close(handle)
+    diffs = []
+    try:
+        writer = NatNetCapture.PacketCaptureWriter(capture_file_name, [major, minor, 0, 0])
+        for frame in frames:
+            writer.write_packet(NatNetCapture.CHANNEL_DATA, NatNetPacker.pack_mocap_data(frame, major, minor))
+        writer.close()
+        if convert_capture(capture_file_name, take_file_name) != 5:
+            diffs.append("frame count")
+        rows = TakeReader(take_file_name).read_all()
+        ref_rows = [(frame.prefix_data.frame_number, frame.suffix_data.timestamp, rigid_body.id_num,
+                     int(rigid_body.tracking_valid), rigid_body.pos, rigid_body.rot)
+                    for frame in frames for rigid_body in frame.rigid_body_data.rigid_body_list]
+        ref_rows = np.array(ref_rows, dtype=TAKE_DTYPE)
+        ref_rows = ref_rows[np.lexsort((ref_rows['id'], ref_rows['frame_number']))]
+        # Packed as float32, allow for that as well
+        diffs += compare_rows(ref_rows, rows, (TIME_QUANTUM, 1e-4, 1e-4))
+    finally:
+        for handle, file_name in handles:
+            os.remove(file_name)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Take Round Trip", test_round_trip, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Take Unclosed", test_unclosed_take, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Take Convert Capture 4.1", lambda: test_convert_capture(4, 1), run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,305 @@
+# Capture time association of photos to mocap poses for Python 3.x
+#
+# bm_record triggers a photo every few NatNet frames, but the image a camera
+# delivers was exposed some time after the trigger and the delay varies
+# from photo to photo.  Rather than taking the pose of the trigger frame,
+# each photo is matched to the pose at its own capture time:
+#   1. photo_times.txt gives the host capture time of every photo and the
+#      host arrival time and NatNet timestamp of the frame nearest to it.
+#      Frames arrive some latency after their timestamp, never before, so
+#      the smallest host time - NatNet timestamp is the clock offset.
+#   2. The capture time less the offset and the camera latency is the
+#      photo time on the NatNet clock.
+#   3. The take poses are loaded into a PoseHistory on the NatNet clock,
+#      the pose at the photo time is a binary search and an interpolation.
+# The association error is how far the trigger frame pose, what photos
+# were matched to before, is from the associated pose.
+
+import os
+from pathlib import Path
+import numpy as np
+from . import NatNetPoseHistory
+from . import NatNetTake
+
+PHOTO_TIMES_FILE = "photo_times.txt"
+PHOTO_POSES_FILE = "photo_poses.txt"
+TAKE_FILE = "optitrack.nntake"
+
+PHOTO_POSES_COLUMNS = "frame_number natnet_time x y z qx qy qz qw time_offset_ms position_error_mm rotation_error_deg"
+PHOTO_POSES_ROW = "%d %.6f %.9g %.9g %.9g %.9g %.9g %.9g %.9g %.3f %.3f %.3f\n"
+
+# Photos whose capture time falls between poses further apart than this,
+# in seconds, are left unassociated rather than interpolated across a
+# tracking loss
+DEFAULT_MAX_GAP = 0.05
+
+
+class PhotoTime:
+    """One photo_times.txt row"""
+    def __init__(self, frame_number, camera_name, capture_time,
+                 nearest_frame_number=-1, nearest_frame_host_time=0.0, nearest_frame_timestamp=0.0):
+        # NatNet frame that triggered the photo
+        self.frame_number = frame_number
+        self.camera_name = camera_name
+        # time.monotonic() when the image was grabbed
+        self.capture_time = capture_time
+        # NatNet frame that arrived closest to capture_time, -1 if none
+        self.nearest_frame_number = nearest_frame_number
+        self.nearest_frame_host_time = nearest_frame_host_time
+        self.nearest_frame_timestamp = nearest_frame_timestamp
+
+
+class PhotoPose:
+    """Pose associated to one photo"""
+    def __init__(self, frame_number, natnet_time, pos, rot, time_offset, position_error, rotation_error):
+        self.frame_number = frame_number
+        # Photo capture time on the NatNet clock
+        self.natnet_time = natnet_time
+        self.pos = pos
+        self.rot = rot
+        # natnet_time - trigger frame timestamp, seconds
+        self.time_offset = time_offset
+        # Distance and angle from the trigger frame pose, meters and degrees,
+        # None if the trigger frame was not tracked
+        self.position_error = position_error
+        self.rotation_error = rotation_error
+
+
+def read_photo_times(file_name, camera_name=None):
+    """PhotoTime list from photo_times.txt, only those of camera_name if given"""
+    photo_times = []
+    with open(file_name) as photo_times_file:
+        for line in photo_times_file:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            if camera_name is not None and fields[1] != camera_name:
+                continue
+            photo_time = PhotoTime(int(fields[0]), fields[1], float(fields[2]))
+            if len(fields) >= 6:
+                # Older takes only have the nearest frame number
+                photo_time.nearest_frame_number = int(fields[3])
+                photo_time.nearest_frame_host_time = float(fields[4])
+                photo_time.nearest_frame_timestamp = float(fields[5])
+            photo_times.append(photo_time)
+    return photo_times
+
+def estimate_clock_offset(photo_times):
+    """host time - NatNet timestamp, None if no photo has a nearest frame"""
+    offsets = [photo_time.nearest_frame_host_time - photo_time.nearest_frame_timestamp
+               for photo_time in photo_times if photo_time.nearest_frame_number >= 0]
+    if not offsets:
+        return None
+    return min(offsets)
+
+def rotation_angle(rot_a, rot_b):
+    """Angle in degrees between two unit quaternions"""
+    dot = min(abs(float(np.dot(rot_a, rot_b))), 1.0)
+    return np.degrees(2.0 * np.arccos(dot))
+
+def associate_photos(photo_times, history, rigid_body_id, clock_offset, frame_timestamps=None,
+                     camera_latency=0.0, max_gap=DEFAULT_MAX_GAP):
+    """PhotoPose list for the photos whose capture time falls inside the pose history.
+
+    history is a PoseHistory on the NatNet clock, frame_timestamps maps
+    frame numbers to NatNet timestamps for the time offsets."""
+    photo_poses = []
+    for photo_time in photo_times:
+        natnet_time = photo_time.capture_time - clock_offset - camera_latency
+        pose = history.pose_at(rigid_body_id, natnet_time, max_gap)
+        if pose is None:
+            continue
+        pos, rot = pose
+        time_offset = None
+        if frame_timestamps is not None and photo_time.frame_number in frame_timestamps:
+            time_offset = natnet_time - frame_timestamps[photo_time.frame_number]
+        position_error = None
+        rotation_error = None
+        trigger_pose = history.pose_at_frame(rigid_body_id, photo_time.frame_number)
+        if trigger_pose is not None:
+            position_error = float(np.linalg.norm(pos - trigger_pose[0]))
+            rotation_error = rotation_angle(rot, trigger_pose[1])
+        photo_poses.append(PhotoPose(photo_time.frame_number, natnet_time, pos, rot,
+                                     time_offset, position_error, rotation_error))
+    return photo_poses
+
+def error_stats(values):
+    """count, mean, p50, p90, p99 and max of the values that are not None"""
+    values = np.array([value for value in values if value is not None], dtype=np.float64)
+    if len(values) == 0:
+        return { "count" : 0 }
+    abs_values = np.abs(values)
+    return { "count" : len(values),
+             "mean"  : float(np.mean(values)),
+             "p50"   : float(np.percentile(abs_values, 50)),
+             "p90"   : float(np.percentile(abs_values, 90)),
+             "p99"   : float(np.percentile(abs_values, 99)),
+             "max"   : float(np.max(abs_values)) }
+
+def get_association_stats(photo_poses):
+    """error_stats of the time offset in ms, position error in mm and rotation error in degrees"""
+    return { "time_offset_ms"     : error_stats([None if photo_pose.time_offset is None else photo_pose.time_offset * 1000.0
+                                                 for photo_pose in photo_poses]),
+             "position_error_mm"  : error_stats([None if photo_pose.position_error is None else photo_pose.position_error * 1000.0
+                                                 for photo_pose in photo_poses]),
+             "rotation_error_deg" : error_stats([photo_pose.rotation_error for photo_pose in photo_poses]) }
+
+def format_association_stats(stats):
+    lines = []
+    for name, values in stats.items():
+        if values["count"] == 0:
+            lines.append("%-20s no samples"%name)
+        else:
+            lines.append("%-20s n=%d mean=%.3f |p50|=%.3f |p90|=%.3f |p99|=%.3f |max|=%.3f"%(
+                name, values["count"], values["mean"], values["p50"], values["p90"], values["p99"], values["max"]))
+    return "\n".join(lines)
+
+def write_photo_poses(file_name, photo_poses):
+    with open(file_name, 'w', newline='') as photo_poses_file:
+        for photo_pose in photo_poses:
+            photo_poses_file.write(PHOTO_POSES_ROW%(
+                photo_pose.frame_number, photo_pose.natnet_time, *photo_pose.pos, *photo_pose.rot,
+                np.nan if photo_pose.time_offset is None else photo_pose.time_offset * 1000.0,
+                np.nan if photo_pose.position_error is None else photo_pose.position_error * 1000.0,
+                np.nan if photo_pose.rotation_error is None else photo_pose.rotation_error))
+
+def associate_take_rows(photo_times, rows, rigid_body_id=None, camera_latency=0.0, max_gap=DEFAULT_MAX_GAP):
+    """associate_photos against NatNetTake TAKE_DTYPE rows, None if there is nothing to associate.
+
+    rigid_body_id defaults to the lowest tracked ID."""
+    clock_offset = estimate_clock_offset(photo_times)
+    if clock_offset is None or len(rows) == 0:
+        return None
+    history = NatNetPoseHistory.PoseHistory(capacity=len(rows), clock=NatNetPoseHistory.CLOCK_NATNET)
+    history.add_take_rows(rows)
+    rigid_body_ids = history.get_rigid_body_ids()
+    if not rigid_body_ids:
+        return None
+    if rigid_body_id is None:
+        rigid_body_id = min(rigid_body_ids)
+    frame_numbers, first_rows = np.unique(rows['frame_number'], return_index=True)
+    frame_timestamps = dict(zip(frame_numbers.tolist(), rows['timestamp'][first_rows].tolist()))
+    return associate_photos(photo_times, history, rigid_body_id, clock_offset, frame_timestamps,
+                            camera_latency, max_gap)
+
+def associate_take(take_dir, rigid_body_id=None, camera_latency=0.0, max_gap=DEFAULT_MAX_GAP):
+    """Associate the photos of a take and write photo_poses.txt next to them.
+
+    take_dir is a take or one camera folder of a take with several
+    cameras.  Returns the PhotoPose list, None if the take has no capture
+    times or no optitrack.nntake."""
+    take_dir = Path(take_dir)
+    camera_name = None
+    root_dir = take_dir
+    if not (take_dir / PHOTO_TIMES_FILE).exists() and (take_dir.parent / PHOTO_TIMES_FILE).exists():
+        # camera_<source> folder, the take files are one level up
+        camera_name = take_dir.name
+        root_dir = take_dir.parent
+    if not (root_dir / PHOTO_TIMES_FILE).exists() or not (root_dir / TAKE_FILE).exists():
+        return None
+    photo_times = read_photo_times(root_dir / PHOTO_TIMES_FILE, camera_name)
+    rows = NatNetTake.TakeReader(root_dir / TAKE_FILE).read_all()
+    photo_poses = associate_take_rows(photo_times, rows, rigid_body_id, camera_latency, max_gap)
+    if photo_poses is None:
+        return None
+    write_photo_poses(take_dir / PHOTO_POSES_FILE, photo_poses)
+    return photo_poses
+
+
+# test program
+
+def generate_photo_times(rows, frame_numbers, clock_offset, network_latency, exposure_delays):
+    """PhotoTime list as bm_record would write it for photos triggered on frame_numbers"""
+    timestamps = dict(zip(rows['frame_number'].tolist(), rows['timestamp'].tolist()))
+    photo_times = []
+    for frame_number, network_delay, exposure_delay in zip(frame_numbers, network_latency, exposure_delays):
+        capture_time = timestamps[frame_number] + clock_offset + exposure_delay
+        photo_times.append(PhotoTime(frame_number, "camera_0", capture_time, frame_number,
+                                     timestamps[frame_number] + clock_offset + network_delay, timestamps[frame_number]))
+    return photo_times
+
+def test_association():
+    """Photos exposed late are matched to the pose at their capture time"""
+    diffs = []
+    rows = NatNetTake.generate_take_rows(1200, 2)
+    rng = np.random.default_rng(3)
+    frame_numbers = list(range(8, 1100, 4))
+    # Frames arrive 2 to 5 ms after their timestamp, photos are exposed 10 to 30 ms after the trigger
+    network_latency = rng.uniform(0.002, 0.005, len(frame_numbers))
+    network_latency[5] = 0.0
+    exposure_delays = rng.uniform(0.010, 0.030, len(frame_numbers))
+    photo_times = generate_photo_times(rows, frame_numbers, 100.0, network_latency, exposure_delays)
+    if not np.isclose(estimate_clock_offset(photo_times), 100.0):
+        diffs.append("clock offset %f"%estimate_clock_offset(photo_times))
+    photo_poses = associate_take_rows(photo_times, rows)
+    if photo_poses is None or len(photo_poses) != len(frame_numbers):
+        return diffs + ["%s photos associated of %d"%(None if photo_poses is None else len(photo_poses), len(frame_numbers))]
+    history = NatNetPoseHistory.PoseHistory(capacity=len(rows), clock=NatNetPoseHistory.CLOCK_NATNET)
+    history.add_take_rows(rows)
+    rigid_body_id = int(np.min(rows['id']))
+    for photo_pose, photo_time, exposure_delay in zip(photo_poses, photo_times, exposure_delays):
+        expected_time = photo_time.nearest_frame_timestamp + exposure_delay
+        if abs(photo_pose.natnet_time - expected_time) > 1e-9 or abs(photo_pose.time_offset - exposure_delay) > 1e-9:
+            diffs.append("frame %d: time %f != %f"%(photo_pose.frame_number, photo_pose.natnet_time, expected_time))
+            break
+        expected_pos = history.pose_at(rigid_body_id, expected_time)[0]
+        if not np.allclose(photo_pose.pos, expected_pos):
+            diffs.append("frame %d: pos %s != %s"%(photo_pose.frame_number, str(photo_pose.pos), str(expected_pos)))
+            break
+    stats = get_association_stats(photo_poses)
+    time_offsets = stats["time_offset_ms"]
+    if time_offsets["count"] != len(frame_numbers) or not 10.0 <= time_offsets["p50"] <= 30.0 or time_offsets["max"] > 30.0:
+        diffs.append("time offset stats %s"%str(time_offsets))
+    if stats["position_error_mm"]["max"] <= 0.0:
+        diffs.append("position error stats %s"%str(stats["position_error_mm"]))
+    return diffs
+
+def test_take_files():
+    """associate_take reads a camera folder of a take and writes photo_poses.txt"""
+    import shutil
+    import tempfile
+    diffs = []
+    take_dir = Path(tempfile.mkdtemp())
+    try:
+        rows = NatNetTake.generate_take_rows(600, 1)
+        NatNetTake.write_take(take_dir / TAKE_FILE, rows, NatNetTake.DEFAULT_BLOCK_FRAMES).close()
+        frame_numbers = list(range(4, 500, 4))
+        delays = [0.004] * len(frame_numbers)
+        photo_times = generate_photo_times(rows, frame_numbers, 50.0, delays, delays)
+        with open(take_dir / PHOTO_TIMES_FILE, 'w') as photo_times_file:
+            for photo_time in photo_times:
+                for camera_name in ["camera_0", "camera_1"]:
+                    photo_times_file.write("%d %s %.6f %d %.6f %.6f\n"%(photo_time.frame_number, camera_name, photo_time.capture_time,
+                                           photo_time.nearest_frame_number, photo_time.nearest_frame_host_time, photo_time.nearest_frame_timestamp))
+        os.makedirs(take_dir / "camera_1")
+        photo_poses = associate_take(take_dir / "camera_1")
+        if photo_poses is None or len(photo_poses) != len(frame_numbers):
+            diffs.append("%s photos associated"%(None if photo_poses is None else len(photo_poses)))
+        elif not (take_dir / "camera_1" / PHOTO_POSES_FILE).exists():
+            diffs.append("no %s"%PHOTO_POSES_FILE)
+        else:
+            with open(take_dir / "camera_1" / PHOTO_POSES_FILE) as photo_poses_file:
+                lines = photo_poses_file.readlines()
+            if len(lines) != len(frame_numbers) or len(lines[0].split()) != len(PHOTO_POSES_COLUMNS.split()):
+                diffs.append("%d lines, %s"%(len(lines), lines[0]))
+        if associate_take(take_dir / "missing") is not None:
+            diffs.append("take without photo times associated")
+    finally:
+        shutil.rmtree(take_dir)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Photo Association", test_association, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Photo Association Take Files", test_take_files, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
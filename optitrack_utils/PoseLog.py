@@ -0,0 +1,280 @@
+# Streaming rigid body pose log for Python 3.x
+#
+# PoseLogWriter takes poses from the NatNet listeners and writes them on a
+# background thread in batches, as text lines or as a NatNetTake file, so
+# a recording holds at most max_pending_rows poses in memory and loses at
+# most the last unsynced batch if the process dies.  The fsync policy
+# decides how often written batches are forced to disk:
+#   FSYNC_NEVER     leave it to the operating system
+#   FSYNC_BATCH     after every batch
+#   FSYNC_INTERVAL  at most every fsync_interval seconds
+# close always syncs.
+
+import os
+import time
+from threading import Condition, Thread
+from . import NatNetTake
+
+# Log formats
+# FORMAT_TEXT writes one line per pose, TEXT_COLUMNS
+FORMAT_TEXT = "text"
+# FORMAT_TAKE writes a NatNetTake file, one block per batch
+FORMAT_TAKE = "take"
+LOG_FORMATS = [FORMAT_TEXT, FORMAT_TAKE]
+
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+FSYNC_POLICIES = [FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL]
+
+# Frame number and pose first, as bm_localize reads optitrack_untimed.txt
+TEXT_COLUMNS = "frame_number x y z qx qy qz qw id timestamp"
+TEXT_ROW = "%d %.9g %.9g %.9g %.9g %.9g %.9g %.9g %d %.6f\n"
+
+DEFAULT_BATCH_ROWS = 1024
+# seconds a pose waits at most before it is written
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_FSYNC_INTERVAL = 2.0
+DEFAULT_MAX_PENDING_ROWS = 65536
+
+
+class PoseLogWriter:
+    """Writes ( frame number, timestamp, rigid body ID, position, orientation ) rows in the background.
+
+    add never blocks on the disk.  If the writer falls more than
+    max_pending_rows behind, new poses are dropped and counted."""
+    def __init__(self, file_name, log_format=FORMAT_TEXT, fsync_policy=FSYNC_INTERVAL,
+                 batch_rows=DEFAULT_BATCH_ROWS, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, max_pending_rows=DEFAULT_MAX_PENDING_ROWS,
+                 nat_net_version=(0,0,0,0)):
+        if log_format not in LOG_FORMATS:
+            raise ValueError("Unknown log format %s, valid formats are %s"%(log_format, ", ".join(LOG_FORMATS)))
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy %s, valid policies are %s"%(fsync_policy, ", ".join(FSYNC_POLICIES)))
+        self.log_format = log_format
+        self.fsync_policy = fsync_policy
+        self.batch_rows = max(batch_rows, 1)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_pending_rows = max(max_pending_rows, self.batch_rows)
+        if log_format == FORMAT_TAKE:
+            self.take_writer = NatNetTake.TakeWriter(file_name, nat_net_version)
+            self.file = None
+        else:
+            self.take_writer = None
+            self.file = open(file_name, 'w', newline='')
+        self.condition = Condition()
+        self.pending = []
+        self.closed = False
+        self.flush_requested = False
+        self.last_sync_time = time.monotonic()
+        # Counters, see get_counters
+        self.added = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.syncs = 0
+        self.thread = Thread( target = self.__writer_thread_function, name = "Pose Log Writer", daemon = True )
+        self.thread.start()
+
+    def add(self, frame_number, timestamp, rigid_body_id, pos, rot, params=0x01):
+        """Queue the pose of one rigid body, False if it was dropped"""
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.pending) >= self.max_pending_rows:
+                self.dropped += 1
+                return False
+            self.pending.append((frame_number, timestamp, rigid_body_id, params, pos, rot))
+            self.added += 1
+            if len(self.pending) == self.batch_rows:
+                self.condition.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """Wait until every pose added so far is written and synced, False on timeout"""
+        with self.condition:
+            target = self.added
+            self.flush_requested = True
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.written >= target and not self.flush_requested, timeout)
+
+    def get_counters(self):
+        """added: poses queued
+        written: poses written to the file
+        dropped: poses lost to a writer too far behind
+        batches: writes done
+        syncs: fsync calls
+        pending: poses waiting to be written"""
+        with self.condition:
+            return { "added"   : self.added,
+                     "written" : self.written,
+                     "dropped" : self.dropped,
+                     "batches" : self.batches,
+                     "syncs"   : self.syncs,
+                     "pending" : len(self.pending) }
+
+    def close(self):
+        """Write the queued poses, sync and close the file"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        if self.take_writer is not None:
+            self.take_writer.close()
+        else:
+            self.file.close()
+
+    def __writer_thread_function(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.flush_requested or
+                                        len(self.pending) >= self.batch_rows, self.flush_interval)
+                rows = self.pending
+                self.pending = []
+                closing = self.closed
+                flush_requested = self.flush_requested
+            if rows:
+                self.__write_rows(rows)
+            now = time.monotonic()
+            sync = closing or flush_requested or \
+                   (rows and self.fsync_policy == FSYNC_BATCH) or \
+                   (self.fsync_policy == FSYNC_INTERVAL and now - self.last_sync_time >= self.fsync_interval)
+            if rows or sync:
+                self.__flush_file(sync)
+            with self.condition:
+                self.written += len(rows)
+                if rows:
+                    self.batches += 1
+                if sync:
+                    self.syncs += 1
+                    self.last_sync_time = now
+                if flush_requested:
+                    self.flush_requested = False
+                self.condition.notify_all()
+                if closing and not self.pending:
+                    return
+
+    def __write_rows(self, rows):
+        if self.take_writer is not None:
+            for frame_number, timestamp, rigid_body_id, params, pos, rot in rows:
+                self.take_writer.add(frame_number, timestamp, rigid_body_id, pos, rot, params)
+        else:
+            self.file.write(''.join([TEXT_ROW%(frame_number, *pos, *rot, rigid_body_id, timestamp)
+                                     for frame_number, timestamp, rigid_body_id, params, pos, rot in rows]))
+
+    def __flush_file(self, sync):
+        if self.take_writer is not None:
+            # Every batch becomes a block, readable even if the take is never closed
+            self.take_writer.flush(sync)
+        else:
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+
+def read_text_log(file_name):
+    """List of ( frame number, timestamp, rigid body ID, position, orientation ) from a FORMAT_TEXT log"""
+    rows = []
+    with open(file_name) as log_file:
+        for line in log_file:
+            fields = line.split()
+            if len(fields) < 10:
+                # The last line of a log that was cut short
+                continue
+            rows.append((int(fields[0]), float(fields[9]), int(fields[8]),
+                         tuple(map(float, fields[1:4])), tuple(map(float, fields[4:8]))))
+    return rows
+
+
+# test program
+
+def test_text_log():
+    """Poses are on disk after flush, before the log is closed"""
+    import tempfile
+    handle, file_name = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = PoseLogWriter(file_name, FORMAT_TEXT, FSYNC_BATCH, batch_rows=16)
+        poses = [(frame_num, 10.0 + frame_num / 240.0, rigid_body_id, (frame_num * 0.001, 1.5, -0.25), (0.0, 0.0, 0.0, 1.0))
+                 for frame_num in range(100) for rigid_body_id in [1, 2]]
+        for pose in poses:
+            writer.add(*pose)
+        if not writer.flush(1.0):
+            diffs.append("flush timed out")
+        rows = read_text_log(file_name)
+        if len(rows) != len(poses):
+            diffs.append("%d rows before close != %d"%(len(rows), len(poses)))
+        for row, pose in zip(rows, poses):
+            if (row[0], row[2]) != (pose[0], pose[2]) or abs(row[1] - pose[1]) > 1e-6 or max(abs(a - b) for a, b in zip(row[3] + row[4], pose[3] + pose[4])) > 1e-7:
+                diffs.append("row %s != %s"%(str(row), str(pose)))
+                break
+        counters = writer.get_counters()
+        writer.close()
+        if counters["written"] != len(poses) or counters["syncs"] < 1:
+            diffs.append("counters %s"%str(counters))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_take_log():
+    """A take log that was never closed reads back every flushed batch"""
+    import tempfile
+    import numpy as np
+    handle, file_name = tempfile.mkstemp(suffix='.nntake')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = PoseLogWriter(file_name, FORMAT_TAKE, FSYNC_NEVER, batch_rows=64)
+        for frame_num in range(200):
+            writer.add(frame_num, frame_num / 240.0, 7, (0.1, 0.2, 0.3), (0.0, 0.0, 0.0, 1.0))
+        writer.flush(1.0)
+        rows = NatNetTake.TakeReader(file_name).read_all()
+        if not np.array_equal(rows['frame_number'], np.arange(200)) or not np.all(rows['id'] == 7):
+            diffs.append("%d rows before close"%len(rows))
+        writer.close()
+        if len(NatNetTake.TakeReader(file_name).read_all()) != 200:
+            diffs.append("rows after close")
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_bounded_memory():
+    """A writer that cannot keep up drops new poses instead of growing"""
+    import tempfile
+    handle, file_name = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    diffs = []
+    try:
+        writer = PoseLogWriter(file_name, FORMAT_TEXT, FSYNC_NEVER, batch_rows=8, max_pending_rows=8)
+        # Hold the writer thread off the queue
+        with writer.condition:
+            results = [writer.add(frame_num, 0.0, 1, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)) for frame_num in range(20)]
+            pending = len(writer.pending)
+        writer.close()
+        counters = writer.get_counters()
+        if pending != 8 or results.count(False) != 12 or counters["dropped"] != 12 or counters["written"] != 8:
+            diffs.append("pending %d, counters %s"%(pending, str(counters)))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Pose Log Text", test_text_log, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose Log Take", test_take_log, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Pose Log Bounded Memory", test_bounded_memory, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)
@@ -0,0 +1,357 @@
+# Recording rate policy for Python 3.x
+#
+# Decides which NatNet frames a recorder keeps a pose for and which
+# trigger a photo.  Frames are picked by their NatNet timestamp, not their
+# frame number, so the rates hold whatever Motive streams at and across
+# dropped frames: time is cut into slots of 1 / rate seconds and the first
+# frame of each slot is kept.
+#
+# The photo rate also backs off when the photo writers fall behind.  update
+# is given the write queue fill, photos dropped so far and the camera
+# trigger backlog; at most every adjust_interval seconds it
+#   reduces  the photo rate by backoff_factor, down to min_photo_rate, when
+#            the queue is above high_water, photos were dropped or a camera
+#            has triggers waiting for an image,
+#   restores it by recover_factor, up to the target, once the queue stayed
+#            below low_water for recover_checks updates in a row.
+# Every rate decision is kept in order and written to the log file, with
+# the numbers it was based on.
+
+import time
+from threading import Lock
+
+# Rates in Hz, None keeps every frame
+# 60 Hz is every fourth frame at Motive's default 240 Hz
+DEFAULT_POSE_RATE = 60.0
+DEFAULT_PHOTO_RATE = 60.0
+DEFAULT_MIN_PHOTO_RATE = 5.0
+
+# Write queue fill, 0 to 1, above which the photo rate is reduced and
+# below which it may be restored
+DEFAULT_HIGH_WATER = 0.75
+DEFAULT_LOW_WATER = 0.25
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_RECOVER_FACTOR = 1.25
+# seconds between rate adjustments
+DEFAULT_ADJUST_INTERVAL = 1.0
+DEFAULT_RECOVER_CHECKS = 3
+
+# Frames this close to a slot boundary, in seconds, count as inside it
+TIME_EPSILON = 1e-6
+
+# Decision events
+EVENT_START = "start"
+EVENT_REDUCE = "reduce"
+EVENT_RESTORE = "restore"
+EVENT_STOP = "stop"
+
+LOG_ROW = "%.6f %s pose_rate=%s photo_rate=%s queue_fill=%.2f dropped=%d camera_backlog=%d %s\n"
+
+
+def format_rate(rate):
+    return "all" if rate is None else "%.3g"%rate
+
+
+class RateDecimator:
+    """Keeps the first frame of every 1 / rate second slot, every frame if rate is None"""
+    def __init__(self, rate=None):
+        self.rate = None
+        self.origin = None
+        self.last_slot = 0
+        self.last_kept = None
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Change the rate, slots start over at the last frame kept"""
+        if rate is not None and rate <= 0.0:
+            raise ValueError("Rate must be positive or None, not %s"%str(rate))
+        self.rate = rate
+        if self.last_kept is not None:
+            self.origin = self.last_kept
+            self.last_slot = 0
+
+    def keep(self, timestamp):
+        """True if the frame at timestamp is kept"""
+        if self.rate is None:
+            self.last_kept = timestamp
+            return True
+        if self.origin is None or timestamp < self.origin:
+            # First frame, or the clock restarted
+            self.origin = timestamp
+            self.last_slot = 0
+            self.last_kept = timestamp
+            return True
+        slot = int((timestamp - self.origin + TIME_EPSILON) * self.rate)
+        if slot <= self.last_slot:
+            return False
+        self.last_slot = slot
+        self.last_kept = timestamp
+        return True
+
+
+class RatePolicy:
+    """Pose and photo decimation with photo backpressure.
+
+    keep_pose and keep_photo are called for every frame, update with the
+    writer state as often as convenient.  Not thread safe on its own, call
+    it under the recorder lock; get_counters and get_decisions may be
+    called from any thread."""
+    def __init__(self, pose_rate=DEFAULT_POSE_RATE, photo_rate=DEFAULT_PHOTO_RATE,
+                 min_photo_rate=DEFAULT_MIN_PHOTO_RATE, high_water=DEFAULT_HIGH_WATER,
+                 low_water=DEFAULT_LOW_WATER, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 recover_factor=DEFAULT_RECOVER_FACTOR, adjust_interval=DEFAULT_ADJUST_INTERVAL,
+                 recover_checks=DEFAULT_RECOVER_CHECKS, log_file_name=None, clock=time.monotonic):
+        if not 0.0 <= low_water < high_water <= 1.0:
+            raise ValueError("Need 0 <= low_water < high_water <= 1, not %s, %s"%(str(low_water), str(high_water)))
+        if photo_rate is not None and min_photo_rate > photo_rate:
+            min_photo_rate = photo_rate
+        self.pose_decimator = RateDecimator(pose_rate)
+        self.photo_decimator = RateDecimator(photo_rate)
+        self.target_photo_rate = photo_rate
+        self.min_photo_rate = min_photo_rate
+        self.high_water = high_water
+        self.low_water = low_water
+        self.backoff_factor = backoff_factor
+        self.recover_factor = recover_factor
+        self.adjust_interval = adjust_interval
+        self.recover_checks = max(recover_checks, 1)
+        self.clock = clock
+        self.lock = Lock()
+        self.last_adjust_time = None
+        self.last_dropped = 0
+        self.calm_checks = 0
+        # ( host time, event, pose rate, photo rate, queue fill, dropped, camera backlog, reason )
+        self.decisions = []
+        self.log_file = open(log_file_name, 'w', newline='') if log_file_name is not None else None
+        self.closed = False
+        # Counters, see get_counters
+        self.poses_kept = 0
+        self.poses_skipped = 0
+        self.photos_kept = 0
+        self.photos_skipped = 0
+        self.reductions = 0
+        self.restores = 0
+        self.__decide(EVENT_START, 0.0, 0, 0, "target photo rate %s, minimum %s"%(
+            format_rate(photo_rate), format_rate(self.min_photo_rate)))
+
+    def keep_pose(self, timestamp):
+        """True if the poses of the frame at this NatNet timestamp are recorded"""
+        kept = self.pose_decimator.keep(timestamp)
+        with self.lock:
+            if kept:
+                self.poses_kept += 1
+            else:
+                self.poses_skipped += 1
+        return kept
+
+    def keep_photo(self, timestamp):
+        """True if the frame at this NatNet timestamp triggers a photo"""
+        kept = self.photo_decimator.keep(timestamp)
+        with self.lock:
+            if kept:
+                self.photos_kept += 1
+            else:
+                self.photos_skipped += 1
+        return kept
+
+    def get_photo_rate(self):
+        return self.photo_decimator.rate
+
+    def get_pose_rate(self):
+        return self.pose_decimator.rate
+
+    def update(self, queue_fill, dropped, camera_backlog=0):
+        """Adjust the photo rate to the photo writers, returns the event if it changed.
+
+        queue_fill is the write queue use from 0 to 1, dropped the photos
+        dropped since recording started and camera_backlog the most
+        triggers any camera has waiting."""
+        now = self.clock()
+        if self.last_adjust_time is not None and now - self.last_adjust_time < self.adjust_interval:
+            return None
+        self.last_adjust_time = now
+        new_drops = dropped - self.last_dropped
+        self.last_dropped = dropped
+        photo_rate = self.photo_decimator.rate
+        if photo_rate is None:
+            # Every frame has a photo, there is nothing to reduce against
+            return None
+        reasons = []
+        if queue_fill >= self.high_water:
+            reasons.append("queue above %.2f"%self.high_water)
+        if new_drops > 0:
+            reasons.append("%d photos dropped"%new_drops)
+        if camera_backlog > 1:
+            reasons.append("camera %d triggers behind"%camera_backlog)
+        if reasons:
+            self.calm_checks = 0
+            if photo_rate <= self.min_photo_rate:
+                return None
+            self.photo_decimator.set_rate(max(photo_rate * self.backoff_factor, self.min_photo_rate))
+            with self.lock:
+                self.reductions += 1
+            self.__decide(EVENT_REDUCE, queue_fill, new_drops, camera_backlog, ", ".join(reasons))
+            return EVENT_REDUCE
+        if queue_fill > self.low_water:
+            self.calm_checks = 0
+            return None
+        self.calm_checks += 1
+        if photo_rate >= self.target_photo_rate or self.calm_checks < self.recover_checks:
+            return None
+        self.calm_checks = 0
+        self.photo_decimator.set_rate(min(photo_rate * self.recover_factor, self.target_photo_rate))
+        with self.lock:
+            self.restores += 1
+        self.__decide(EVENT_RESTORE, queue_fill, new_drops, camera_backlog,
+                      "queue below %.2f for %d checks"%(self.low_water, self.recover_checks))
+        return EVENT_RESTORE
+
+    def get_decisions(self):
+        with self.lock:
+            return list(self.decisions)
+
+    def get_counters(self):
+        """poses_kept: frames whose poses were recorded
+        poses_skipped: frames decimated away from the pose log
+        photos_kept: frames that triggered a photo
+        photos_skipped: frames that did not
+        reductions: photo rate reductions
+        restores: photo rate increases back towards the target
+        photo_rate: current photo rate, None for every frame"""
+        with self.lock:
+            return { "poses_kept"     : self.poses_kept,
+                     "poses_skipped"  : self.poses_skipped,
+                     "photos_kept"    : self.photos_kept,
+                     "photos_skipped" : self.photos_skipped,
+                     "reductions"     : self.reductions,
+                     "restores"       : self.restores,
+                     "photo_rate"     : self.photo_decimator.rate }
+
+    def close(self):
+        """Log the final counters and close the log file"""
+        if self.closed:
+            return
+        self.closed = True
+        counters = self.get_counters()
+        self.__decide(EVENT_STOP, 0.0, 0, 0, "%d photos kept, %d skipped, %d reductions, %d restores"%(
+            counters["photos_kept"], counters["photos_skipped"], counters["reductions"], counters["restores"]))
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def __decide(self, event, queue_fill, dropped, camera_backlog, reason):
+        decision = (self.clock(), event, self.pose_decimator.rate, self.photo_decimator.rate,
+                    queue_fill, dropped, camera_backlog, reason)
+        with self.lock:
+            self.decisions.append(decision)
+        line = LOG_ROW%(decision[0], event, format_rate(decision[2]), format_rate(decision[3]),
+                        queue_fill, dropped, camera_backlog, reason)
+        if self.log_file is not None:
+            self.log_file.write(line)
+            self.log_file.flush()
+        if event in (EVENT_REDUCE, EVENT_RESTORE):
+            print("Rate policy: " + line.rstrip())
+
+
+# test program
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_decimation():
+    """60 Hz out of 240 Hz keeps every fourth frame, also with jitter and dropped frames"""
+    diffs = []
+    import numpy as np
+    decimator = RateDecimator(60.0)
+    kept = [frame_num for frame_num in range(240) if decimator.keep(100.0 + frame_num / 240.0)]
+    if kept != list(range(0, 240, 4)):
+        diffs.append("kept %s"%str(kept[:12]))
+    random = np.random.default_rng(5)
+    decimator = RateDecimator(60.0)
+    frame_nums = [frame_num for frame_num in range(2400) if frame_num % 7 != 3]
+    times = [frame_num / 240.0 + random.uniform(-1e-4, 1e-4) for frame_num in frame_nums]
+    kept_times = [t for t in times if decimator.keep(t)]
+    if not 590 <= len(kept_times) <= 601:
+        diffs.append("%d of 600 kept with jitter and drops"%len(kept_times))
+    if max(np.diff(kept_times)) > 2.5 / 60.0:
+        diffs.append("gap of %f s"%max(np.diff(kept_times)))
+    decimator = RateDecimator(None)
+    if not all(decimator.keep(frame_num / 240.0) for frame_num in range(10)):
+        diffs.append("rate None skipped frames")
+    return diffs
+
+def test_backpressure():
+    """A full queue halves the photo rate down to the minimum, a calm one restores it, every change is logged"""
+    diffs = []
+    clock = FakeClock()
+    policy = RatePolicy(60.0, 60.0, min_photo_rate=10.0, adjust_interval=1.0, recover_checks=2, clock=clock)
+    rates = []
+    for queue_fill, dropped in [(0.9, 0), (0.9, 0), (0.2, 5), (0.5, 5), (0.1, 5), (0.1, 5), (0.1, 5), (0.1, 5), (0.1, 5), (0.1, 5)]:
+        clock.now += 1.0
+        policy.update(queue_fill, dropped)
+        # Too soon, ignored
+        policy.update(1.0, dropped + 100)
+        rates.append(policy.get_photo_rate())
+    expected = [30.0, 15.0, 10.0, 10.0, 10.0, 12.5, 12.5, 15.625, 15.625, 19.53125]
+    if not all(abs(a - b) < 1e-9 for a, b in zip(rates, expected)):
+        diffs.append("rates %s != %s"%(str(rates), str(expected)))
+    clock.now += 1.0
+    policy.update(0.0, 5, camera_backlog=3)
+    policy.close()
+    events = [decision[1] for decision in policy.get_decisions()]
+    expected_events = [EVENT_START, EVENT_REDUCE, EVENT_REDUCE, EVENT_REDUCE, EVENT_RESTORE, EVENT_RESTORE, EVENT_RESTORE, EVENT_REDUCE, EVENT_STOP]
+    if events != expected_events:
+        diffs.append("events %s"%str(events))
+    counters = policy.get_counters()
+    if counters["reductions"] != 4 or counters["restores"] != 3:
+        diffs.append("counters %s"%str(counters))
+    return diffs
+
+def test_log_file():
+    """Decisions are in the log file as they are made"""
+    import os
+    import tempfile
+    handle, file_name = tempfile.mkstemp(suffix='.log')
+    os.close(handle)
+    diffs = []
+    try:
+        clock = FakeClock()
+        policy = RatePolicy(None, 60.0, clock=clock, log_file_name=file_name)
+        clock.now += 5.0
+        policy.update(1.0, 0)
+        with open(file_name) as log_file:
+            lines = log_file.readlines()
+        if len(lines) != 2 or lines[1].split()[1] != EVENT_REDUCE or "photo_rate=30" not in lines[1]:
+            diffs.append("log before close %s"%str(lines))
+        frame_times = [frame_num / 240.0 for frame_num in range(240)]
+        poses = sum(policy.keep_pose(t) for t in frame_times)
+        photos = sum(policy.keep_photo(t) for t in frame_times)
+        policy.close()
+        with open(file_name) as log_file:
+            lines = log_file.readlines()
+        if poses != 240 or photos != 30 or lines[-1].split()[1] != EVENT_STOP:
+            diffs.append("%d poses, %d photos, %s"%(poses, photos, lines[-1]))
+    finally:
+        os.remove(file_name)
+    return diffs
+
+def test_all(run_test=True):
+    from . import NatNetDecoder
+    totals=[0,0,0]
+    totals = NatNetDecoder.run_test_case("Test Rate Policy Decimation", test_decimation, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Rate Policy Backpressure", test_backpressure, run_test, totals)
+    totals = NatNetDecoder.run_test_case("Test Rate Policy Log File", test_log_file, run_test, totals)
+
+    print("--------------------")
+    print("[PASS] Count = %3.1d"%totals[0])
+    print("[FAIL] Count = %3.1d"%totals[1])
+    print("[SKIP] Count = %3.1d"%totals[2])
+
+    return totals
+
+if __name__ == "__main__":
+    test_all(True)